@@ -0,0 +1,236 @@
+"""Режим на asyncio: те же маршруты, что у Flask-приложения, на одном event loop.
+
+    python aio_app.py                    # или SERVER_MODE=aio python run.py
+    gunicorn aio_app:make_app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:$PORT
+
+Логика мастера общая с app.py (process_update и всё, что ниже). Здесь другой
+транспорт: aiohttp-сервер, исходящие вызовы Bot API через aiohttp-клиент с
+порядком внутри чата, а поход в БД — через async-драйвер (db.get_async_engine).
+Обработка апдейта идёт прямо в loop, если всё нужное лежит в памяти (каталог,
+SESSION_BACKEND=memory, локальный dedup); иначе — в потоках app.updates
+(очередь на чат, как во Flask-режиме), чтобы блокирующие вызовы хранилищ не
+останавливали loop.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, NamedTuple
+
+import aiohttp
+from aiohttp import web
+
+import app as wsgi
+import service
+from catalog import catalog
+from service import card_json, filters_from_params
+from session_store import MemorySessionStore
+from metrics import registry, BOT_API_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+AIO_HANDLER_THREADS = int(os.getenv("AIO_HANDLER_THREADS", "8"))
+AIO_HTTP_CONNECTIONS = int(os.getenv("AIO_HTTP_CONNECTIONS", "100"))   # одновременных соединений к Bot API
+
+service.ASYNC_DB = os.getenv("ASYNC_DB", "1") == "1"
+
+
+class _Resp(NamedTuple):
+    status_code: int
+    text: str
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class _SyncBridge:
+    """Синхронный .call() для цепочек вроде _deliver_media_group, которые идут в потоке, а HTTP — в loop."""
+
+    def __init__(self, dispatcher: "AioOutboundDispatcher"):
+        self.dispatcher = dispatcher
+
+    def call(self, method: str, payload: Dict[str, Any], timeout: float) -> Optional[_Resp]:
+        fut = asyncio.run_coroutine_threadsafe(self.dispatcher.call(method, payload, timeout), self.dispatcher.loop)
+        return fut.result()
+
+
+class AioOutboundDispatcher:
+    """Та же роль, что у dispatch.OutboundDispatcher: порядок внутри чата, параллельно между чатами.
+
+    Вызовы одного чата выстраиваются в цепочку задач; send() можно звать и из
+    loop, и из потоков обработчика.
+    """
+
+    def __init__(self, api_base: str, session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop,
+                 executor: ThreadPoolExecutor):
+        self.api_base = api_base
+        self.session = session
+        self.loop = loop
+        self.executor = executor
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def send(self, chat_id: int, method: str, payload: Dict[str, Any], timeout: float = 15):
+        return self._submit(chat_id, lambda: self.call(method, payload, timeout))
+
+    def run(self, chat_id: int, fn: Callable, *args):
+        return self._submit(chat_id, lambda: self.loop.run_in_executor(self.executor, fn, _SyncBridge(self), *args))
+
+    async def join(self):
+        while self._tails:
+            await asyncio.gather(*list(self._tails.values()), return_exceptions=True)
+
+    def _submit(self, chat_id: int, make_step: Callable):
+        if _on_loop(self.loop):
+            return self._chain(chat_id, make_step)
+        self.loop.call_soon_threadsafe(self._chain, chat_id, make_step)
+        return None
+
+    def _chain(self, chat_id: int, make_step: Callable) -> asyncio.Task:
+        prev = self._tails.get(chat_id)
+
+        async def step():
+            if prev is not None:
+                await asyncio.wait([prev])
+            return await make_step()
+
+        task = self.loop.create_task(step())
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._done(chat_id, t))
+        return task
+
+    def _done(self, chat_id: int, task: asyncio.Task):
+        if self._tails.get(chat_id) is task:
+            self._tails.pop(chat_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("outbound step for chat %s failed", chat_id, exc_info=task.exception())
+
+    async def call(self, method: str, payload: Dict[str, Any], timeout: float = 15) -> Optional[_Resp]:
+        started = time.perf_counter()
+        try:
+            async with self.session.post(f"{self.api_base}/{method}", json=payload,
+                                         timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                resp = _Resp(r.status, await r.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            BOT_API_SECONDS.labels(method, "error").observe(time.perf_counter() - started)
+            logger.error("%s failed | %s", method, e)
+            return None
+        BOT_API_SECONDS.labels(method, resp.status_code).observe(time.perf_counter() - started)
+        if resp.status_code != 200:
+            logger.error("%s %s | %s", method, resp.status_code, resp.text)
+        return resp
+
+
+def _on_loop(loop: asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def _handles_in_memory() -> bool:
+    """Можно ли обработать апдейт прямо в loop — без блокирующих походов в БД/Redis."""
+    return (catalog.snapshot() is not None
+            and isinstance(wsgi.sessions, MemorySessionStore)
+            and wsgi.dedup.shared is None)
+
+
+def _json(data: Any, status: int = 200) -> web.Response:
+    return web.Response(text=json.dumps(data, ensure_ascii=False), content_type="application/json", status=status)
+
+
+# ----------------- МАРШРУТЫ -----------------
+async def index(request: web.Request):
+    return web.Response(text="Сервис tg_miniapp работает! 🔥 Используйте /recommend или Telegram-бота.")
+
+async def recommend(request: web.Request):
+    filters = filters_from_params(request.query)
+    try:
+        selected = await service.asample_rows(filters, 3)
+    except Exception:
+        logger.exception("[API] ERROR executing query")
+        return _json({"message": "Ошибка запроса к БД"}, status=500)
+    if not selected:
+        return _json({"message": "Ничего не нашлось"})
+    return _json([card_json(item, filters) for item in selected])
+
+async def facets(request: web.Request):
+    category = request.query.get("category")
+    if category and category not in wsgi.category_options_map:
+        return _json({"message": f"Неизвестная категория {category}"}, status=400)
+    data = service.facets_json(request.query, wsgi.category_options_map, [category] if category else None)
+    if data is None:
+        return _json({"message": "Каталог ещё загружается"}, status=503)
+    return _json(data)
+
+def _in_memory_route(view: Callable[[], Any]):
+    """Маршрут, который считается только по срезу каталога в памяти, — тот же обработчик, что во Flask."""
+    async def handler(request: web.Request):
+        with wsgi.app.test_request_context(query_string=request.query_string):
+            resp = view()
+        return web.Response(body=resp.get_data(), content_type="application/json", status=resp.status_code)
+    return handler
+
+async def stats(request: web.Request):
+    with wsgi.app.test_request_context():
+        return web.Response(body=wsgi.stats().get_data(), content_type="application/json")
+
+async def metrics(request: web.Request):
+    return web.Response(text=registry.expose(), content_type="text/plain", charset="utf-8")
+
+async def telegram_webhook(request: web.Request):
+    if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != wsgi.WEBHOOK_SECRET:
+        logger.warning("Wrong secret header")
+        return web.Response(text="forbidden", status=403)
+    try:
+        update = await request.json()
+    except ValueError:
+        update = {}
+
+    update = update or {}
+    if _handles_in_memory():
+        wsgi.process_update(update)   # в loop апдейты и так идут по одному
+        return web.Response(text="ok")
+    # иначе — в очередь своего чата (wsgi.updates); ждать места в очереди можно только вне loop
+    accepted = await asyncio.get_running_loop().run_in_executor(
+        request.app["executor"], wsgi.updates.dispatch, wsgi.update_chat_id(update), update)
+    return web.Response(text="ok" if accepted else "busy", status=200 if accepted else 503)
+
+
+# ----------------- ПРИЛОЖЕНИЕ -----------------
+async def _on_startup(aio: web.Application):
+    connector = aiohttp.TCPConnector(limit=AIO_HTTP_CONNECTIONS, keepalive_timeout=60)
+    aio["http"] = aiohttp.ClientSession(connector=connector)
+    # все tg_* из app.py теперь уходят через aiohttp в этом loop
+    wsgi.outbound = AioOutboundDispatcher(wsgi.TG_API, aio["http"], asyncio.get_running_loop(), aio["executor"])
+    logger.info("[AIO] started, handler threads=%s", AIO_HANDLER_THREADS)
+
+async def _on_cleanup(aio: web.Application):
+    await asyncio.get_running_loop().run_in_executor(aio["executor"], wsgi.updates.join)
+    await wsgi.outbound.join()
+    await aio["http"].close()
+    aio["executor"].shutdown(wait=False)
+
+def make_app() -> web.Application:
+    aio = web.Application()
+    aio["executor"] = ThreadPoolExecutor(max_workers=AIO_HANDLER_THREADS, thread_name_prefix="aio-handler")
+    aio.router.add_get("/", index)
+    aio.router.add_get("/recommend", recommend)
+    aio.router.add_get("/facets", facets)
+    aio.router.add_get("/nearby", _in_memory_route(wsgi.nearby))
+    aio.router.add_get("/search", _in_memory_route(wsgi.search))
+    aio.router.add_get("/stats", stats)
+    aio.router.add_get("/metrics", metrics)
+    aio.router.add_post(f"/webhook/{wsgi.WEBHOOK_SECRET}", telegram_webhook)
+    aio.on_startup.append(_on_startup)
+    aio.on_cleanup.append(_on_cleanup)
+    return aio
+
+def main():
+    web.run_app(make_app(), host="0.0.0.0", port=wsgi.PORT, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,30 @@
 import os
+import re
 import json
-import ast
-import random
 import logging
 from typing import Dict, Any, List, Optional
 
 from flask import Flask, request, Response
 from flask_cors import CORS
-from sqlalchemy import text
+import service
+from catalog import catalog
+from session_store import make_session_store
+from dedup import make_deduplicator
+from result_cache import result_cache, ResultCache
+from callbacks import CallbackCodec, SELECT, PAGE, RESTART, MORE
+from photo_cache import make_photo_cache, largest_file_id, result_messages
+from photo_health import make_photo_health
+from statements import statements
+from geo import find_station, format_distance
+from resolver import make_resolvers
+from service import sample_rows, format_card, card_json, filters_from_params
 from db import engine
+from metrics import registry, WEBHOOK_SECONDS, UPDATES_TOTAL
+from logs import setup_logging, LazyJSON, DroppingQueueHandler
 
 # ----------------- ЛОГИ -----------------
-logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO"),
-    format="%(asctime)s [APP] %(levelname)s: %(message)s",
-)
+# очередь + фоновый поток, JSON, выборка по категориям (см. logs.py: LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE)
+setup_logging("APP")
 logger = logging.getLogger(__name__)
 
 # ----------------- КОНФИГ -----------------
@@ -25,9 +35,16 @@ PORT = int(os.getenv("PORT", "8080"))
 if not TELEGRAM_TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN is not set")
 
-# Telegram API (используем requests, библиотека PTB не нужна)
-import requests as rq
-TG_API = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
+# Telegram API (используем requests, библиотека PTB не нужна).
+# Все вызовы уходят через очередь: вебхук отвечает 200 сразу, а порядок сообщений в чате сохраняется.
+from dispatch import BotApi, OutboundDispatcher, UpdateDispatcher
+TG_API_BASE = os.getenv("TG_API_BASE", "https://api.telegram.org")   # свой Bot API сервер или заглушка в бенчмарках
+TG_API = f"{TG_API_BASE}/bot{TELEGRAM_TOKEN}"
+TG_MEDIA_GROUP = os.getenv("TG_MEDIA_GROUP", "1") == "1"   # карточки одним альбомом вместо sendPhoto на каждую
+# hide — варианты без совпадений не показываются, у остальных число мест; count — только число; off — как раньше
+KEYBOARD_FACETS = os.getenv("KEYBOARD_FACETS", "hide")
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "4096"))
+outbound = OutboundDispatcher(BotApi(TG_API))
 
 # ----------------- ОПЦИИ (если есть файл options.py — используем его) -----------------
 try:
@@ -58,14 +75,6 @@ category_options_map = {
     "reason": reason_options,
 }
 
-# Маппинг в названия колонок БД
-column_map = {
-    "Бюджет": "Бюджет",
-    "Тип заведения": "Тип заведения",
-    "Кухня": "Кухня",
-    "Атмосфера": "атмосфера",  # в БД с маленькой
-    "Повод": "повод",          # в БД с маленькой
-}
 # ключ из кнопок -> «человеческое» имя для колонок
 key2human = {
     "budget": "Бюджет",
@@ -75,36 +84,97 @@ key2human = {
     "reason": "Повод",
 }
 
-# ----------------- СОСТОЯНИЕ (в памяти процесса) -----------------
-# ВАЖНО: на Railway запускай gunicorn с ОДНИМ воркером, чтобы состояние не терялось.
-user_state: Dict[int, Dict[str, Any]] = {}   # {user_id: {"budget": ..., "type": ..., "page_map": {"budget": 0, ...}}}
+# текст -> вариант списка (регистр, падежи, синонимы, опечатки); см. resolver.py
+resolvers = make_resolvers(category_options_map)
+
+# callback_data кнопок: `1s27` вместо `cuisine:Итальянская кухня` (см. callbacks.py)
+callbacks = CallbackCodec(category_order, category_options_map)
+
+# ----------------- СОСТОЯНИЕ -----------------
+# {chat_id: {"budget": ..., "type": ..., "page_map": {"budget": 0, ...}}}
+# SESSION_BACKEND=memory — dict в памяти процесса, тогда gunicorn нужен с ОДНИМ воркером.
+# SESSION_BACKEND=sql | redis — состояние общее, воркеров (WEB_CONCURRENCY) и нод может быть сколько угодно.
+sessions = make_session_store()
+
+# file_id уже загруженных фото (PHOTO_CACHE=0 — всегда URL); чужие записи подтягиваются при обновлении каталога
+photo_cache = make_photo_cache()
+# URL, которые `python photo_health.py check` признал битыми (PHOTO_HEALTH=0 — не учитывать)
+photo_health = make_photo_health()
+
+# повторная доставка того же update_id (Telegram не дождался ответа) подтверждается без обработки
+dedup = make_deduplicator()
+
+def new_state() -> Dict[str, Any]:
+    return {"page_map": {k: 0 for k in category_order}}
+
+def state_filters(state: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """Выборы мастера -> фильтры подбора (невыбранные шаги — None)."""
+    return {key2human[key]: resolvers[key].normalize(state.get(key)) for key in category_order}
 
 # ----------------- ВСПОМОГАТЕЛЬНОЕ -----------------
-def normalize(value: Optional[str], options_list: List[str]) -> Optional[str]:
-    if not value:
-        return value
-    for opt in options_list:
-        if value.strip().lower() == opt.strip().lower():
-            return opt
-    return value
-
-def build_keyboard(options: List[str], prefix: str, page: int = 0, page_size: int = 10) -> Dict[str, Any]:
+def build_keyboard(options: List[str], prefix: str, page: int = 0, page_size: int = 10,
+                   counts: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    # counts — {вариант: сколько мест останется}; пустые варианты скрываются до разбивки на страницы
+    if counts is not None and KEYBOARD_FACETS == "hide":
+        options = [opt for opt in options if counts.get(opt)]
+    page = min(page, max(0, (len(options) - 1) // page_size))
     start = page * page_size
     end = start + page_size
-    keyboard = [[{"text": opt, "callback_data": f"{prefix}:{opt}"}] for opt in options[start:end]]
+    if counts is None:
+        keyboard = [[{"text": opt, "callback_data": callbacks.select(prefix, opt)}] for opt in options[start:end]]
+    else:
+        keyboard = [[{"text": f"{opt} · {counts.get(opt, 0)}", "callback_data": callbacks.select(prefix, opt)}]
+                    for opt in options[start:end]]
+    if counts is not None and not options:
+        # по этой категории у оставшихся мест ничего не указано — шаг можно только пропустить
+        keyboard.append([{"text": "Любой вариант", "callback_data": callbacks.select(prefix, None)}])
 
     nav_row = []
     if page > 0:
-        nav_row.append({"text": "⬅️ Назад", "callback_data": f"{prefix}_page:{page - 1}"})
+        nav_row.append({"text": "⬅️ Назад", "callback_data": callbacks.page(prefix, page - 1)})
     if end < len(options):
-        nav_row.append({"text": "➡️ Далее", "callback_data": f"{prefix}_page:{page + 1}"})
+        nav_row.append({"text": "➡️ Далее", "callback_data": callbacks.page(prefix, page + 1)})
     if nav_row:
         keyboard.append(nav_row)
 
-    keyboard.append([{"text": "🔁 Начать заново", "callback_data": "restart"}])
+    keyboard.append([{"text": "🔁 Начать заново", "callback_data": callbacks.restart}])
     return {"inline_keyboard": keyboard}
 
-def tg_send_message(chat_id: int, text: str, reply_markup: Dict[str, Any] | None = None):
+def _dump_keyboard(keyboard: Dict[str, Any]) -> str:
+    return json.dumps(keyboard, ensure_ascii=False, separators=(",", ":"))
+
+# клавиатуры без счётчиков — один раз при старте, уже в виде JSON для reply_markup
+STATIC_KEYBOARDS: Dict[str, List[str]] = {
+    key: [_dump_keyboard(build_keyboard(options, key, page)) for page in range(max(1, -(-len(options) // 10)))]
+    for key, options in category_options_map.items()
+}
+# со счётчиками — по (версия каталога, выборы, шаг, страница); после подмены среза старые записи — промах
+keyboard_cache = ResultCache(maxsize=KEYBOARD_CACHE_SIZE, ttl=24 * 3600)
+
+def wizard_keyboard(state: Dict[str, Any], key: str, page: int = 0) -> str:
+    """Готовый reply_markup шага key с учётом уже сделанных выборов (счётчики — service.facet_counts)."""
+    if KEYBOARD_FACETS != "off":
+        snap = catalog.snapshot()
+        ck = (service.facet_steps(state, upto=key), key, page)
+        keyboard = keyboard_cache.get(ck, snap.version) if snap is not None else None
+        if keyboard is not None:
+            return keyboard
+        counts = service.facet_counts(state, key, category_options_map[key])
+        if counts is not None:
+            keyboard = _dump_keyboard(build_keyboard(category_options_map[key], key, page, counts=counts))
+            if snap is not None:
+                # без каталога счётчики из БД живут в result_cache (свой TTL), клавиатура не кэшируется
+                keyboard_cache.put(ck, keyboard, snap.version)
+            return keyboard
+    pages = STATIC_KEYBOARDS[key]
+    return pages[min(page, len(pages) - 1)]
+
+NO_IMAGE_URL = "https://via.placeholder.com/640x360.png?text=No+Image"
+
+def _fit_caption(caption: str) -> str:
+    return caption[:1021] + "..." if len(caption) > 1024 else caption
+
+def tg_send_message(chat_id: int, text: str, reply_markup: Dict[str, Any] | str | None = None):
     payload = {
         "chat_id": chat_id,
         "text": text,
@@ -113,11 +183,9 @@ def tg_send_message(chat_id: int, text: str, reply_markup: Dict[str, Any] | None
     }
     if reply_markup:
         payload["reply_markup"] = reply_markup
-    resp = rq.post(f"{TG_API}/sendMessage", json=payload, timeout=15)
-    if resp.status_code != 200:
-        logger.error("sendMessage %s | %s", resp.status_code, resp.text)
+    return outbound.send(chat_id, "sendMessage", payload, timeout=15)
 
-def tg_edit_message(chat_id: int, message_id: int, text: str, reply_markup: Dict[str, Any] | None = None):
+def tg_edit_message(chat_id: int, message_id: int, text: str, reply_markup: Dict[str, Any] | str | None = None):
     payload = {
         "chat_id": chat_id,
         "message_id": message_id,
@@ -126,133 +194,218 @@ def tg_edit_message(chat_id: int, message_id: int, text: str, reply_markup: Dict
     }
     if reply_markup:
         payload["reply_markup"] = reply_markup
-    resp = rq.post(f"{TG_API}/editMessageText", json=payload, timeout=15)
-    if resp.status_code != 200:
-        logger.error("editMessageText %s | %s", resp.status_code, resp.text)
-
-def tg_answer_callback(cb_id: str):
-    rq.post(f"{TG_API}/answerCallbackQuery", json={"callback_query_id": cb_id}, timeout=15)
-
-def tg_send_photo(chat_id: int, photo_url: str, caption: str):
-    payload = {
-        "chat_id": chat_id,
-        "photo": photo_url or "https://via.placeholder.com/640x360.png?text=No+Image",
-        "caption": caption[:1021] + "..." if len(caption) > 1024 else caption,
-        "parse_mode": "HTML",
-    }
-    resp = rq.post(f"{TG_API}/sendPhoto", json=payload, timeout=20)
-    if resp.status_code != 200:
-        logger.error("sendPhoto %s | %s", resp.status_code, resp.text)
-        tg_send_message(chat_id, caption)
-
-# ----------------- РАБОТА С БД -----------------
-def run_query(filters: Dict[str, Optional[str]]):
-    query = "SELECT * FROM restaurants_v2 WHERE TRUE"
-    params: Dict[str, Any] = {}
-    for key, value in filters.items():
-        if value:
-            col_name = column_map[key]  # точное имя колонки в БД
-            placeholder = key.replace(" ", "_")
-            query += f' AND LOWER("{col_name}") LIKE :{placeholder}'
-            params[placeholder] = f"%{value.strip().lower()}%"
-
-    logger.info("[API] SQL: %s", query)
-    logger.info("[API] params: %s", params)
-
-    with engine.connect() as conn:
-        result = conn.execute(text(query), params)
-        return result.mappings().all()
-
-def clean_item(row_dict: Dict[str, Any]) -> Dict[str, Any]:
-    return {k: v for k, v in row_dict.items() if v and str(v).strip().lower() != "nan"}
-
-def generate_ai_reason(item: Dict[str, Any], filters: Dict[str, Optional[str]]) -> str:
-    parts = []
-    if filters.get("Кухня") and filters["Кухня"].lower() in (item.get("Кухня") or "").lower():
-        parts.append(f"здесь готовят отличную {filters['Кухня'].lower()} кухню")
-    if filters.get("Атмосфера") and filters["Атмосфера"].lower() in (item.get("атмосфера") or "").lower():
-        parts.append(f"атмосфера — {filters['Атмосфера'].lower()}")
-    if filters.get("Повод") and filters["Повод"].lower() in (item.get("повод") or "").lower():
-        parts.append(f"идеально подойдёт для: {filters['Повод'].lower()}")
-    if filters.get("Тип заведения") and filters["Тип заведения"].lower() in (item.get("Тип заведения") or "").lower():
-        parts.append(f"формат: {filters['Тип заведения'].lower()}")
-    if filters.get("Бюджет"):
-        parts.append(f"в пределах бюджета: {filters['Бюджет'].lower()}")
-    if parts:
-        return "Это место выбрано, потому что " + ", ".join(parts) + "."
-    return "Это заведение точно стоит посетить — оно выделяется среди других."
-
-def format_card(item: Dict[str, Any], filters: Dict[str, Optional[str]]) -> str:
-    name = item.get("Название", "Ресторан без названия")
-    desc = item.get("Описание")
-    address = item.get("Адрес")
-    metro = item.get("Метро")
-    link = item.get("Ссылка") or item.get("Сайт")
-    reason = generate_ai_reason(item, filters)
-
-    lines = [f"<b>{name}</b>"]
-    if desc:    lines.append(desc)
-    if address: lines.append(f"📍 {address}")
-    # метро может быть строкой или списком-строкой
-    if metro:
-        try:
-            metro_list = ast.literal_eval(metro) if isinstance(metro, str) else metro
-            if isinstance(metro_list, list):
-                lines.append(f"🚇 {', '.join(metro_list)}")
-            else:
-                lines.append(f"🚇 {str(metro)}")
-        except Exception:
-            lines.append(f"🚇 {str(metro)}")
-    if link:    lines.append(f"🔗 {link}")
-    lines.append("")
-    lines.append(f"🤖 {reason}")
-    return "\n".join(lines)
+    return outbound.send(chat_id, "editMessageText", payload, timeout=15)
+
+def tg_answer_callback(chat_id: int, cb_id: str):
+    return outbound.send(chat_id, "answerCallbackQuery", {"callback_query_id": cb_id}, timeout=15)
+
+def _photo_media(name: Optional[str], url: Optional[str]) -> str:
+    """Что отдать в photo/media: file_id из кэша, иначе URL; битый по photo_health.py URL — сразу заглушка."""
+    if photo_cache is not None and name and url:
+        file_id = photo_cache.get(name, url)
+        if file_id:
+            return file_id
+    if photo_health is not None and photo_health.is_bad(url):
+        return NO_IMAGE_URL
+    return url or NO_IMAGE_URL
+
+def _remember_photos(resp, cards: List[tuple], media: List[str]):
+    """file_id из ответа Telegram — для карточек, которые ушли по URL."""
+    if photo_cache is None:
+        return
+    for message, (url, _, name), sent in zip(result_messages(resp), cards, media):
+        if name and url and sent == url:
+            photo_cache.put(name, url, largest_file_id(message))
+
+def _deliver_photo(api: OutboundDispatcher, chat_id: int, card: tuple):
+    url, caption, name = card
+    media = _photo_media(name, url)
+    payload = {"chat_id": chat_id, "photo": media, "caption": _fit_caption(caption), "parse_mode": "HTML"}
+    resp = api.call("sendPhoto", payload, timeout=20)
+    if (resp is None or resp.status_code != 200) and media not in (url, NO_IMAGE_URL):
+        # file_id протух — забываем и пробуем исходный URL
+        photo_cache.forget(name, url)
+        media = payload["photo"] = url or NO_IMAGE_URL
+        resp = api.call("sendPhoto", payload, timeout=20)
+    if resp is not None and resp.status_code == 200:
+        _remember_photos(resp, [card], [media])
+        return resp
+    # не прошло фото — в том же потоке (и по порядку) шлём карточку текстом
+    return api.call("sendMessage", {"chat_id": chat_id, "text": caption, "parse_mode": "HTML",
+                                    "disable_web_page_preview": False}, timeout=20)
+
+def tg_send_photo(chat_id: int, photo_url: str, caption: str, name: Optional[str] = None):
+    return outbound.run(chat_id, _deliver_photo, chat_id, (photo_url, caption, name))
+
+def _deliver_media_group(api: OutboundDispatcher, chat_id: int, cards: List[tuple]):
+    """sendMediaGroup с подменой битых фото внутри альбома.
+
+    Telegram отвечает «failed to send message #N …» — если у N-й карточки был
+    file_id из кэша, пробуем её URL, иначе меняем фото на заглушку и повторяем
+    альбом; если и так не вышло, шлём все карточки одним сообщением.
+    """
+    sent = [_photo_media(name, url) for url, _, name in cards]
+    media = [{"type": "photo", "media": m, "caption": _fit_caption(caption), "parse_mode": "HTML"}
+             for m, (_, caption, _) in zip(sent, cards)]
+    for _ in range(2 * len(media) + 1):
+        resp = api.call("sendMediaGroup", {"chat_id": chat_id, "media": media}, timeout=30)
+        if resp is not None and resp.status_code == 200:
+            _remember_photos(resp, cards, sent)
+            return resp
+        m = re.search(r"message #(\d+)", resp.text if resp is not None else "")
+        bad = int(m.group(1)) - 1 if m else -1
+        if not 0 <= bad < len(media) or sent[bad] == NO_IMAGE_URL:
+            break
+        url, _, name = cards[bad]
+        if sent[bad] != url and url:
+            photo_cache.forget(name, url)
+            sent[bad] = url
+        else:
+            sent[bad] = NO_IMAGE_URL
+        media[bad]["media"] = sent[bad]
+    text = "\n\n".join(caption for _, caption, _ in cards)
+    return api.call("sendMessage", {"chat_id": chat_id, "text": text[:4096], "parse_mode": "HTML",
+                                    "disable_web_page_preview": True}, timeout=15)
+
+def tg_send_media_group(chat_id: int, cards: List[tuple]):
+    """cards — [(photo_url, caption, название)], от 2 до 10 штук (ограничение Telegram на альбом)."""
+    return outbound.run(chat_id, _deliver_media_group, chat_id, cards)
 
 # ----------------- FLASK -----------------
 app = Flask(__name__)
 CORS(app)
 
+def _reload_photos(snap):
+    for source in (photo_cache, photo_health):
+        if source is None:
+            continue
+        try:
+            source.reload()
+        except Exception:
+            logger.exception("[PHOTO] reload failed")
+catalog.on_swap(_reload_photos)
+service.start()
+
+# ----------------- МЕТРИКИ -----------------
+registry.counter_fn("tgm_result_cache_total", "Обращения к кэшу подборок", lambda: {
+    ("hit",): result_cache.hits, ("miss",): result_cache.misses, ("eviction",): result_cache.evictions,
+}, ("result",))
+registry.gauge("tgm_result_cache_size", "Комбинаций фильтров в кэше", lambda: len(result_cache))
+registry.counter_fn("tgm_log_dropped_total", "Записи лога, отброшенные из-за переполнения очереди",
+                    lambda: DroppingQueueHandler.dropped)
+if photo_cache is not None:
+    registry.counter_fn("tgm_photo_cache_total", "Отправки фото: file_id из кэша, по URL, протухшие file_id", lambda: {
+        ("hit",): photo_cache.hits, ("miss",): photo_cache.misses, ("stale",): photo_cache.stale,
+    }, ("result",))
+if photo_health is not None:
+    registry.counter_fn("tgm_photo_skipped_total", "Фото, заменённые заглушкой без попытки (битый URL)",
+                        lambda: photo_health.skipped)
+registry.counter_fn("tgm_statements_total", "Выполнения форм подбора: PREPARE, EXECUTE, без подготовки, повторный PREPARE после ошибки", lambda: {
+    ("prepare",): statements.prepares, ("execute",): statements.executions, ("plain",): statements.plain,
+    ("reprepare",): statements.reprepares,
+}, ("event",))
+registry.gauge("tgm_statement_shapes", "Разных форм SQL-запроса подбора", lambda: len(statements))
+registry.gauge("tgm_catalog_rows", "Строк в текущем срезе каталога",
+               lambda: len(catalog.snapshot()) if catalog.snapshot() else 0)
+registry.gauge("tgm_db_pool_connections", "Соединения пула db.engine", lambda: {
+    ("checked_out",): engine.pool.checkedout(), ("overflow",): max(0, engine.pool.overflow()),
+    ("idle",): engine.pool.checkedin(),
+}, ("state",))
+registry.gauge("tgm_update_queue_depth", "Апдейты в очереди потока обработки", lambda: {
+    (str(i),): depth for i, depth in enumerate(updates.depths())
+}, ("shard",))
+registry.counter_fn("tgm_updates_rejected_total", "Апдейты, не принятые из-за полной очереди (Telegram повторит)",
+                    lambda: updates.rejected)
+
 @app.route("/")
 def index():
     return "Сервис tg_miniapp работает! 🔥 Используйте /recommend или Telegram-бота."
 
 @app.route("/recommend", methods=["GET"])
 def recommend():
-    filters = {
-        "Бюджет": request.args.get("budget"),
-        "Тип заведения": request.args.get("type"),
-        "Кухня": request.args.get("cuisine"),
-        "Атмосфера": request.args.get("atmosphere"),
-        "Повод": request.args.get("reason"),
-    }
+    filters = filters_from_params(request.args)
 
     try:
-        rows = run_query(filters)
+        selected = sample_rows(filters, 3)
     except Exception:
         logger.exception("[API] ERROR executing query")
         return Response(json.dumps({"message": "Ошибка запроса к БД"}, ensure_ascii=False),
                         content_type="application/json", status=500)
 
-    if not rows:
+    if not selected:
         return Response(json.dumps({"message": "Ничего не нашлось"}, ensure_ascii=False),
                         content_type="application/json")
 
-    selected = rows if len(rows) <= 3 else random.sample(rows, 3)
-    data = []
-    for row in selected:
-        item = clean_item(dict(row))
-        data.append({
-            "name": item.get("Название", "Ресторан без названия"),
-            "description": item.get("Описание"),
-            "address": item.get("Адрес"),
-            "metro": item.get("Метро"),
-            "photo": item.get("Фото"),
-            "link": item.get("Ссылка") or item.get("Сайт"),
-            "ai_reason": generate_ai_reason(item, filters),
-        })
+    data = [card_json(item, filters) for item in selected]
+    return Response(json.dumps(data, ensure_ascii=False), content_type="application/json")
 
+@app.route("/search", methods=["GET"])
+def search():
+    """?q=суши тверская [&k=5] -> карточки по убыванию релевантности (BM25) со score."""
+    query = (request.args.get("q") or "").strip()
+    try:
+        k = min(max(int(request.args.get("k", 3)), 1), 50)
+    except ValueError:
+        k = 3
+    if not query:
+        return Response(json.dumps({"message": "Нужен параметр q"}, ensure_ascii=False),
+                        content_type="application/json", status=400)
+    found = service.search_rows(query, k)
+    if found is None:
+        return Response(json.dumps({"message": "Каталог ещё загружается"}, ensure_ascii=False),
+                        content_type="application/json", status=503)
+    filters = filters_from_params({})
+    data = [dict(card_json(item, filters), score=round(score, 3)) for item, score in found]
     return Response(json.dumps(data, ensure_ascii=False), content_type="application/json")
 
+@app.route("/nearby", methods=["GET"])
+def nearby():
+    """?lat=…&lon=… или ?station=… плюс фильтры как у /recommend -> ближайшие места с distance_km."""
+    station = find_station(request.args.get("station") or "")
+    try:
+        lat, lon = (station[1], station[2]) if station else (float(request.args["lat"]), float(request.args["lon"]))
+        k = min(max(int(request.args.get("k", 3)), 1), 50)
+    except (KeyError, ValueError):
+        return Response(json.dumps({"message": "Нужны lat и lon или известная станция метро"}, ensure_ascii=False),
+                        content_type="application/json", status=400)
+    filters = filters_from_params(request.args)
+    found = service.nearby_rows(filters, lat, lon, k)
+    if found is None:
+        return Response(json.dumps({"message": "Каталог ещё загружается"}, ensure_ascii=False),
+                        content_type="application/json", status=503)
+    data = [card_json(item, filters, km) for item, km in found]
+    return Response(json.dumps(data, ensure_ascii=False), content_type="application/json")
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    snap = catalog.snapshot()
+    data = {
+        "catalog": {"version": snap.version, "rows": len(snap), "loaded_at": snap.loaded_at} if snap else None,
+        "geo": snap.geo.stats() if snap else None,
+        "search": snap.search.stats() if snap else None,
+        "result_cache": result_cache.stats(),
+        "statements": statements.stats(),
+        "updates": updates.stats(),
+    }
+    return Response(json.dumps(data, ensure_ascii=False), content_type="application/json")
+
+@app.route("/facets", methods=["GET"])
+def facets():
+    """Для Mini App: ?budget=…&type=… [&category=cuisine] -> сколько мест даст каждый вариант."""
+    category = request.args.get("category")
+    if category and category not in category_options_map:
+        return Response(json.dumps({"message": f"Неизвестная категория {category}"}, ensure_ascii=False),
+                        content_type="application/json", status=400)
+    data = service.facets_json(request.args, category_options_map, [category] if category else None)
+    if data is None:
+        return Response(json.dumps({"message": "Каталог ещё загружается"}, ensure_ascii=False),
+                        content_type="application/json", status=503)
+    return Response(json.dumps(data, ensure_ascii=False), content_type="application/json")
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(registry.expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ----------------- TELEGRAM WEBHOOK -----------------
 @app.route(f"/webhook/{WEBHOOK_SECRET}", methods=["POST"])
 def telegram_webhook():
@@ -263,8 +416,61 @@ def telegram_webhook():
         return Response("forbidden", status=403)
 
     update = request.get_json(silent=True) or {}
-    logger.info("[TG] update: %s", json.dumps(update, ensure_ascii=False))
+    # обработка — в потоке своего чата, вебхук отвечает сразу
+    if not updates.dispatch(update_chat_id(update), update):
+        return Response("busy", status=503)
+    return Response("ok")
+
+def process_update(update: Dict[str, Any]):
+    """Дедупликация, метрики и обработка апдейта — общее для Flask и aio_app.
+
+    Обычно вызывается из очереди чата (updates), когда вебхук уже ответил 200:
+    повторной доставки этого апдейта не будет, поэтому ошибки не пробрасываются,
+    а пишутся в лог.
+    """
+    logger.info("[TG] update: %s", LazyJSON(update), extra={"category": "update"})
+    kind = update_type(update)
+    update_id = update.get("update_id")
+    try:
+        fresh = dedup.claim(update_id)
+    except Exception:
+        # общее хранилище (SQL/Redis) недоступно — лучше возможный дубль, чем молчащий бот
+        logger.exception("[TG] dedup claim failed, processing update_id=%s unchecked", update_id)
+        fresh = True
+    if not fresh:
+        UPDATES_TOTAL.labels("duplicate").inc()
+        logger.info("[TG] duplicate update_id=%s skipped", update_id)
+        return Response("ok")
+
+    UPDATES_TOTAL.labels(kind).inc()
+    try:
+        with WEBHOOK_SECONDS.labels(kind).time():
+            return handle_update(update)
+    except Exception:
+        logger.exception("[TG] update_id=%s (%s) failed", update_id, kind)
+        return Response("error", status=500)
+
+def update_type(update: Dict[str, Any]) -> str:
+    for key in ("callback_query", "message", "edited_message"):
+        if key in update:
+            return key
+    return "other"
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """Ключ очереди: чат, а для апдейтов без чата — update_id (порядок им не важен)."""
+    cb = update.get("callback_query")
+    if cb:
+        msg = cb.get("message")
+        return msg["chat"]["id"] if msg else cb.get("from", {}).get("id", 0)
+    msg = update.get("message") or update.get("edited_message")
+    if msg:
+        return msg["chat"]["id"]
+    return update.get("update_id") or 0
 
+# апдейты одного чата — строго по очереди в одном потоке, разные чаты — параллельно (UPDATE_WORKERS)
+updates = UpdateDispatcher(process_update)
+
+def handle_update(update: Dict[str, Any]):
     # callback_query (кнопки)
     if "callback_query" in update:
         return handle_callback(update["callback_query"])
@@ -277,95 +483,187 @@ def telegram_webhook():
     chat_id = msg["chat"]["id"]
     text = (msg.get("text") or "").strip()
 
+    # геопозиция — ближайшие места с учётом уже сделанных в мастере выборов
+    location = msg.get("location")
+    if location:
+        state = sessions.get(chat_id) or new_state()
+        return send_nearby(chat_id, state_filters(state), location["latitude"], location["longitude"], "от тебя")
+
+    # /near [станция] — поиск рядом: кнопка «отправить геопозицию» или станция метро текстом
+    if text.startswith("/near"):
+        arg = text.partition(" ")[2].strip()
+        station = find_station(arg) if arg else None
+        if station is None:
+            tg_send_message(chat_id, "Отправь геопозицию или напиши станцию метро — покажу, что рядом 📍",
+                            reply_markup=LOCATION_KEYBOARD)
+            return Response("ok")
+        return send_station_nearby(chat_id, station)
+
     # /start — сброс состояния и показ первой клавиатуры
     if text.startswith("/start"):
-        user_state[chat_id] = {"page_map": {k: 0 for k in category_order}}
+        state = new_state()
+        sessions.set(chat_id, state)
         tg_send_message(chat_id, "Привет! Давай подберём тебе ресторан.\n" + category_prompt["budget"],
-                        reply_markup=build_keyboard(budget_options, "budget", 0))
+                        reply_markup=wizard_keyboard(state, "budget"))
         return Response("ok")
 
-    # если текст, а не кнопки — трактуем как быстрый поиск по «кухне»
-    user_state.setdefault(chat_id, {"page_map": {k: 0 for k in category_order}})
-    filters = {"Бюджет": None, "Тип заведения": None, "Кухня": text, "Атмосфера": None, "Повод": None}
+    # название станции метро — места рядом с ней
+    station = find_station(text)
+    if station is not None:
+        return send_station_nearby(chat_id, station)
+
+    # если текст, а не кнопки — полнотекстовый поиск по каталогу (название, описание, кухня, тип, метро)
+    cuisine = resolvers["cuisine"].resolve(text)
+    filters = {"Бюджет": None, "Тип заведения": None, "Кухня": cuisine or text, "Атмосфера": None, "Повод": None}
+    found = service.search_rows(text, 3)
+    if found:
+        cards = [(item.get("Фото"), format_card(item, filters), item.get("Название")) for item, _ in found]
+        return send_cards(chat_id, cards)
+    # каталог не загружен или ни одного слова не нашлось — подстрока в «кухне» (узнанная кухня — целиком)
     return send_recommendations(chat_id, filters)
 
 def handle_callback(cb: Dict[str, Any]):
     chat_id = cb["message"]["chat"]["id"]
     message_id = cb["message"]["message_id"]
-    data = cb.get("data") or ""
-    tg_answer_callback(cb.get("id"))
+    action = callbacks.decode(cb.get("data") or "")
+    tg_answer_callback(chat_id, cb.get("id"))
+    if action is None:
+        return Response("ok")   # кнопка несовместимой версии или чужие данные
 
-    state = user_state.setdefault(chat_id, {"page_map": {k: 0 for k in category_order}})
-    page_map: Dict[str, int] = state.get("page_map", {})
+    state = sessions.get(chat_id) or new_state()
+    page_map: Dict[str, int] = state.setdefault("page_map", {})
 
     # restart
-    if data == "restart":
-        user_state[chat_id] = {"page_map": {k: 0 for k in category_order}}
+    if action.action == RESTART:
+        state = new_state()
+        sessions.set(chat_id, state)
         tg_edit_message(chat_id, message_id, category_prompt["budget"],
-                        reply_markup=build_keyboard(budget_options, "budget", 0))
+                        reply_markup=wizard_keyboard(state, "budget"))
         return Response("ok")
 
+    # ещё варианты из той же подборки
+    if action.action == MORE:
+        return send_more(chat_id, state)
+
     # пагинация
-    if "_page:" in data:
-        prefix, page_str = data.split("_page:")
-        page = max(0, int(page_str))
+    if action.action == PAGE:
+        prefix, page = action.key, action.page
         page_map[prefix] = page
+        sessions.set(chat_id, state)
         tg_edit_message(chat_id, message_id, category_prompt[prefix],
-                        reply_markup=build_keyboard(category_options_map[prefix], prefix, page))
+                        reply_markup=wizard_keyboard(state, prefix, page))
         return Response("ok")
 
     # выбор значения
-    if ":" in data:
-        prefix, value = data.split(":", 1)
+    if action.action == SELECT:
+        prefix, value = action.key, action.value
         # сохраняем выбор
         state[prefix] = value
+        sessions.set(chat_id, state)
 
         # какая следующая категория?
-        try:
-            idx = category_order.index(prefix)
-            next_key = category_order[idx + 1] if idx + 1 < len(category_order) else None
-        except ValueError:
-            next_key = None
+        idx = category_order.index(prefix)
+        next_key = category_order[idx + 1] if idx + 1 < len(category_order) else None
 
         if next_key:
             page = page_map.get(next_key, 0)
             tg_edit_message(chat_id, message_id, category_prompt[next_key],
-                            reply_markup=build_keyboard(category_options_map[next_key], next_key, page))
+                            reply_markup=wizard_keyboard(state, next_key, page))
             return Response("ok")
 
         # если это был последний выбор — собираем фильтры и шоуим рекомендации
-        filters = {
-            "Бюджет": normalize(state.get("budget"), budget_options),
-            "Тип заведения": normalize(state.get("type"), type_options),
-            "Кухня": normalize(state.get("cuisine"), cuisine_options),
-            "Атмосфера": normalize(state.get("atmosphere"), atmosphere_options),
-            "Повод": normalize(state.get("reason"), reason_options),
-        }
-        return send_recommendations(chat_id, filters)
+        return send_recommendations(chat_id, state_filters(state))
 
     return Response("ok")
 
 def send_recommendations(chat_id: int, filters: Dict[str, Optional[str]]):
+    # из каталога в памяти — через колоду: следующие места покажет кнопка «Ещё варианты»
+    deck = service.new_deck(filters)
     try:
-        rows = run_query(filters)
+        selected = (deck and service.deck_rows(deck)) or sample_rows(filters, 3)
     except Exception:
         logger.exception("[TG] DB error")
         tg_send_message(chat_id, "Упс, не получилось сходить в базу. Попробуй ещё раз позже 🙏")
         return Response("ok")
 
-    if not rows:
+    if not selected:
         tg_send_message(chat_id, "Ничего не нашлось, попробуй иначе сформулировать запрос 🍽️")
         return Response("ok")
 
-    selected = rows if len(rows) <= 3 else random.sample(rows, 3)
-    for row in selected:
-        item = clean_item(dict(row))
-        caption = format_card(item, filters)
-        tg_send_photo(chat_id, item.get("Фото"), caption)
+    more = save_deck(chat_id, deck)
+    return send_cards(chat_id, recommendation_cards(selected, filters), more=more)
 
-    tg_send_message(chat_id, "Хочешь попробовать другую подборку? Нажми /start или «🔁 Начать заново».")
+def send_more(chat_id: int, state: Dict[str, Any]):
+    """Следующие 3 места из колоды в сессии — без повторов и без запроса в БД."""
+    deck = state.get("more")
+    if not deck:
+        tg_send_message(chat_id, "Эта подборка уже неактуальна — нажми /start, подберём заново 🙏")
+        return Response("ok")
+    selected = service.deck_rows(deck)
+    if selected is None:
+        # колода кончилась или каталог обновился — перемешиваем заново под те же фильтры
+        return send_recommendations(chat_id, deck["f"])
+    more = save_deck(chat_id, deck, state)
+    return send_cards(chat_id, recommendation_cards(selected, deck["f"]), more=more)
+
+def save_deck(chat_id: int, deck: Optional[Dict[str, Any]], state: Optional[Dict[str, Any]] = None) -> bool:
+    """Колода -> сессия; True — в ней ещё есть что показать."""
+    state = state if state is not None else sessions.get(chat_id) or new_state()
+    more = bool(deck) and service.deck_left(deck) > 0
+    if more:
+        state["more"] = deck
+    elif state.pop("more", None) is None:
+        return False   # сохранять нечего
+    sessions.set(chat_id, state)
+    return more
+
+def recommendation_cards(selected: List[Dict[str, Any]], filters: Dict[str, Optional[str]]) -> List[tuple]:
+    return [(item.get("Фото"), format_card(item, filters), item.get("Название")) for item in selected]
+
+def send_cards(chat_id: int, cards: List[tuple], more: bool = False):
+    if TG_MEDIA_GROUP and len(cards) > 1:
+        tg_send_media_group(chat_id, cards)
+    else:
+        for photo, caption, name in cards:
+            tg_send_photo(chat_id, photo, caption, name)
+
+    if more:
+        tg_send_message(chat_id, "Показать ещё места под эти фильтры?", reply_markup=MORE_KEYBOARD)
+    else:
+        tg_send_message(chat_id, "Хочешь попробовать другую подборку? Нажми /start или «🔁 Начать заново».")
     return Response("ok")
 
+MORE_KEYBOARD = {"inline_keyboard": [
+    [{"text": "➕ Ещё варианты", "callback_data": callbacks.more}],
+    [{"text": "🔁 Начать заново", "callback_data": callbacks.restart}],
+]}
+
+# кнопка под полем ввода: Telegram сам пришлёт message.location
+LOCATION_KEYBOARD = {
+    "keyboard": [[{"text": "📍 Отправить геопозицию", "request_location": True}]],
+    "resize_keyboard": True,
+    "one_time_keyboard": True,
+}
+
+def send_station_nearby(chat_id: int, station: tuple):
+    name, lat, lon = station
+    state = sessions.get(chat_id) or new_state()
+    return send_nearby(chat_id, state_filters(state), lat, lon, f"от м. {name}")
+
+def send_nearby(chat_id: int, filters: Dict[str, Optional[str]], lat: float, lon: float, origin: str):
+    """Ближайшие места под фильтры — из KD-дерева среза каталога, без запроса в БД."""
+    found = service.nearby_rows(filters, lat, lon, 3)
+    if found is None:
+        tg_send_message(chat_id, "Каталог ещё загружается, попробуй через минуту 🙏")
+        return Response("ok")
+    if not found:
+        tg_send_message(chat_id, "Рядом ничего подходящего не нашлось 🍽️ Попробуй /start с другими настройками.")
+        return Response("ok")
+    cards = [(item.get("Фото"), format_card(item, filters, f"{format_distance(km)} {origin}"), item.get("Название"))
+             for item, km in found]
+    return send_cards(chat_id, cards)
+
 # ----------------- RUN -----------------
+# asyncio-режим запускается своим модулем: `python aio_app.py` (app.py он импортирует сам)
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=PORT, debug=False, use_reloader=False)
@@ -0,0 +1 @@
+"""Бенчмарки tg_miniapp: `python -m bench.<имя> --help`."""
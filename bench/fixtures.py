@@ -0,0 +1,49 @@
+"""Синтетический restaurants_v2 в SQLite для бенчмарков."""
+import os
+import random
+import sqlite3
+
+from options import (
+    budget_options, type_options, cuisine_options,
+    atmosphere_options, reason_options
+)
+
+STATIONS = ["Арбатская", "Пушкинская", "Тверская", "Чистые пруды", "Курская",
+            "Смоленская", "Парк культуры", "Павелецкая", "Белорусская", "Китай-город"]
+
+COLUMNS = ["Название", "Описание", "Адрес", "Метро", "Кухня", "Тип заведения",
+           "Бюджет", "Фото", "Ссылка", "атмосфера", "повод"]
+
+
+def make_row(i: int, rnd: random.Random) -> tuple:
+    return (
+        f"Место {i}",
+        "nan" if i % 7 == 0 else f"Уютное место №{i} с авторским меню и открытой кухней",
+        f"Москва, ул. Примерная, {i}",
+        str(rnd.sample(STATIONS, 2)),
+        ", ".join(c.lower() for c in rnd.sample(cuisine_options, 2)),
+        rnd.choice(type_options).lower(),
+        rnd.choice(budget_options),
+        f"https://img.example.com/{i}.jpg",
+        f"https://example.com/place/{i}",
+        ", ".join(a.lower() for a in rnd.sample(atmosphere_options, 2)),
+        ", ".join(r.lower() for r in rnd.sample(reason_options, 2)),
+    )
+
+
+def make_catalog(path: str, rows: int, seed: int = 1) -> str:
+    """Создаёт (или пересоздаёт) SQLite-файл с rows строками; возвращает DATABASE_URL."""
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cols = ", ".join(f'"{c}" TEXT' for c in COLUMNS)
+    conn.execute(f"CREATE TABLE restaurants_v2 ({cols})")
+    marks = ", ".join("?" for _ in COLUMNS)
+    batch = 50_000
+    for start in range(0, rows, batch):
+        conn.executemany(f"INSERT INTO restaurants_v2 VALUES ({marks})",
+                         (make_row(i, rnd) for i in range(start, min(rows, start + batch))))
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{os.path.abspath(path)}"
@@ -0,0 +1,95 @@
+"""Поиск «рядом»: KD-дерево среза каталога против перебора всех строк.
+
+    python -m bench.geo --sizes 10000 100000 --queries 2000
+
+Строки — те же синтетические, что в bench.fixtures, но с координатами
+(Широта/Долгота) в пределах Москвы; каталог собирается прямо в памяти.
+Для каждого запроса ответ дерева сверяется с перебором.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+# каталог собирается в памяти, к БД никто не подключается (но catalog импортирует db)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_geo.db')}")
+
+from bench.fixtures import COLUMNS, make_row
+from catalog import CatalogSnapshot
+from render import prepare_item
+from options import budget_options, cuisine_options
+
+FILTERS = [
+    {},                                                     # без фильтров
+    {"Бюджет": budget_options[0]},                           # примерно четверть каталога
+    {"Кухня": cuisine_options[0].lower()},
+    {"Бюджет": budget_options[0], "Кухня": cuisine_options[1].lower()},   # узкий: перебор кандидатов
+]
+
+
+def make_rows(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        row = dict(zip(COLUMNS, make_row(i, rnd)))
+        row["Широта"] = round(rnd.uniform(55.57, 55.91), 6)
+        row["Долгота"] = round(rnd.uniform(37.37, 37.85), 6)
+        rows.append(prepare_item(row))
+    return rows
+
+
+def brute(snap: CatalogSnapshot, filters, x: float, y: float, k: int):
+    ids = snap.match_ids(filters)
+    scored = sorted(((snap.geo.points[i][0] - x) ** 2 + (snap.geo.points[i][1] - y) ** 2, i) for i in ids)
+    return [i for d2, i in scored[:k] if d2 <= 25.0]   # NEARBY_MAX_KM = 5
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    from geo import to_xy
+    report = []
+    for size in args.sizes:
+        print(f"⏳ {size} строк…", file=sys.stderr, flush=True)
+        rows = make_rows(size)
+        started = time.perf_counter()
+        snap = CatalogSnapshot(rows, 1)
+        build_ms = (time.perf_counter() - started) * 1000
+        rnd = random.Random(7)
+        points = [(rnd.uniform(55.6, 55.88), rnd.uniform(37.4, 37.82)) for _ in range(args.queries)]
+        for filters in FILTERS:
+            snap.match(filters)   # маски фасетов в кэше, как после прогрева
+            times, mismatches = [], 0
+            for lat, lon in points:
+                t = time.perf_counter()
+                got = snap.nearest(filters, lat, lon, args.k)
+                times.append((time.perf_counter() - t) * 1000)
+                want = brute(snap, filters, *to_xy(lat, lon), args.k)
+                # при равных расстояниях порядок может отличаться — сравниваем расстояния
+                if [round(km, 9) for _, km in got] != [round(math.dist(snap.geo.points[i], to_xy(lat, lon)), 9)
+                                                       for i in want]:
+                    mismatches += 1
+            times.sort()
+            report.append({
+                "rows": size,
+                "build_ms": round(build_ms),
+                "filters": filters,
+                "matches": snap.match(filters).bit_count(),
+                "p50_ms": round(statistics.median(times), 3),
+                "p99_ms": round(times[int(len(times) * 0.99) - 1], 3),
+                "mismatches": mismatches,
+            })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Нагрузочный прогон вебхука и /recommend: задержки p50/p95/p99, RPS, запросов к БД на запрос.
+
+    python -m bench.load --rows 20000 --users 200 --concurrency 16
+    python -m bench.load --database-url postgresql://... --users 500 --concurrency 32
+
+Каталог — синтетический SQLite (bench.fixtures) или существующая БД; Bot API —
+локальная заглушка, которая отвечает {"ok": true} на любой метод. Запросы идут
+через Flask test client, то есть меряется само приложение без сети и gunicorn.
+Апдейт вебхука меряется до конца process_update в очереди своего чата, а не до
+ответа 200 (он приходит сразу после постановки в очередь).
+"""
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import argparse
+import tempfile
+import threading
+import statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fixtures import make_catalog
+from callbacks import SELECT
+
+SECRET = "bench-secret"
+FREE_TEXT = ["итальянская", "суши", "грузинская кухня", "бар", "завтрак", "пицца"]
+
+
+# ----------------- ЗАГЛУШКА BOT API -----------------
+class StubBotApi(BaseHTTPRequestHandler):
+    calls = 0
+    _lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with StubBotApi._lock:
+            StubBotApi.calls += 1
+        body = json.dumps({"ok": True, "result": {"message_id": 1}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBotApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+# ----------------- СЦЕНАРИИ -----------------
+class Recorder:
+    """Задержки и число SQL-запросов по видам запросов."""
+
+    def __init__(self):
+        self.samples = {}
+        self.local = threading.local()
+        self._lock = threading.Lock()
+        self._sent = {}   # update_id -> (вид, когда ушёл вебхук)
+
+    def on_sql(self, *args, **kwargs):
+        self.local.queries = getattr(self.local, "queries", 0) + 1
+
+    def record(self, kind: str, elapsed_ms: float, queries: int, status: int):
+        with self._lock:
+            self.samples.setdefault(kind, []).append((elapsed_ms, queries, status))
+
+    def measure(self, kind: str, fn):
+        self.local.queries = 0
+        started = time.perf_counter()
+        resp = fn()
+        self.record(kind, (time.perf_counter() - started) * 1000, self.local.queries, resp.status_code)
+        return resp
+
+    # вебхук отвечает, как только апдейт встал в очередь чата (app.updates), поэтому
+    # апдейт меряется от отправки вебхука до конца process_update в потоке диспетчера
+    def sent(self, kind: str, update_id: int):
+        self._sent[update_id] = (kind, time.perf_counter())
+
+    def rejected(self, update_id: int, status: int):
+        sent = self._sent.pop(update_id, None)
+        if sent is None:
+            return   # UPDATE_WORKERS=0: упал прямо в вебхуке и уже записан в wrap_handler
+        kind, started = sent
+        self.record(kind, (time.perf_counter() - started) * 1000, 0, status)
+
+    def wrap_handler(self, handler):
+        def process(update):
+            kind, started = self._sent.pop(update["update_id"])
+            self.local.queries = 0
+            status = 500
+            try:
+                resp = handler(update)
+                status = resp.status_code
+                return resp
+            finally:
+                self.record(kind, (time.perf_counter() - started) * 1000, self.local.queries, status)
+        return process
+
+
+def option_callbacks(app_module, prefix: str):
+    """callback_data всех вариантов категории — так, как их строит сам бот."""
+    options = app_module.category_options_map[prefix]
+    found, page = [], 0
+    while page * 10 < len(options):
+        for row in app_module.build_keyboard(options, prefix, page)["inline_keyboard"]:
+            for button in row:
+                data = button["callback_data"]
+                decoded = app_module.callbacks.decode(data)
+                if decoded is not None and decoded.action == SELECT:
+                    found.append(data)
+        page += 1
+    return found
+
+
+def user_session(app_module, rec: Recorder, chat_id: int, rnd: random.Random, update_ids):
+    client = app_module.app.test_client()
+    url = f"/webhook/{SECRET}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    def post(kind, update):
+        update_id = update["update_id"] = next(update_ids)
+        rec.sent(kind, update_id)
+        resp = client.post(url, json=update, headers=headers)
+        if resp.status_code != 200:   # не встал в очередь — process_update не будет
+            rec.rejected(update_id, resp.status_code)
+
+    post("webhook:/start", {"message": {"chat": {"id": chat_id}, "text": "/start"}})
+    for prefix in app_module.category_order:
+        data = rnd.choice(option_callbacks(app_module, prefix))
+        cb = {"id": str(chat_id), "data": data, "message": {"chat": {"id": chat_id}, "message_id": 1}}
+        post(f"webhook:callback:{prefix}", {"callback_query": cb})
+    text = rnd.choice(FREE_TEXT)
+    post("webhook:text", {"message": {"chat": {"id": chat_id}, "text": text}})
+
+    params = {k: rnd.choice(app_module.category_options_map[k])
+              for k in app_module.category_order if rnd.random() < 0.6}
+    rec.measure("recommend", lambda: client.get("/recommend", query_string=params))
+
+
+# ----------------- ОТЧЁТ -----------------
+def summarize(samples, wall: float) -> dict:
+    latencies = sorted(s[0] for s in samples)
+    if len(latencies) > 1:
+        # inclusive: перцентили внутри наблюдений (exclusive экстраполирует за max)
+        q = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s[2] >= 400),
+        "rps": round(len(samples) / wall, 1),
+        "p50_ms": round(p50, 2),
+        "p95_ms": round(p95, 2),
+        "p99_ms": round(p99, 2),
+        "max_ms": round(latencies[-1], 2),
+        "db_queries_per_request": round(sum(s[1] for s in samples) / len(samples), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000, help="размер синтетического каталога")
+    parser.add_argument("--database-url", help="готовая БД вместо синтетической")
+    parser.add_argument("--users", type=int, default=200, help="сколько пользователей проходят мастер")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    database_url = args.database_url or make_catalog(os.path.join(tmp.name, "catalog.db"), args.rows)
+    os.environ.update({
+        "DATABASE_URL": database_url,
+        "TELEGRAM_TOKEN": "bench",
+        "WEBHOOK_SECRET": SECRET,
+        "TG_API_BASE": start_stub(),
+        "CATALOG_REFRESH_SEC": "0",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from sqlalchemy import event
+    import db
+    rec = Recorder()
+    event.listen(db.engine, "before_cursor_execute", rec.on_sql)
+    import app as app_module   # импорт поднимает каталог и диспетчер с уже подменёнными env
+    app_module.updates.handler = rec.wrap_handler(app_module.updates.handler)
+
+    update_ids = itertools.count(1)   # next() у count атомарен, общий счётчик на все потоки
+
+    print(f"⏳ {args.users} пользователей, concurrency={args.concurrency}…", file=sys.stderr, flush=True)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(user_session, app_module, rec, 10_000 + i, random.Random(args.seed + i), update_ids)
+                   for i in range(args.users)]
+        for f in futures:
+            f.result()
+    wall = time.perf_counter() - started
+    app_module.updates.join()    # апдейты, ещё стоящие в очередях чатов
+    processed = time.perf_counter() - started
+    app_module.outbound.join()
+    drained = time.perf_counter() - started
+
+    webhook = [s for kind, items in rec.samples.items() if kind.startswith("webhook") for s in items]
+    report = {
+        "config": {"rows": None if args.database_url else args.rows, "users": args.users,
+                   "concurrency": args.concurrency},
+        "wall_s": round(wall, 3),
+        "updates_processed_s": round(processed, 3),
+        "outbound_drained_s": round(drained, 3),
+        "bot_api_calls": StubBotApi.calls,
+        "webhook": summarize(webhook, processed),
+        "recommend": summarize(rec.samples.get("recommend", []), wall),
+        "by_kind": {kind: summarize(items, processed if kind.startswith("webhook") else wall)
+                    for kind, items in sorted(rec.samples.items())},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Сравнение режимов сервера: Flask (потоки) против aio_app (asyncio) по настоящему HTTP.
+
+    python -m bench.modes --rows 20000 --users 300 --concurrency 64 --api-delay 0.05
+    python -m bench.modes --modes aio --database-url postgresql://...
+
+Каждый режим поднимается отдельным процессом (`python app.py` или `python aio_app.py`),
+Bot API — локальная заглушка с задержкой --api-delay, чтобы исходящие вызовы
+стоили как настоящие. Кроме задержек самого вебхука меряется время, за которое
+заглушка получила все ответы бота (вебхук отвечает 200 раньше, чем уходят сообщения).
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import itertools
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fixtures import make_catalog
+from bench.load import StubBotApi, Recorder, summarize, option_callbacks, FREE_TEXT
+
+SECRET = "bench-secret"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SlowStubBotApi(StubBotApi):
+    delay = 0.0
+    last_call = 0.0
+
+    def do_POST(self):
+        time.sleep(SlowStubBotApi.delay)
+        super().do_POST()
+        SlowStubBotApi.last_call = time.perf_counter()
+
+
+def start_stub(delay: float) -> str:
+    SlowStubBotApi.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowStubBotApi)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, env: dict) -> tuple:
+    port = free_port()
+    script = {"wsgi": "app.py", "aio": "aio_app.py"}[mode]
+    proc = subprocess.Popen([sys.executable, script], cwd=ROOT, env={**env, "PORT": str(port)})
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            if requests.get(base + "/", timeout=1).status_code == 200:
+                return proc, base
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{mode}: сервер не поднялся на {base}")
+
+
+# ----------------- СЦЕНАРИЙ -----------------
+def user_session(app_module, base: str, rec: Recorder, chat_id: int, rnd: random.Random, update_ids):
+    http = requests.Session()
+    url = f"{base}/webhook/{SECRET}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    def post(update):
+        update["update_id"] = next(update_ids)
+        return http.post(url, json=update, headers=headers, timeout=30)
+
+    rec.measure("webhook:/start", lambda: post({"message": {"chat": {"id": chat_id}, "text": "/start"}}))
+    for prefix in app_module.category_order:
+        data = rnd.choice(option_callbacks(app_module, prefix))
+        cb = {"id": str(chat_id), "data": data, "message": {"chat": {"id": chat_id}, "message_id": 1}}
+        rec.measure(f"webhook:callback:{prefix}", lambda: post({"callback_query": cb}))
+    text = rnd.choice(FREE_TEXT)
+    rec.measure("webhook:text", lambda: post({"message": {"chat": {"id": chat_id}, "text": text}}))
+
+    params = {k: rnd.choice(app_module.category_options_map[k])
+              for k in app_module.category_order if rnd.random() < 0.6}
+    rec.measure("recommend", lambda: http.get(f"{base}/recommend", params=params, timeout=30))
+
+
+def run_mode(mode: str, app_module, env: dict, args) -> dict:
+    proc, base = start_server(mode, env)
+    try:
+        rec = Recorder()
+        calls_before = StubBotApi.calls
+        update_ids = itertools.count(1)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(user_session, app_module, base, rec, 10_000 + i,
+                                   random.Random(args.seed + i), update_ids)
+                       for i in range(args.users)]
+            for f in futures:
+                f.result()
+        wall = time.perf_counter() - started
+
+        # исходящие ещё летят: ждём, пока заглушка не замолчит на секунду
+        while time.perf_counter() - max(SlowStubBotApi.last_call, started + wall) < 1.0:
+            time.sleep(0.1)
+        drained = max(SlowStubBotApi.last_call, started + wall) - started
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+    webhook = [s for kind, items in rec.samples.items() if kind.startswith("webhook") for s in items]
+    report = {
+        "wall_s": round(wall, 3),
+        "outbound_drained_s": round(drained, 3),
+        "bot_api_calls": StubBotApi.calls - calls_before,
+        "webhook": summarize(webhook, wall),
+        "recommend": summarize(rec.samples.get("recommend", []), wall),
+    }
+    for section in ("webhook", "recommend"):
+        report[section].pop("db_queries_per_request")   # SQL идёт в процессе сервера, отсюда не видно
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000, help="размер синтетического каталога")
+    parser.add_argument("--database-url", help="готовая БД вместо синтетической")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--api-delay", type=float, default=0.05, help="задержка заглушки Bot API, сек")
+    parser.add_argument("--modes", default="wsgi,aio")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    database_url = args.database_url or make_catalog(os.path.join(tmp.name, "catalog.db"), args.rows)
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "TELEGRAM_TOKEN": "bench",
+        "WEBHOOK_SECRET": SECRET,
+        "TG_API_BASE": start_stub(args.api_delay),
+        "CATALOG_REFRESH_SEC": "0",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    }
+    os.environ.update(env)
+    import app as app_module   # только ради build_keyboard и списков вариантов
+
+    report = {"config": {"rows": None if args.database_url else args.rows, "users": args.users,
+                         "concurrency": args.concurrency, "api_delay_s": args.api_delay}}
+    for mode in args.modes.split(","):
+        print(f"⏳ {mode}: {args.users} пользователей, concurrency={args.concurrency}…", file=sys.stderr, flush=True)
+        report[mode] = run_mode(mode, app_module, env, args)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Случайная выборка k совпадений: всё в Python + random.sample против выборки в БД.
+
+Выборка в БД идёт тем же путём, что и sample_rows: queries.sample_matches
+через реестр форм statements (в Postgres — подготовленные запросы).
+
+    python -m bench.sampling --sizes 10000 100000 1000000 --repeat 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+from sqlalchemy import create_engine, text
+
+from bench.fixtures import make_catalog
+from queries import build_filter_query, count_matches, sample_matches
+from statements import StatementRegistry
+
+FILTERS = {"Бюджет": "1000–3000 ₽"}   # широкий фильтр: примерно четверть каталога
+registry = StatementRegistry()
+
+
+def materialize_all(conn, k: int):
+    query, params = build_filter_query(FILTERS)
+    rows = conn.execute(text(query), params).mappings().all()
+    return random.sample(rows, k) if len(rows) > k else rows
+
+
+def count_and_sample(conn, k: int):
+    return sample_matches(conn, FILTERS, k, count_matches(conn, FILTERS, statements=registry), statements=registry)
+
+
+def sample_cached_count(count: int):
+    # как sample_rows: число совпадений уже лежит в result_cache, остаётся один запрос
+    return lambda conn, k: sample_matches(conn, FILTERS, k, count, statements=registry)
+
+
+def timed(fn, conn, k: int, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        got = fn(conn, k)
+        times.append((time.perf_counter() - started) * 1000)
+        assert len(got) == k
+    return {"p50_ms": round(statistics.median(times), 2), "max_ms": round(max(times), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            print(f"⏳ {size} строк…", file=sys.stderr, flush=True)
+            engine = create_engine(make_catalog(os.path.join(tmp, f"catalog_{size}.db"), size))
+            with engine.connect() as conn:
+                matches = count_matches(conn, FILTERS)
+                report.append({
+                    "rows": size,
+                    "matches": matches,
+                    "materialize_all": timed(materialize_all, conn, args.k, args.repeat),
+                    "count_and_sample": timed(count_and_sample, conn, args.k, args.repeat),
+                    "sample_cached_count": timed(sample_cached_count(matches), conn, args.k, args.repeat),
+                })
+            engine.dispose()
+    print(json.dumps({"results": report, "statements": registry.stats()}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Свободный текст: BM25 по инвертированному индексу против прохода по строкам с подстрокой в Кухне.
+
+    python -m bench.search --sizes 10000 100000 --repeat 200
+
+Строки — синтетические из bench.fixtures, каталог собирается в памяти.
+«like_scan» — то, что делал `LOWER("Кухня") LIKE '%текст%'`, только без БД:
+проход по всем строкам на каждый запрос.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+# каталог собирается в памяти, к БД никто не подключается (но catalog импортирует db)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_search.db')}")
+
+from bench.fixtures import COLUMNS, make_row
+from render import prepare_item
+from search import SearchIndex
+
+QUERIES = ["суши", "грузинская кухня", "итальянскую пиццу у метро тверская", "бар чистые пруды",
+           "Место 4242", "вегетарианская кафе арбатская", "кофейня", "японская китай-город"]
+
+
+def like_scan(rows, query: str):
+    needle = query.lower()
+    return [i for i, row in enumerate(rows) if needle in str(row.get("Кухня") or "").lower()][:3]
+
+
+def timed(fn, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return {"p50_ms": round(statistics.median(times), 3), "p99_ms": round(times[int(len(times) * 0.99) - 1], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    report = []
+    for size in args.sizes:
+        print(f"⏳ {size} строк…", file=sys.stderr, flush=True)
+        rnd = random.Random(1)
+        rows = [prepare_item(dict(zip(COLUMNS, make_row(i, rnd)))) for i in range(size)]
+        started = time.perf_counter()
+        index = SearchIndex(rows)
+        build_ms = (time.perf_counter() - started) * 1000
+        for query in QUERIES:
+            report.append({
+                "rows": size,
+                "build_ms": round(build_ms),
+                "terms": len(index),
+                "query": query,
+                "hits": len(index.search(query, args.k)),
+                "bm25": timed(lambda: index.search(query, args.k), args.repeat),
+                "like_scan": timed(lambda: like_scan(rows, query), max(1, args.repeat // 10)),
+            })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
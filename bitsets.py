@@ -0,0 +1,23 @@
+"""Битовые маски строк каталога (int): сборка из номеров и обратно."""
+from typing import List
+
+
+def mask_from_ids(ids: List[int]) -> int:
+    """Собирает битовую маску из номеров строк за один проход (без сдвигов по большому int)."""
+    if not ids:
+        return 0
+    buf = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+def iter_ids(mask: int) -> List[int]:
+    """Номера установленных битов маски по возрастанию."""
+    bits = bin(mask)[:1:-1]   # младший бит первым
+    ids = []
+    pos = bits.find("1")
+    while pos != -1:
+        ids.append(pos)
+        pos = bits.find("1", pos + 1)
+    return ids
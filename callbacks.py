@@ -0,0 +1,91 @@
+"""Компактный callback_data для кнопок мастера.
+
+Вместо `cuisine:Латиноамериканская кухня` (66 байт при лимите Telegram в 64)
+кнопка несёт версию протокола, действие и индексы:
+
+    1s27     выбор: категория 2 (cuisine), вариант 7
+    1s2      пропуск шага (вариант «Любой»)
+    1p21     страница 1 клавиатуры категории 2
+    1r       начать заново
+    1m       ещё варианты из той же подборки (колода в сессии)
+
+Разбор — срезы строки и обращение к списку по индексу. Кнопки старого формата
+(`prefix:value`, `prefix_page:n`, `restart`) из уже отправленных сообщений
+по-прежнему понимаются.
+"""
+from typing import Dict, List, Optional, NamedTuple
+
+CALLBACK_VERSION = "1"
+
+SELECT, PAGE, RESTART, MORE = "s", "p", "r", "m"
+
+
+class Callback(NamedTuple):
+    action: str                  # SELECT | PAGE | RESTART | MORE
+    key: Optional[str] = None    # категория мастера: budget, type, …
+    value: Optional[str] = None  # выбранный вариант; "" — шаг пропущен
+    page: int = 0
+
+
+class CallbackCodec:
+    """Кодирование/разбор callback_data для фиксированных списков вариантов."""
+
+    def __init__(self, category_order: List[str], options_map: Dict[str, List[str]]):
+        self.keys = list(category_order)
+        self.options = [list(options_map[key]) for key in self.keys]
+        self._key_index = {key: i for i, key in enumerate(self.keys)}
+        self._option_index = [{opt: j for j, opt in enumerate(opts)} for opts in self.options]
+        self.restart = CALLBACK_VERSION + RESTART
+        self.more = CALLBACK_VERSION + MORE
+
+    # ----------------- КОДИРОВАНИЕ -----------------
+    def select(self, key: str, option: Optional[str]) -> str:
+        c = self._key_index[key]
+        if not option:
+            return f"{CALLBACK_VERSION}{SELECT}{c}"
+        return f"{CALLBACK_VERSION}{SELECT}{c}{self._option_index[c][option]}"
+
+    def page(self, key: str, page: int) -> str:
+        return f"{CALLBACK_VERSION}{PAGE}{self._key_index[key]}{page}"
+
+    # ----------------- РАЗБОР -----------------
+    def decode(self, data: str) -> Optional[Callback]:
+        """None — данные не наши или от несовместимой версии (кнопка устарела)."""
+        if not data:
+            return None
+        if data[0].isdigit():
+            return self._decode_compact(data)
+        return self._decode_legacy(data)
+
+    def _decode_compact(self, data: str) -> Optional[Callback]:
+        if data[:1] != CALLBACK_VERSION or len(data) < 2:
+            return None
+        action = data[1]
+        if action == RESTART:
+            return Callback(RESTART)
+        if action == MORE:
+            return Callback(MORE)
+        try:
+            c = int(data[2])
+            key = self.keys[c]
+            rest = data[3:]
+            if action == SELECT:
+                return Callback(SELECT, key, self.options[c][int(rest)] if rest else "")
+            if action == PAGE:
+                return Callback(PAGE, key, page=max(0, int(rest)))
+        except (IndexError, ValueError):
+            pass
+        return None
+
+    def _decode_legacy(self, data: str) -> Optional[Callback]:
+        if data == "restart":
+            return Callback(RESTART)
+        if "_page:" in data:
+            prefix, _, page = data.partition("_page:")
+            if prefix in self._key_index and page.isdigit():
+                return Callback(PAGE, prefix, page=int(page))
+            return None
+        prefix, sep, value = data.partition(":")
+        if sep and prefix in self._key_index:
+            return Callback(SELECT, prefix, value)
+        return None
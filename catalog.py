@@ -0,0 +1,238 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from sqlalchemy import text
+import db
+from queries import SINGLE_VALUED, column_map, known_values, projection
+from render import prepare_item
+from geo import GeoIndex, NEARBY_MAX_KM
+from search import SearchIndex
+from bitsets import mask_from_ids, iter_ids
+from metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+# 0 — не обновлять каталог по таймеру (только по запросу через request_refresh())
+CATALOG_REFRESH_SEC = int(os.getenv("CATALOG_REFRESH_SEC", "600"))
+
+# фильтр -> колонка в restaurants_v2
+FACET_COLUMNS = column_map
+
+# в ячейке может лежать несколько значений: «итальянская кухня, европейская кухня»
+_SEPARATORS = (",", ";")
+# свободный текст пользователей не должен раздувать кэш подстрочных масок
+_LIKE_CACHE_MAX = 4096
+# деревья «рядом» для узких фильтров (комбинации мастера повторяются)
+_GEO_CACHE_MAX = 256
+
+
+def _split_values(raw: Any, single: bool = False) -> List[str]:
+    if raw is None:
+        return []
+    s = str(raw).strip().lower()
+    if not s or s == "nan":
+        return []
+    if single:
+        # как lower(btrim(col)) в SQL: вся ячейка, обрезаются только пробелы
+        return [str(raw).strip(" ").lower()]
+    for sep in _SEPARATORS[1:]:
+        s = s.replace(sep, _SEPARATORS[0])
+    return [p.strip() for p in s.split(_SEPARATORS[0]) if p.strip()]
+
+
+class CatalogSnapshot:
+    """Неизменяемый срез restaurants_v2 с инвертированными индексами по фасетам.
+
+    Для каждого фасета хранится {значение: битовая маска строк}. Значение
+    из options.py — маска ровно этого значения (как `@>` в queries.py;
+    у SINGLE_VALUED значение — вся ячейка, как `=` по facet_budget),
+    свободный текст `LOWER(col) LIKE '%x%'` — OR масок всех значений,
+    содержащих x, а комбинация фильтров — AND масок.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], version: int):
+        self.rows = rows
+        self.version = version
+        self.loaded_at = time.time()
+        self.all_mask = (1 << len(rows)) - 1
+        self.index: Dict[str, Dict[str, int]] = {}
+        for key, col in FACET_COLUMNS.items():
+            postings: Dict[str, List[int]] = {}
+            for i, row in enumerate(rows):
+                for value in _split_values(row.get(col), single=key in SINGLE_VALUED):
+                    postings.setdefault(value, []).append(i)
+            self.index[key] = {v: mask_from_ids(ids) for v, ids in postings.items()}
+        # подстрочные запросы повторяются, поэтому маски запоминаем
+        self._like_cache: Dict[tuple, int] = {}
+        # кандидаты после шагов мастера и счётчики вариантов следующего шага
+        self._steps_cache: Dict[tuple, int] = {}
+        self._counts_cache: Dict[tuple, Dict[str, int]] = {}
+        # точки ресторанов для «рядом» (координаты или центр станций метро)
+        self.geo = GeoIndex(rows)
+        self._geo_cache: Dict[int, Any] = {}
+        # BM25 по названию, описанию, кухне, типу и метро — для свободного текста
+        self.search = SearchIndex(rows)
+
+    def facet_mask(self, key: str, value: str) -> int:
+        needle = value.strip().lower()
+        if not needle:
+            return self.all_mask
+        ck = (key, needle)
+        mask = self._like_cache.get(ck)
+        if mask is None:
+            if needle in known_values[key]:
+                # кнопка мастера: «бар» не должен находить «спортбар»
+                mask = self.index[key].get(needle, 0)
+            elif any(sep in needle for sep in _SEPARATORS):
+                # запрос шире одного значения — честно проверяем исходные ячейки
+                col = FACET_COLUMNS[key]
+                mask = mask_from_ids([i for i, row in enumerate(self.rows)
+                                      if needle in str(row.get(col) or "").lower()])
+            else:
+                postings = self.index[key]
+                mask = postings.get(needle, 0)
+                for v, m in postings.items():
+                    if needle in v:
+                        mask |= m
+            if len(self._like_cache) < _LIKE_CACHE_MAX:
+                self._like_cache[ck] = mask
+        return mask
+
+    def match(self, filters: Dict[str, Optional[str]]) -> int:
+        mask = self.all_mask
+        for key, value in filters.items():
+            if value:
+                mask &= self.facet_mask(key, value)
+                if not mask:
+                    break
+        return mask
+
+    def candidates(self, steps: Tuple[Tuple[str, str], ...]) -> int:
+        """Маска строк после шагов ((фасет, значение), ...) в порядке мастера.
+
+        Префиксы запоминаются, поэтому очередной шаг — один AND к маске предыдущего.
+        """
+        if not steps:
+            return self.all_mask
+        mask = self._steps_cache.get(steps)
+        if mask is None:
+            mask = self.candidates(steps[:-1]) & self.facet_mask(*steps[-1])
+            if len(self._steps_cache) < _LIKE_CACHE_MAX:
+                self._steps_cache[steps] = mask
+        return mask
+
+    def option_counts(self, steps: Tuple[Tuple[str, str], ...], key: str, options: List[str]) -> Dict[str, int]:
+        """{вариант: сколько строк останется, если его выбрать} для следующего фасета key."""
+        ck = (steps, key)
+        counts = self._counts_cache.get(ck)
+        if counts is None:
+            mask = self.candidates(steps)
+            counts = {opt: (mask & self.facet_mask(key, opt)).bit_count() if mask else 0 for opt in options}
+            if len(self._counts_cache) < _LIKE_CACHE_MAX:
+                self._counts_cache[ck] = counts
+        return counts
+
+    def nearest(self, filters: Dict[str, Optional[str]], lat: float, lon: float, k: int,
+                max_km: float = NEARBY_MAX_KM) -> List[Tuple[int, float]]:
+        """k ближайших к точке строк, подходящих под фильтры: [(номер строки, км)].
+
+        Широкий фильтр (от 5% мест) — общее KD-дерево с проверкой бита маски;
+        узкий — своё дерево по совпадениям, построенное при первом запросе.
+        """
+        geo = self.geo
+        mask = self.match(filters)
+        if mask == self.all_mask:
+            return geo.nearest(lat, lon, k, max_km=max_km)
+        located = mask & geo.located_mask
+        if located.bit_count() * 20 >= len(geo):
+            return geo.nearest(lat, lon, k, mask=located, max_km=max_km)
+        tree = self._geo_cache.get(located)
+        if tree is None:
+            ids = iter_ids(located)
+            if len(self._geo_cache) >= _GEO_CACHE_MAX:
+                return geo.nearest(lat, lon, k, candidates=ids, max_km=max_km)
+            tree = self._geo_cache[located] = geo.subtree(ids)
+        return geo.nearest(lat, lon, k, tree=tree, max_km=max_km)
+
+    def match_ids(self, filters: Dict[str, Optional[str]]) -> List[int]:
+        return iter_ids(self.match(filters))
+
+    def select(self, filters: Dict[str, Optional[str]]) -> List[Dict[str, Any]]:
+        return [self.rows[i] for i in self.match_ids(filters)]
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class Catalog:
+    """Держит текущий CatalogSnapshot и подменяет его целиком при обновлении."""
+
+    def __init__(self, refresh_sec: int = CATALOG_REFRESH_SEC):
+        self.refresh_sec = refresh_sec
+        self._snap: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._load_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[CatalogSnapshot], None]] = []
+
+    def on_swap(self, fn: Callable[["CatalogSnapshot"], None]):
+        """fn(snapshot) вызывается после каждой подмены среза (сброс кэшей и т.п.)."""
+        self._listeners.append(fn)
+
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        return self._snap
+
+    def _load_rows(self) -> List[Dict[str, Any]]:
+        with db.connect() as conn, DB_QUERY_SECONDS.labels("catalog_load").time():
+            result = conn.execute(text(f"SELECT {projection(conn)} FROM restaurants_v2"))
+            # чистка "nan", разбор метро и HTML карточки — один раз при загрузке
+            return [prepare_item(dict(r)) for r in result.mappings()]
+
+    def refresh(self) -> CatalogSnapshot:
+        """Синхронно перечитывает таблицу и атомарно подменяет срез."""
+        with self._load_lock:
+            started = time.perf_counter()
+            rows = self._load_rows()
+            self._version += 1
+            snap = CatalogSnapshot(rows, self._version)
+            self._snap = snap   # присваивание ссылки атомарно — читатели видят либо старый, либо новый срез
+        for fn in self._listeners:
+            fn(snap)
+        logger.info("[CATALOG] loaded v%s: %s rows in %.0f ms",
+                    snap.version, len(snap), (time.perf_counter() - started) * 1000)
+        return snap
+
+    def request_refresh(self):
+        """Просит фоновый поток перечитать каталог, не дожидаясь таймера."""
+        self._wake.set()
+
+    def _refresh_loop(self):
+        while True:
+            self._wake.wait(self.refresh_sec if self.refresh_sec > 0 else None)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("[CATALOG] refresh failed, keeping v%s",
+                                 self._snap.version if self._snap else 0)
+
+    def start(self):
+        """Первичная загрузка + запуск фонового обновления."""
+        try:
+            self.refresh()
+        except Exception:
+            # без каталога подбор уходит в БД; фоновый поток попробует ещё раз
+            logger.exception("[CATALOG] initial load failed")
+            if self.refresh_sec <= 0:
+                self._wake.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="catalog-refresh", daemon=True)
+            self._thread.start()
+
+
+catalog = Catalog()
@@ -1,7 +1,11 @@
 import os
-from sqlalchemy import create_engine
+import time
+import threading
+from sqlalchemy import create_engine, make_url, event
 from dotenv import load_dotenv
 
+from metrics import DB_CHECKOUT_SECONDS
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -13,4 +17,65 @@ engine = create_engine(
     pool_pre_ping=True,
     pool_size=5,
     max_overflow=10,
-)
\ No newline at end of file
+)
+
+# ----------------- ОЖИДАНИЕ СОЕДИНЕНИЯ -----------------
+# engine.connect() ставит отметку времени, событие checkout пула закрывает замер.
+# Обёртка стоит на самом engine, поэтому учитываются все, кто берёт соединение:
+# db.connect(), engine.begin() в сессиях, dedup, кэше и проверке фото, ingest.
+_checkout = threading.local()
+
+def _timed_connect(connect):
+    def timed(*args, **kwargs):
+        _checkout.started = time.perf_counter()
+        try:
+            return connect(*args, **kwargs)
+        except Exception:
+            # не дождались соединения (таймаут пула, БД недоступна) — ожидание тоже в метрике
+            if _checkout.started is not None:
+                DB_CHECKOUT_SECONDS.observe(time.perf_counter() - _checkout.started)
+            raise
+        finally:
+            _checkout.started = None
+    return timed
+
+@event.listens_for(engine, "checkout")
+def _observe_checkout(dbapi_conn, record, proxy):
+    started = getattr(_checkout, "started", None)
+    if started is not None:   # raw_connection() и прочее мимо engine.connect() не меряем
+        DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+        _checkout.started = None
+
+engine.connect = _timed_connect(engine.connect)
+
+def _unicode_lower(sync_engine):
+    """Встроенный LOWER в SQLite меняет только ASCII; фильтры должны понимать кириллицу, как в Postgres."""
+    if sync_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def _register(dbapi_conn, _record):
+        dbapi_conn.create_function("lower", 1, lambda s: s.lower() if isinstance(s, str) else s)
+
+_unicode_lower(engine)
+
+def connect():
+    """engine.connect(); ожидание соединения из пула попадает в DB_CHECKOUT_SECONDS (см. выше)."""
+    return engine.connect()
+
+# ----------------- ASYNC (для режима aio_app) -----------------
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+_async_engine = None
+
+def get_async_engine():
+    """AsyncEngine на том же DATABASE_URL (asyncpg / aiosqlite), создаётся при первом обращении."""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        url = make_url(DATABASE_URL)
+        driver = ASYNC_DRIVERS.get(url.get_backend_name())
+        if not driver:
+            raise RuntimeError(f"No async driver for {url.get_backend_name()}")
+        _async_engine = create_async_engine(url.set(drivername=driver), pool_pre_ping=True)
+        _unicode_lower(_async_engine.sync_engine)
+    return _async_engine
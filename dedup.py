@@ -0,0 +1,119 @@
+"""Отсев повторно доставленных апдейтов по update_id.
+
+Telegram повторяет апдейт, если вебхук не ответил вовремя. Первый экземпляр
+«занимает» update_id, повторы подтверждаются без обработки. update_id
+занимается уже в очереди чата, после ответа 200, поэтому упавшая обработка
+не повторяется — ошибка остаётся в логе.
+
+    DEDUP_BACKEND=memory | sql | redis   # по умолчанию — как SESSION_BACKEND
+    DEDUP_WINDOW=20000                   # сколько последних update_id помнит процесс
+    DEDUP_TTL=3600                       # сколько секунд помнит общее хранилище
+"""
+import os
+import time
+import threading
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import text
+
+from session_store import SESSION_BACKEND, REDIS_URL
+
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", SESSION_BACKEND)
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "20000"))
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", "3600"))
+
+
+class MemoryDedup:
+    """Кольцевой буфер последних update_id + множество для O(1) проверки."""
+
+    def __init__(self, window: int = DEDUP_WINDOW):
+        self._order: deque = deque()
+        self._seen = set()
+        self.window = window
+        self._lock = threading.Lock()
+
+    def claim(self, update_id: int) -> bool:
+        """True — апдейт новый и теперь наш; False — уже обрабатывался."""
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._seen.add(update_id)
+            self._order.append(update_id)
+            if len(self._order) > self.window:
+                self._seen.discard(self._order.popleft())
+            return True
+
+
+class SQLDedup:
+    """Таблица bot_seen_updates: INSERT … ON CONFLICT DO NOTHING решает, кто первый."""
+
+    _SWEEP_EVERY = 1000
+
+    def __init__(self, engine, ttl: int = DEDUP_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self._claims = 0
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS bot_seen_updates (
+                    update_id  BIGINT PRIMARY KEY,
+                    expires_at DOUBLE PRECISION NOT NULL
+                )
+            """))
+
+    def claim(self, update_id: int) -> bool:
+        now = time.time()
+        with self.engine.begin() as conn:
+            self._claims += 1
+            if self._claims % self._SWEEP_EVERY == 0:
+                conn.execute(text("DELETE FROM bot_seen_updates WHERE expires_at <= :now"), {"now": now})
+            inserted = conn.execute(text("""
+                INSERT INTO bot_seen_updates (update_id, expires_at) VALUES (:u, :e)
+                ON CONFLICT (update_id) DO NOTHING
+            """), {"u": update_id, "e": now + self.ttl}).rowcount
+        return inserted == 1
+
+
+class RedisDedup:
+    """SET NX EX на сервере с протоколом Redis."""
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = DEDUP_TTL, prefix: str = "tgm:u:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("DEDUP_BACKEND=redis требует пакет redis (pip install -r requirements-redis.txt)")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def claim(self, update_id: int) -> bool:
+        return bool(self.client.set(f"{self.prefix}{update_id}", 1, nx=True, ex=self.ttl))
+
+
+class UpdateDeduplicator:
+    """Локальное окно отсекает повторы без сетевых вызовов; общее хранилище — повторы, пришедшие в другой воркер."""
+
+    def __init__(self, shared=None, window: int = DEDUP_WINDOW):
+        self.local = MemoryDedup(window)
+        self.shared = shared
+        self.duplicates = 0
+
+    def claim(self, update_id: Optional[int]) -> bool:
+        if update_id is None:
+            return True
+        if not self.local.claim(update_id) or (self.shared is not None and not self.shared.claim(update_id)):
+            self.duplicates += 1
+            return False
+        return True
+
+
+def make_deduplicator(backend: str = DEDUP_BACKEND) -> UpdateDeduplicator:
+    if backend == "memory":
+        return UpdateDeduplicator()
+    if backend == "sql":
+        from db import engine
+        return UpdateDeduplicator(SQLDedup(engine))
+    if backend == "redis":
+        return UpdateDeduplicator(RedisDedup())
+    raise RuntimeError(f"Unknown DEDUP_BACKEND={backend!r} (memory | sql | redis)")
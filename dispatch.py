@@ -0,0 +1,178 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Callable, List
+
+import requests as rq
+from requests.adapters import HTTPAdapter
+
+from metrics import BOT_API_SECONDS, UPDATE_QUEUE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+TG_ASYNC_SEND = os.getenv("TG_ASYNC_SEND", "1") == "1"     # 0 — слать прямо в потоке вебхука
+TG_SEND_WORKERS = int(os.getenv("TG_SEND_WORKERS", "4"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))            # 0 — обрабатывать апдейт прямо в потоке вебхука
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "100"))    # апдейтов в очереди одного потока
+UPDATE_PUT_TIMEOUT = float(os.getenv("UPDATE_PUT_TIMEOUT", "1"))  # сколько ждать места в полной очереди
+
+
+class ShardedWorkerPool:
+    """Пул потоков, где у каждого потока своя очередь.
+
+    Задачи с одинаковым ключом (chat_id) всегда попадают в одну очередь и
+    выполняются строго по порядку; разные ключи идут параллельно.
+    """
+
+    def __init__(self, workers: int, name: str, maxsize: int = 0, wait_metric=None):
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize) for _ in range(max(1, workers))]
+        self.wait_metric = wait_metric   # Histogram: сколько задача простояла в очереди
+        for i, q in enumerate(self.queues):
+            threading.Thread(target=self._worker, args=(q,), name=f"{name}-{i}", daemon=True).start()
+
+    def shard(self, key: int) -> queue.Queue:
+        return self.queues[hash(key) % len(self.queues)]
+
+    def submit(self, key: int, fn: Callable, *args, **kwargs) -> Future:
+        fut: Future = Future()
+        self.shard(key).put((fut, fn, args, kwargs, time.perf_counter()))
+        return fut
+
+    def offer(self, key: int, timeout: float, fn: Callable, *args) -> Future:
+        """Как submit, но не ждёт места в полной очереди дольше timeout — тогда queue.Full."""
+        fut: Future = Future()
+        self.shard(key).put((fut, fn, args, {}, time.perf_counter()), timeout=timeout)
+        return fut
+
+    def depths(self) -> List[int]:
+        return [q.qsize() for q in self.queues]
+
+    def join(self):
+        """Ждёт, пока все очереди опустеют (для тестов и остановки)."""
+        for q in self.queues:
+            q.join()
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            fut, fn, args, kwargs, enqueued = q.get()
+            if self.wait_metric is not None:
+                self.wait_metric.observe(time.perf_counter() - enqueued)
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        # Future почти никто не читает (send, dispatch) — без лога ошибка пропала бы
+                        logger.exception("%s failed", getattr(fn, "__qualname__", fn))
+                        fut.set_exception(e)
+            finally:
+                q.task_done()
+
+
+class UpdateDispatcher:
+    """Входящие апдейты: строго по порядку внутри чата, параллельно между чатами.
+
+    Без этого два быстрых нажатия в одном чате гонялись за состояние сессии
+    в разных потоках gunicorn, а другие чаты ждали медленный sendPhoto.
+    Очереди ограничены: если очередь чата полна дольше put_timeout, dispatch()
+    возвращает False, и вебхук отвечает ошибкой — Telegram повторит доставку.
+    Принятый апдейт обратно не возвращается: его update_id уже занят в dedup,
+    поэтому ошибка обработки только пишется в лог (и в пуле, и при UPDATE_WORKERS=0).
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], Any], workers: int = UPDATE_WORKERS,
+                 maxsize: int = UPDATE_QUEUE_SIZE, put_timeout: float = UPDATE_PUT_TIMEOUT):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+        self.rejected = 0
+        self.pool = (ShardedWorkerPool(workers, "tg-update", maxsize, wait_metric=UPDATE_QUEUE_SECONDS)
+                     if workers > 0 else None)
+
+    def dispatch(self, chat_id: int, update: Dict[str, Any]) -> bool:
+        if self.pool is None:
+            # UPDATE_WORKERS=0: в потоке вебхука; process_update сам пишет ошибку в лог и не пробрасывает её,
+            # вебхук всё равно отвечает 200 — повторной доставки нет
+            self.handler(update)
+            return True
+        try:
+            self.pool.offer(chat_id, self.put_timeout, self.handler, update)   # ошибки пишет в лог пул
+        except queue.Full:
+            self.rejected += 1
+            logger.warning("update queue full, chat_id=%s update_id=%s", chat_id, update.get("update_id"))
+            return False
+        return True
+
+    def depths(self) -> List[int]:
+        return self.pool.depths() if self.pool is not None else []
+
+    def join(self):
+        if self.pool is not None:
+            self.pool.join()
+
+    def stats(self) -> Dict[str, Any]:
+        depths = self.depths()
+        return {"workers": len(depths), "queue_size": self.maxsize, "queued": sum(depths),
+                "max_depth": max(depths, default=0), "rejected": self.rejected}
+
+
+class BotApi:
+    """Bot API поверх одной keep-alive сессии с пулом соединений."""
+
+    def __init__(self, api_base: str, pool_size: int = TG_SEND_WORKERS):
+        self.api_base = api_base
+        self.session = rq.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def call(self, method: str, payload: Dict[str, Any], timeout: float = 15) -> rq.Response:
+        return self.session.post(f"{self.api_base}/{method}", json=payload, timeout=timeout)
+
+
+class OutboundDispatcher:
+    """Очередь исходящих вызовов Bot API: порядок внутри чата, параллельно между чатами.
+
+    send() сразу возвращает Future; ошибки пишутся в лог из фонового потока.
+    Цепочки с запасным вариантом (sendPhoto -> sendMessage) идут через run().
+    """
+
+    def __init__(self, api: BotApi, workers: int = TG_SEND_WORKERS, async_send: bool = TG_ASYNC_SEND):
+        self.api = api
+        self.pool = ShardedWorkerPool(workers, "tg-send") if async_send else None
+
+    def send(self, chat_id: int, method: str, payload: Dict[str, Any], timeout: float = 15) -> Future:
+        if self.pool is not None:
+            return self.pool.submit(chat_id, self.call, method, payload, timeout)
+        fut: Future = Future()
+        fut.set_result(self.call(method, payload, timeout))
+        return fut
+
+    def run(self, chat_id: int, fn: Callable, *args) -> Future:
+        """Произвольная цепочка вызовов (fn получает сам диспетчер) в очереди этого чата."""
+        if self.pool is not None:
+            return self.pool.submit(chat_id, fn, self, *args)
+        fut: Future = Future()
+        fut.set_result(fn(self, *args))
+        return fut
+
+    def join(self):
+        if self.pool is not None:
+            self.pool.join()
+
+    def call(self, method: str, payload: Dict[str, Any], timeout: float) -> Optional[rq.Response]:
+        started = time.perf_counter()
+        try:
+            resp = self.api.call(method, payload, timeout)
+        except rq.RequestException as e:
+            BOT_API_SECONDS.labels(method, "error").observe(time.perf_counter() - started)
+            logger.error("%s failed | %s", method, e)
+            return None
+        BOT_API_SECONDS.labels(method, resp.status_code).observe(time.perf_counter() - started)
+        if resp.status_code != 200:
+            logger.error("%s %s | %s", method, resp.status_code, resp.text)
+        return resp
@@ -0,0 +1,317 @@
+"""Поиск «рядом»: координаты станций метро и KD-дерево по ресторанам каталога.
+
+Координаты ресторана — из колонок Широта/Долгота, если они есть в
+restaurants_v2, иначе центр его станций из колонки Метро (адрес офлайн не
+геокодируется). Точки переводятся в километры на плоскости вокруг центра
+Москвы: в пределах города ошибка такого приближения — доли процента.
+
+Встроенная таблица станций неполная и приблизительная (±100–200 м);
+дополнить или поправить её можно CSV-файлом `название,широта,долгота`:
+
+    METRO_STATIONS_FILE=stations.csv
+    NEARBY_MAX_KM=5          # дальше этого «рядом» не считается
+"""
+import os
+import csv
+import math
+import heapq
+import logging
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+METRO_STATIONS_FILE = os.getenv("METRO_STATIONS_FILE")
+NEARBY_MAX_KM = float(os.getenv("NEARBY_MAX_KM", "5"))
+
+LAT_COLUMNS = ("Широта", "lat", "latitude")
+LON_COLUMNS = ("Долгота", "lon", "lng", "longitude")
+
+# проекция: градус широты ≈ 111.2 км, градус долготы — в cos(широты) раз меньше
+_KM_PER_DEG = 111.195
+_LAT0, _LON0 = 55.7522, 37.6156
+_KX = _KM_PER_DEG * math.cos(math.radians(_LAT0))
+
+# (широта, долгота) станций метро Москвы
+STATIONS: Dict[str, Tuple[float, float]] = {
+    # центр
+    "Охотный Ряд": (55.7571, 37.6156), "Театральная": (55.7576, 37.6189),
+    "Площадь Революции": (55.7567, 37.6218), "Лубянка": (55.7597, 37.6261),
+    "Кузнецкий Мост": (55.7614, 37.6245), "Китай-город": (55.7565, 37.6319),
+    "Арбатская": (55.7520, 37.6030), "Александровский сад": (55.7523, 37.6087),
+    "Библиотека имени Ленина": (55.7512, 37.6103), "Боровицкая": (55.7502, 37.6092),
+    "Кропоткинская": (55.7454, 37.6036), "Смоленская": (55.7491, 37.5832),
+    "Тверская": (55.7646, 37.6058), "Пушкинская": (55.7657, 37.6041),
+    "Чеховская": (55.7657, 37.6085), "Маяковская": (55.7699, 37.5963),
+    "Чистые пруды": (55.7650, 37.6385), "Тургеневская": (55.7654, 37.6369),
+    "Сретенский бульвар": (55.7661, 37.6356), "Цветной бульвар": (55.7716, 37.6208),
+    "Трубная": (55.7677, 37.6219), "Сухаревская": (55.7723, 37.6327),
+    "Красные ворота": (55.7690, 37.6485), "Новокузнецкая": (55.7424, 37.6293),
+    "Третьяковская": (55.7410, 37.6256), "Полянка": (55.7368, 37.6185),
+    "Баррикадная": (55.7608, 37.5815), "Достоевская": (55.7815, 37.6140),
+    "Чкаловская": (55.7559, 37.6593), "Марксистская": (55.7409, 37.6563),
+    # кольцевая
+    "Киевская": (55.7436, 37.5660), "Краснопресненская": (55.7604, 37.5773),
+    "Белорусская": (55.7774, 37.5820), "Новослободская": (55.7796, 37.6013),
+    "Проспект Мира": (55.7796, 37.6334), "Комсомольская": (55.7753, 37.6547),
+    "Курская": (55.7586, 37.6591), "Таганская": (55.7424, 37.6533),
+    "Павелецкая": (55.7316, 37.6364), "Добрынинская": (55.7290, 37.6225),
+    "Октябрьская": (55.7293, 37.6112), "Парк культуры": (55.7352, 37.5932),
+    # север
+    "Менделеевская": (55.7820, 37.5989), "Савёловская": (55.7940, 37.5871),
+    "Дмитровская": (55.8081, 37.5817), "Тимирязевская": (55.8187, 37.5749),
+    "Петровско-Разумовская": (55.8365, 37.5754), "Владыкино": (55.8482, 37.5901),
+    "Отрадное": (55.8637, 37.6049), "Алтуфьево": (55.8979, 37.5866),
+    "Марьина Роща": (55.7933, 37.6161), "Рижская": (55.7925, 37.6363),
+    "Алексеевская": (55.8078, 37.6386), "ВДНХ": (55.8210, 37.6412),
+    "Ботанический сад": (55.8446, 37.6380), "Свиблово": (55.8553, 37.6530),
+    "Бабушкинская": (55.8696, 37.6640), "Медведково": (55.8881, 37.6616),
+    "Динамо": (55.7897, 37.5582), "Петровский парк": (55.7921, 37.5596),
+    "Аэропорт": (55.8005, 37.5330), "Сокол": (55.8057, 37.5151),
+    "Войковская": (55.8188, 37.4974), "Водный стадион": (55.8399, 37.4869),
+    "Речной вокзал": (55.8549, 37.4760),
+    # северо-запад и запад
+    "Улица 1905 года": (55.7650, 37.5613), "Беговая": (55.7737, 37.5455),
+    "Полежаевская": (55.7773, 37.5178), "Хорошёвская": (55.7766, 37.5207),
+    "ЦСКА": (55.7866, 37.5348), "Шелепиха": (55.7576, 37.5256),
+    "Октябрьское Поле": (55.7936, 37.4934), "Щукинская": (55.8085, 37.4644),
+    "Тушинская": (55.8257, 37.4370), "Планерная": (55.8607, 37.4365),
+    "Строгино": (55.8037, 37.4028), "Митино": (55.8461, 37.3612),
+    "Студенческая": (55.7387, 37.5484), "Кутузовская": (55.7405, 37.5342),
+    "Выставочная": (55.7505, 37.5420), "Деловой центр": (55.7492, 37.5395),
+    "Международная": (55.7483, 37.5333), "Фили": (55.7460, 37.5144),
+    "Багратионовская": (55.7434, 37.4970), "Парк Победы": (55.7363, 37.5166),
+    "Славянский бульвар": (55.7292, 37.4710), "Кунцевская": (55.7306, 37.4466),
+    "Молодёжная": (55.7413, 37.4156), "Крылатское": (55.7568, 37.4081),
+    "Минская": (55.7234, 37.5036), "Ломоносовский проспект": (55.7054, 37.5224),
+    "Раменки": (55.6963, 37.5054),
+    # юго-запад и юг
+    "Фрунзенская": (55.7272, 37.5801), "Спортивная": (55.7224, 37.5619),
+    "Воробьёвы горы": (55.7101, 37.5591), "Университет": (55.6926, 37.5344),
+    "Проспект Вернадского": (55.6766, 37.5051), "Юго-Западная": (55.6637, 37.4830),
+    "Шаболовская": (55.7188, 37.6079), "Ленинский проспект": (55.7069, 37.5851),
+    "Академическая": (55.6875, 37.5733), "Профсоюзная": (55.6777, 37.5626),
+    "Новые Черёмушки": (55.6702, 37.5544), "Калужская": (55.6566, 37.5401),
+    "Беляево": (55.6425, 37.5262), "Тёплый Стан": (55.6189, 37.5056),
+    "Серпуховская": (55.7267, 37.6247), "Тульская": (55.7089, 37.6224),
+    "Нагатинская": (55.6825, 37.6209), "Нагорная": (55.6729, 37.6103),
+    "Нахимовский проспект": (55.6624, 37.6056), "Севастопольская": (55.6515, 37.5982),
+    "Каховская": (55.6530, 37.5968), "Пражская": (55.6113, 37.6031),
+    "Автозаводская": (55.7071, 37.6573), "Коломенская": (55.6778, 37.6634),
+    "Каширская": (55.6544, 37.6486),
+    # восток и юго-восток
+    "Бауманская": (55.7722, 37.6791), "Красносельская": (55.7801, 37.6670),
+    "Сокольники": (55.7893, 37.6800), "Электрозаводская": (55.7821, 37.7053),
+    "Семёновская": (55.7833, 37.7194), "Партизанская": (55.7886, 37.7495),
+    "Измайловская": (55.7876, 37.7813), "Римская": (55.7466, 37.6807),
+    "Площадь Ильича": (55.7473, 37.6812), "Авиамоторная": (55.7517, 37.7172),
+    "Шоссе Энтузиастов": (55.7582, 37.7511), "Перово": (55.7510, 37.7866),
+    "Новогиреево": (55.7518, 37.8166), "Пролетарская": (55.7316, 37.6663),
+    "Крестьянская застава": (55.7323, 37.6653), "Волгоградский проспект": (55.7247, 37.6871),
+    "Текстильщики": (55.7090, 37.7322), "Кузьминки": (55.7055, 37.7632),
+    "Выхино": (55.7158, 37.8179), "Дубровка": (55.7181, 37.6763),
+    "Люблино": (55.6760, 37.7616), "Братиславская": (55.6590, 37.7508),
+    "Марьино": (55.6494, 37.7441),
+}
+
+_STATION_PREFIXES = ("станция метро ", "метро ", "ст. м. ", "ст.м. ", "м. ", "м.", "м ")
+
+
+def station_key(name: str) -> str:
+    """«м. Савеловская», «савёловская » -> один ключ."""
+    s = " ".join(str(name).casefold().replace("ё", "е").split())
+    for prefix in _STATION_PREFIXES:
+        if s.startswith(prefix):
+            return s[len(prefix):].strip()
+    return s
+
+
+def load_stations(path: Optional[str] = METRO_STATIONS_FILE) -> Dict[str, Tuple[str, float, float]]:
+    """{ключ станции: (название, широта, долгота)} — встроенная таблица + METRO_STATIONS_FILE поверх."""
+    stations = {station_key(name): (name, lat, lon) for name, (lat, lon) in STATIONS.items()}
+    if path:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+                try:
+                    stations[station_key(row[0])] = (row[0].strip(), float(row[1]), float(row[2]))
+                except ValueError:
+                    continue   # заголовок или битая строка
+        logger.info("[GEO] %s stations (with %s)", len(stations), path)
+    return stations
+
+
+stations = load_stations()
+
+
+def find_station(text: str) -> Optional[Tuple[str, float, float]]:
+    """Станция по тексту пользователя: точное название или однозначное начало («чист» -> Чистые пруды)."""
+    key = station_key(text)
+    if not key:
+        return None
+    found = stations.get(key)
+    if found is not None:
+        return found
+    if len(key) < 4:
+        return None
+    matches = [v for k, v in stations.items() if k.startswith(key)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def to_xy(lat: float, lon: float) -> Tuple[float, float]:
+    """Широта/долгота -> км на плоскости вокруг центра Москвы."""
+    return (lon - _LON0) * _KX, (lat - _LAT0) * _KM_PER_DEG
+
+
+def format_distance(km: float) -> str:
+    if km < 1:
+        return f"{max(50, round(km * 1000, -1)):.0f} м"
+    return f"{km:.1f} км".replace(".", ",")
+
+
+# ----------------- KD-ДЕРЕВО -----------------
+class KDTree:
+    """Статическое 2-d дерево в трёх списках.
+
+    Узел поддиапазона [lo, hi) — элемент mid = (lo + hi) // 2; слева от него
+    точки с меньшей координатой по оси глубины (x на чётной, y на нечётной).
+    """
+
+    def __init__(self, points: Iterable[Tuple[float, float, int]]):
+        pts = list(points)
+        self._build(pts, 0, len(pts), 0)
+        self.xs = [p[0] for p in pts]
+        self.ys = [p[1] for p in pts]
+        self.ids = [p[2] for p in pts]
+
+    @classmethod
+    def _build(cls, pts: list, lo: int, hi: int, depth: int):
+        if hi - lo <= 1:
+            return
+        axis = depth & 1
+        pts[lo:hi] = sorted(pts[lo:hi], key=lambda p: p[axis])
+        mid = (lo + hi) // 2
+        cls._build(pts, lo, mid, depth + 1)
+        cls._build(pts, mid + 1, hi, depth + 1)
+
+    def nearest(self, x: float, y: float, k: int, member: Optional[bytes] = None,
+                max_d2: float = math.inf) -> List[Tuple[float, int]]:
+        """k ближайших [(квадрат расстояния, id)]; member — битовая маска id (bytes, младший бит первым)."""
+        xs, ys, ids = self.xs, self.ys, self.ids
+        best: List[Tuple[float, int]] = []   # куча (-d2, id): наверху самый дальний из найденных
+        worst = max_d2
+        stack = [(0, len(ids), 0, 0.0)]
+        while stack:
+            lo, hi, depth, bound = stack.pop()
+            if lo >= hi or bound >= worst:
+                continue
+            mid = (lo + hi) // 2
+            px, py, pid = xs[mid], ys[mid], ids[mid]
+            d2 = (px - x) ** 2 + (py - y) ** 2
+            if d2 < worst and (member is None or member[pid >> 3] >> (pid & 7) & 1):
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, pid))
+                else:
+                    heapq.heapreplace(best, (-d2, pid))
+                if len(best) == k:
+                    worst = -best[0][0]
+            diff = (x - px) if not depth & 1 else (y - py)
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            stack.append((far[0], far[1], depth + 1, diff * diff))
+            stack.append((near[0], near[1], depth + 1, 0.0))
+        return sorted((-d, i) for d, i in best)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# ----------------- ИНДЕКС КАТАЛОГА -----------------
+def _float(raw: Any) -> Optional[float]:
+    try:
+        v = float(str(raw).replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+    return v if math.isfinite(v) else None
+
+
+class GeoIndex:
+    """Точки ресторанов среза каталога: KD-дерево + координаты по номеру строки."""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.points: List[Optional[Tuple[float, float]]] = [None] * len(rows)
+        self.unknown_stations: Counter = Counter()
+        by_metro: Dict[tuple, Optional[Tuple[float, float]]] = {}
+        for i, row in enumerate(rows):
+            point = self._explicit(row)
+            if point is None:
+                metro = tuple(row.get("_metro") or ())
+                if metro not in by_metro:
+                    by_metro[metro] = self._centroid(metro)
+                point = by_metro[metro]
+            self.points[i] = point
+        self.tree = KDTree((p[0], p[1], i) for i, p in enumerate(self.points) if p is not None)
+        # строки, у которых есть координаты (для AND с маской фильтров)
+        located = bytearray(len(rows) // 8 + 1)
+        for i in self.tree.ids:
+            located[i >> 3] |= 1 << (i & 7)
+        self.located_mask = int.from_bytes(located, "little")
+
+    @staticmethod
+    def _explicit(row: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+        lat = next((_float(row[c]) for c in LAT_COLUMNS if row.get(c) is not None), None)
+        lon = next((_float(row[c]) for c in LON_COLUMNS if row.get(c) is not None), None)
+        if lat is None or lon is None:
+            return None
+        return to_xy(lat, lon)
+
+    def _centroid(self, metro: tuple) -> Optional[Tuple[float, float]]:
+        found = []
+        for name in metro:
+            station = stations.get(station_key(name))
+            if station is None:
+                self.unknown_stations[name] += 1
+            else:
+                found.append(to_xy(station[1], station[2]))
+        if not found:
+            return None
+        return sum(p[0] for p in found) / len(found), sum(p[1] for p in found) / len(found)
+
+    def subtree(self, ids: Iterable[int]) -> KDTree:
+        """Отдельное дерево по части строк — для узких фильтров, где общее дерево обходит в основном чужие точки."""
+        points = self.points
+        return KDTree((points[i][0], points[i][1], i) for i in ids if points[i] is not None)
+
+    def nearest(self, lat: float, lon: float, k: int, mask: Optional[int] = None,
+                candidates: Optional[List[int]] = None, tree: Optional[KDTree] = None,
+                max_km: float = NEARBY_MAX_KM) -> List[Tuple[int, float]]:
+        """k ближайших [(номер строки, км)]: по общему дереву (с маской строк), по своему дереву tree
+        или перебором списка candidates."""
+        x, y = to_xy(lat, lon)
+        max_d2 = max_km * max_km if max_km else math.inf
+        if candidates is not None:
+            scored = []
+            for i in candidates:
+                p = self.points[i]
+                if p is not None:
+                    d2 = (p[0] - x) ** 2 + (p[1] - y) ** 2
+                    if d2 <= max_d2:
+                        scored.append((d2, i))
+            found = heapq.nsmallest(k, scored)
+        elif tree is not None:
+            found = tree.nearest(x, y, k, None, max_d2)
+        else:
+            member = None if mask is None else (mask & self.located_mask).to_bytes(len(self.points) // 8 + 1, "little")
+            found = self.tree.nearest(x, y, k, member, max_d2)
+        return [(i, math.sqrt(d2)) for d2, i in found]
+
+    def __len__(self):
+        return len(self.tree)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "located": len(self.tree),
+            "rows": len(self.points),
+            "unknown_stations": dict(self.unknown_stations.most_common(10)),
+        }
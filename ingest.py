@@ -0,0 +1,325 @@
+"""Загрузка каталога в restaurants_v2: staging-таблица, COPY и атомарная подмена.
+
+    python ingest.py restaurants.csv
+    python ingest.py dump.jsonl --format jsonl
+    python ingest.py export.parquet               # нужен pyarrow
+    python ingest.py restaurants.csv --dry-run    # только нормализация и отчёт
+
+Нормализация на входе, чтобы на запросе ничего не чистить:
+  • "nan", "None", "null" и пустые строки -> NULL;
+  • Метро -> массив станций (text[] в Postgres, JSON-список в SQLite) вместо строки
+    с Python-списком;
+  • фасеты (Бюджет, Тип заведения, Кухня, атмосфера, повод) приводятся к написанию
+    из options.py, дубликаты внутри ячейки убираются; незнакомые значения
+    остаются как есть и попадают в отчёт.
+
+Строки идут в restaurants_v2_staging (та же схема и генерируемые колонки;
+индексы restaurants_v2 строятся по готовым данным после COPY, а не на каждую
+строку), затем одной транзакцией: старая таблица -> _old, staging ->
+restaurants_v2. Читатели видят либо старый каталог, либо новый целиком.
+Процессы бота перечитают каталог по таймеру (CATALOG_REFRESH_SEC).
+"""
+import os
+import re
+import csv
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import Counter
+from typing import Dict, Any, List, Optional, Iterator, Iterable
+
+from sqlalchemy import text
+
+from render import parse_metro
+from queries import SINGLE_VALUED as SINGLE_VALUED_FILTERS, column_map
+from options import (
+    budget_options, type_options, cuisine_options,
+    atmosphere_options, reason_options
+)
+
+TABLE = "restaurants_v2"
+STAGING = "restaurants_v2_staging"
+OLD = "restaurants_v2_old"
+# индексы staging живут под временными именами, пока старая таблица не удалена
+INDEX_SUFFIX = "__staging"
+_INDEX_DEF = re.compile(r"^(CREATE (?:UNIQUE )?INDEX )(\S+) ON (?:ONLY )?\S+ (USING .*)$", re.S)
+
+# схема по умолчанию, если restaurants_v2 ещё нет
+DEFAULT_COLUMNS = ["Название", "Описание", "Адрес", "Метро", "Кухня", "Тип заведения",
+                   "Бюджет", "Фото", "Ссылка", "Сайт", "атмосфера", "повод"]
+METRO = "Метро"
+NULLS = {"", "nan", "none", "null", "nat"}
+_NULL_MAXLEN = max(map(len, NULLS))
+_MISSING = object()
+
+# колонка в БД -> варианты из options.py
+FACET_OPTIONS = {
+    column_map["Бюджет"]: budget_options,
+    column_map["Тип заведения"]: type_options,
+    column_map["Кухня"]: cuisine_options,
+    column_map["Атмосфера"]: atmosphere_options,
+    column_map["Повод"]: reason_options,
+}
+# у бюджета одно значение на ресторан, запятые бывают внутри («1 000–3 000 ₽»)
+SINGLE_VALUED = {column_map[key] for key in SINGLE_VALUED_FILTERS}
+
+
+# ----------------- ЧТЕНИЕ -----------------
+def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+    elif fmt in ("jsonl", "ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif fmt == "json":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield from (data if isinstance(data, list) else data.get("rows", []))
+    elif fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Для Parquet нужен пакет pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=50_000):
+            yield from batch.to_pylist()
+    else:
+        raise SystemExit(f"Неизвестный формат {fmt!r}: csv | json | jsonl | parquet")
+
+
+# ----------------- НОРМАЛИЗАЦИЯ -----------------
+class Normalizer:
+    """Строка источника -> кортеж значений для staging. Ячейки фасетов повторяются, поэтому ответы запоминаются."""
+
+    def __init__(self, columns: List[str]):
+        self.columns = columns
+        self.canonical = {col: {o.strip().casefold(): o for o in opts} for col, opts in FACET_OPTIONS.items()}
+        self._plan = [(col, {} if col == METRO or col in FACET_OPTIONS else None) for col in columns]
+        self.unknown: Dict[str, Counter] = {col: Counter() for col in FACET_OPTIONS}
+        self.rows = 0
+        self.nulls = 0
+
+    def clean(self, value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            if isinstance(value, float) and value != value:   # NaN из pandas/pyarrow
+                return None
+            value = str(value)
+        s = value.strip()
+        if len(s) <= _NULL_MAXLEN and s.casefold() in NULLS:
+            self.nulls += 1
+            return None
+        return s
+
+    def facet(self, col: str, raw: str) -> Optional[str]:
+        canonical = self.canonical[col]
+        parts = [raw] if col in SINGLE_VALUED else raw.replace(";", ",").split(",")
+        out: List[str] = []
+        for part in parts:
+            p = part.strip()
+            if not p:
+                continue
+            value = canonical.get(p.casefold())
+            if value is None:
+                self.unknown[col][p.lower()] += 1
+                value = p
+            if value not in out:
+                out.append(value)
+        return ", ".join(out) or None
+
+    def _cell(self, col: str, value: Any):
+        if col == METRO:
+            stations = parse_metro(value if isinstance(value, (list, tuple)) else self.clean(value))
+            return stations or None
+        value = self.clean(value)
+        return self.facet(col, value) if value is not None else None
+
+    def __call__(self, raw: Dict[str, Any]) -> tuple:
+        self.rows += 1
+        out = []
+        for col, memo in self._plan:
+            value = raw.get(col)
+            if memo is None:
+                out.append(self.clean(value))
+            elif isinstance(value, str):
+                # значения фасетов и метро повторяются — разбираем каждое один раз
+                cell = memo.get(value, _MISSING)
+                if cell is _MISSING:
+                    cell = memo[value] = self._cell(col, value)
+                elif cell is None:
+                    self.nulls += 1
+                out.append(cell)
+            else:
+                out.append(self._cell(col, value))
+        return tuple(out)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "nulls_cleaned": self.nulls,
+            "unknown_facet_values": {col: dict(c.most_common(10)) for col, c in self.unknown.items() if c},
+        }
+
+
+# ----------------- ЗАГРУЗКА -----------------
+def table_columns(conn, table: str = TABLE) -> Optional[List[str]]:
+    try:
+        keys = list(conn.execute(text(f'SELECT * FROM "{table}" LIMIT 0')).keys())
+    except Exception:
+        conn.rollback()
+        return None
+    # генерируемые колонки (facet_* из migrations/001) считает сама БД
+    return [k for k in keys if not k.startswith("facet_")]
+
+
+def _pg_array(values: Optional[List[str]]) -> Optional[str]:
+    if not values:
+        return None
+    return "{" + ",".join('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values) + "}"
+
+
+def staging_indexes(conn) -> List[str]:
+    """CREATE INDEX для staging по образцу индексов restaurants_v2 (GIN, триграммы, btree)."""
+    rows = conn.execute(text("SELECT indexname, indexdef FROM pg_indexes "
+                             "WHERE schemaname = current_schema() AND tablename = :t"), {"t": TABLE}).all()
+    ddl = []
+    for name, indexdef in rows:
+        m = _INDEX_DEF.match(indexdef)
+        if m is None:
+            print(f"⚠️  индекс {name} не перенесён: {indexdef}", file=sys.stderr)
+            continue
+        ddl.append(f'{m.group(1)}"{name}{INDEX_SUFFIX}" ON "{STAGING}" {m.group(3)}')
+    return ddl
+
+
+def _copy_postgres(engine, columns: List[str], rows: Iterable[tuple], created: bool):
+    """COPY в staging через psycopg2; CSV буферизуется во временный файл (в памяти до 64 МБ).
+
+    Индексы создаются после COPY: построить индекс по готовой таблице в разы
+    быстрее, чем обновлять GIN и триграммы на каждой вставленной строке.
+    """
+    indexes: List[str] = []
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{STAGING}"'))
+        if created:
+            cols = ", ".join(f'"{c}" {"text[]" if c == METRO else "text"}' for c in columns)
+            conn.execute(text(f'CREATE TABLE "{STAGING}" ({cols})'))
+        else:
+            indexes = staging_indexes(conn)
+            conn.execute(text(f'CREATE TABLE "{STAGING}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING GENERATED)'))
+            if METRO in columns:
+                conn.execute(text(f'ALTER TABLE "{STAGING}" ALTER COLUMN "{METRO}" TYPE text[] '
+                                  f'USING NULL::text[]'))
+    metro_at = columns.index(METRO) if METRO in columns else -1
+    buf = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024, mode="w+", encoding="utf-8", newline="")
+    writer = csv.writer(buf)
+    for row in rows:
+        if metro_at >= 0:
+            row = row[:metro_at] + (_pg_array(row[metro_at]),) + row[metro_at + 1:]
+        writer.writerow(row)   # None -> пустое поле без кавычек -> NULL
+    buf.seek(0)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        col_list = ", ".join(f'"{c}"' for c in columns)
+        cur.copy_expert(f'COPY "{STAGING}" ({col_list}) FROM STDIN WITH (FORMAT csv)', buf)
+        for ddl in indexes:
+            cur.execute(ddl)
+        cur.execute(f'ANALYZE "{STAGING}"')
+        raw.commit()
+    finally:
+        raw.close()
+        buf.close()
+
+
+def _copy_sqlite(engine, columns: List[str], rows: Iterable[tuple], created: bool, batch: int = 50_000):
+    """SQLite (локальная разработка, бенчмарки): executemany пачками, Метро — JSON-список."""
+    metro_at = columns.index(METRO) if METRO in columns else -1
+    marks = ", ".join(f":c{i}" for i in range(len(columns)))
+    col_list = ", ".join(f'"{c}"' for c in columns)
+    col_defs = ", ".join(f'"{c}" TEXT' for c in columns)
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{STAGING}"'))
+        conn.execute(text(f'CREATE TABLE "{STAGING}" ({col_defs})'))
+        insert = text(f'INSERT INTO "{STAGING}" ({col_list}) VALUES ({marks})')
+        chunk: List[Dict[str, Any]] = []
+        for row in rows:
+            if metro_at >= 0 and row[metro_at] is not None:
+                row = row[:metro_at] + (json.dumps(row[metro_at], ensure_ascii=False),) + row[metro_at + 1:]
+            chunk.append({f"c{i}": v for i, v in enumerate(row)})
+            if len(chunk) >= batch:
+                conn.execute(insert, chunk)
+                chunk.clear()
+        if chunk:
+            conn.execute(insert, chunk)
+
+
+def swap(engine, created: bool):
+    """staging -> restaurants_v2 одной транзакцией; старая таблица удаляется после подмены."""
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+        conn.execute(text(f'DROP TABLE IF EXISTS "{OLD}"'))
+        if not created:
+            conn.execute(text(f'ALTER TABLE "{TABLE}" RENAME TO "{OLD}"'))
+        conn.execute(text(f'ALTER TABLE "{STAGING}" RENAME TO "{TABLE}"'))
+        conn.execute(text(f'DROP TABLE IF EXISTS "{OLD}"'))
+        if engine.dialect.name == "postgresql":
+            # старые индексы ушли вместе с _old — возвращаем их имена
+            names = conn.execute(text("SELECT indexname FROM pg_indexes "
+                                      "WHERE schemaname = current_schema() AND tablename = :t"),
+                                 {"t": TABLE}).scalars()
+            for name in [n for n in names if n.endswith(INDEX_SUFFIX)]:
+                conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name[:-len(INDEX_SUFFIX)]}"'))
+
+
+def ingest(engine, source: Iterable[Dict[str, Any]], dry_run: bool = False) -> Dict[str, Any]:
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        columns = table_columns(conn)
+    created = columns is None
+    columns = columns or DEFAULT_COLUMNS
+    normalize = Normalizer(columns)
+    rows = (normalize(r) for r in source)
+
+    if dry_run:
+        for _ in rows:
+            pass
+    elif engine.dialect.name == "postgresql":
+        _copy_postgres(engine, columns, rows, created)
+    else:
+        _copy_sqlite(engine, columns, rows, created)
+    loaded = time.perf_counter()
+    if not dry_run:
+        swap(engine, created)
+
+    report = normalize.report()
+    report.update({
+        "dry_run": dry_run,
+        "columns": columns,
+        "load_s": round(loaded - started, 2),
+        "swap_s": round(time.perf_counter() - loaded, 3),
+    })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source")
+    parser.add_argument("--format", choices=["csv", "json", "jsonl", "ndjson", "parquet"])
+    parser.add_argument("--dry-run", action="store_true", help="только нормализация и отчёт, без записи")
+    args = parser.parse_args()
+
+    from db import engine
+    report = ingest(engine, read_rows(args.source, args.format), dry_run=args.dry_run)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
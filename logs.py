@@ -0,0 +1,124 @@
+"""Логи без работы в потоке запроса: выборка по категориям, очередь и JSON в отдельном потоке.
+
+    LOG_LEVEL=INFO                       # как раньше
+    LOG_FORMAT=json | text               # структурированные записи или прежний формат строк
+    LOG_SAMPLE=update=0.01               # доля записей категории, которая попадает в лог
+    LOG_QUEUE_SIZE=10000                 # переполнение очереди — запись отбрасывается, а не ждёт
+
+Категория задаётся через extra={"category": "update"}. WARNING и выше пишутся
+всегда. Аргументы сообщения форматируются только в потоке-писателе, поэтому
+тяжёлую сериализацию стоит заворачивать в LazyJSON.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from typing import Dict, Any, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+
+def parse_rates(raw: str) -> Dict[str, float]:
+    rates = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            rates[name.strip()] = float(value)
+    return rates
+
+
+LOG_SAMPLE = parse_rates(os.getenv("LOG_SAMPLE", "update=0.01"))
+
+
+class LazyJSON:
+    """json.dumps откладывается до момента, когда запись действительно пишется."""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "category", ""), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь как есть: без форматирования и без ожидания при переполнении."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, app: str):
+        super().__init__()
+        self.app = app
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "app": self.app,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        category = getattr(record, "category", None)
+        if category:
+            data["category"] = category
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(app: str):
+    """Заменяет logging.basicConfig: корневой логгер пишет через очередь и фоновый поток."""
+    global _listener
+    if _listener is not None:
+        return
+    if LOG_FORMAT == "text":
+        formatter = logging.Formatter(f"%(asctime)s [{app}] %(levelname)s: %(message)s")
+    else:
+        formatter = JSONFormatter(app)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(formatter)
+
+    q: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(q)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(q, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
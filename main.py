@@ -1,27 +1,29 @@
 import os
 import logging
-import ast
-import asyncio
-import functools
-import requests
 
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
+    ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes,
+    filters as tg_filters
 )
 
 from options import (
     budget_options, type_options, cuisine_options,
     atmosphere_options, reason_options
 )
+import service
+from callbacks import CallbackCodec, MORE, PAGE, RESTART, SELECT
+from logs import setup_logging
+from geo import find_station, format_distance
+from resolver import make_resolvers
+from service import format_card, filters_from_params
 
 # ----------------- ЛОГИ -----------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [BOT] %(levelname)s: %(message)s")
+setup_logging("BOT")
 logger = logging.getLogger(__name__)
 
 # ----------------- КОНФИГ -----------------
 BOT_TOKEN = os.environ.get("BOT_TOKEN")  # Задай в Railway → Variables
-API_URL = "http://127.0.0.1:8080/recommend"  # локально внутри сервиса (смотрим по логам Flask)
 
 user_state = {}
 
@@ -32,35 +34,35 @@ category_options_map = {
     "atmosphere": atmosphere_options,
     "reason": reason_options
 }
+category_order = ["budget", "type", "cuisine", "atmosphere", "reason"]
+callbacks = CallbackCodec(category_order, category_options_map)
+resolvers = make_resolvers(category_options_map)
 
 # ----------------- УТИЛИТЫ -----------------
-def normalize(value, options_list):
-    if not value:
-        return value
-    for opt in options_list:
-        if value.strip().lower() == opt.strip().lower():
-            return opt
-    return value
-
-def build_keyboard(options, prefix, page=0, page_size=10):
+def _build_keyboard(options, prefix, page=0, page_size=10):
     start = page * page_size
     end = start + page_size
-    keyboard = [[InlineKeyboardButton(opt, callback_data=f"{prefix}:{opt}")] for opt in options[start:end]]
+    keyboard = [[InlineKeyboardButton(opt, callback_data=callbacks.select(prefix, opt))] for opt in options[start:end]]
     nav = []
     if page > 0:
-        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{prefix}_page:{page - 1}"))
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=callbacks.page(prefix, page - 1)))
     if end < len(options):
-        nav.append(InlineKeyboardButton("➡️ Далее", callback_data=f"{prefix}_page:{page + 1}"))
+        nav.append(InlineKeyboardButton("➡️ Далее", callback_data=callbacks.page(prefix, page + 1)))
     if nav:
         keyboard.append(nav)
-    keyboard.append([InlineKeyboardButton("🔁 Начать заново", callback_data="restart")])
+    keyboard.append([InlineKeyboardButton("🔁 Начать заново", callback_data=callbacks.restart)])
     return InlineKeyboardMarkup(keyboard)
 
-async def fetch_api(url, params):
-    """Неблокирующий requests.get + timeout."""
-    loop = asyncio.get_running_loop()
-    fn = functools.partial(requests.get, url, params=params, timeout=15)
-    return await loop.run_in_executor(None, fn)
+# все (категория, страница) собираются один раз при импорте
+_KEYBOARDS = {
+    key: [_build_keyboard(options, key, page) for page in range(max(1, -(-len(options) // 10)))]
+    for key, options in category_options_map.items()
+}
+
+def build_keyboard(prefix, page=0):
+    """Готовая клавиатура шага prefix (варианты — из category_options_map)."""
+    pages = _KEYBOARDS[prefix]
+    return pages[min(page, len(pages) - 1)]
 
 # ----------------- ХЕНДЛЕРЫ -----------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -68,41 +70,58 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_state[user_id] = {}
     await update.message.reply_text(
         "Привет! Давай подберём тебе ресторан. Сначала выбери бюджет:",
-        reply_markup=build_keyboard(budget_options, 'budget')
+        reply_markup=build_keyboard('budget')
     )
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    data = query.data
+    action = callbacks.decode(query.data or "")
+    if action is None:
+        return
 
-    if data == "restart":
+    if action.action == RESTART:
         user_state[user_id] = {}
         await query.edit_message_text(
             "Окей! Сначала выбери бюджет:",
-            reply_markup=build_keyboard(budget_options, 'budget')
+            reply_markup=build_keyboard('budget')
         )
         return
 
-    if "_page:" in data:
-        prefix, page = data.split("_page:")
-        page = int(page)
+    if action.action == PAGE:
+        prefix, page = action.key, action.page
         await query.edit_message_text(
             f"Выбери {prefix}:",
-            reply_markup=build_keyboard(category_options_map[prefix], prefix, page)
+            reply_markup=build_keyboard(prefix, page)
         )
         return
 
-    category, value = data.split(":", 1)
-    user_state[user_id][category] = value
+    if action.action == MORE:
+        # «Ещё варианты» из вебхук-бота: колоды здесь нет, поэтому — новая случайная подборка по тем же выборам
+        state = user_state.get(user_id)
+        if not state:
+            await query.edit_message_text(
+                "Подборка устарела. Начнём заново — выбери бюджет:",
+                reply_markup=build_keyboard('budget')
+            )
+            return
+        await show_recommendations(query, state)
+        return
+
+    if action.action != SELECT:
+        logger.warning("Неизвестный callback: %r", query.data)
+        return
+
+    category, value = action.key, action.value
+    user_state.setdefault(user_id, {})[category] = value
 
     next_step = {
-        "budget": ("Выбери тип заведения:", type_options, 'type'),
-        "type": ("Выбери кухню:", cuisine_options, 'cuisine'),
-        "cuisine": ("Выбери атмосферу:", atmosphere_options, 'atmosphere'),
-        "atmosphere": ("Выбери повод:", reason_options, 'reason'),
-        "reason": ("Отлично! Вот подборка для тебя:", None, None)
+        "budget": ("Выбери тип заведения:", 'type'),
+        "type": ("Выбери кухню:", 'cuisine'),
+        "cuisine": ("Выбери атмосферу:", 'atmosphere'),
+        "atmosphere": ("Выбери повод:", 'reason'),
+        "reason": ("Отлично! Вот подборка для тебя:", None)
     }
 
     if category == "reason":
@@ -111,68 +130,35 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_recommendations(query, user_state[user_id])
         return
 
-    msg, options, next_key = next_step[category]
-    await query.edit_message_text(msg, reply_markup=build_keyboard(options, next_key))
+    msg, next_key = next_step[category]
+    await query.edit_message_text(msg, reply_markup=build_keyboard(next_key))
 
 MAX_CAPTION_LENGTH = 1024
 
 async def show_recommendations(query, filters):
-    params = {
-        "budget": normalize(filters.get("budget"), budget_options),
-        "type": normalize(filters.get("type"), type_options),
-        "cuisine": normalize(filters.get("cuisine"), cuisine_options),
-        "atmosphere": normalize(filters.get("atmosphere"), atmosphere_options),
-        "reason": normalize(filters.get("reason"), reason_options)
-    }
+    params = {key: resolvers[key].normalize(filters.get(key)) for key in category_order}
 
-    # Логируем сам вызов API
-    logger.info(f"🔎 Вызов show_recommendations, API_URL={API_URL}, params={params}")
+    filters = filters_from_params(params)
+    logger.info(f"🔎 Вызов show_recommendations, filters={filters}")
 
-    # 3 попытки на случай «сонного» контейнера/сети
-    for attempt in range(3):
-        try:
-            response = await fetch_api(API_URL, params)
-            logger.info(f"📬 Ответ от API (попытка {attempt+1}/3): {response.status_code} {response.text[:500]}")
-            data = response.json()
-            break
-        except Exception as e:
-            logger.warning(f"⚠️ Проблема с API (попытка {attempt+1}/3): {e}")
-            if attempt < 2:
-                await asyncio.sleep(2 * (attempt + 1))
-            else:
-                await query.edit_message_text("Ошибка при получении данных. Попробуйте позже.")
-                return
-
-    if not data or (isinstance(data, dict) and data.get("message")):
-        await query.edit_message_text("Ничего не нашлось по твоим критериям. Попробуй снова с другими настройками.")
+    # подбор в этом же процессе: каталог в памяти, а в БД — через ограниченный пул потоков сервиса
+    try:
+        items = await service.asample_rows(filters, 3)
+    except Exception:
+        logger.exception("⚠️ Ошибка подбора")
+        await query.edit_message_text("Ошибка при получении данных. Попробуйте позже.")
         return
 
-    for place in data[:3]:
-        text = f"<b>{place.get('name', 'Без названия')}</b>\n"
-        if place.get("description"):
-            text += f"{place['description']}\n"
-        if place.get("address"):
-            text += f"📍 {place['address']}\n"
-
-        metro_raw = place.get("metro", "")
-        try:
-            metro_list = ast.literal_eval(metro_raw)
-            metro_str = ", ".join(metro_list) if isinstance(metro_list, list) else str(metro_list)
-        except Exception:
-            metro_str = str(metro_raw) if metro_raw else "—"
-        if metro_str:
-            text += f"🚇 {metro_str}\n"
-
-        if place.get("link"):
-            text += f"<a href=\"{place['link']}\">Подробнее</a>\n"
-
-        reason = place.get("ai_reason") or "Подходит по выбранным параметрам."
-        text += f"\n🤖 {reason}"
+    if not items:
+        await query.edit_message_text("Ничего не нашлось по твоим критериям. Попробуй снова с другими настройками.")
+        return
 
+    for item in items:
+        text = format_card(item, filters)
         if len(text) > MAX_CAPTION_LENGTH:
             text = text[:MAX_CAPTION_LENGTH - 3] + "..."
 
-        photo = place.get("photo") or "https://via.placeholder.com/640x360.png?text=No+Image"
+        photo = item.get("Фото") or "https://via.placeholder.com/640x360.png?text=No+Image"
 
         try:
             await query.message.reply_photo(photo=photo, caption=text, parse_mode="HTML")
@@ -182,14 +168,54 @@ async def show_recommendations(query, filters):
 
     await query.message.reply_text(
         "Хочешь попробовать другой подбор? Нажми /start или кнопку ниже 👇",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Начать заново", callback_data="restart")]])
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Начать заново", callback_data=callbacks.restart)]])
     )
 
+# ----------------- РЯДОМ -----------------
+LOCATION_KEYBOARD = ReplyKeyboardMarkup([[KeyboardButton("📍 Отправить геопозицию", request_location=True)]],
+                                        resize_keyboard=True, one_time_keyboard=True)
+
+async def near(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    station = find_station(" ".join(context.args)) if context.args else None
+    if station is None:
+        await update.message.reply_text("Отправь геопозицию или напиши /near и станцию метро — покажу, что рядом 📍",
+                                        reply_markup=LOCATION_KEYBOARD)
+        return
+    name, lat, lon = station
+    await show_nearby(update, lat, lon, f"от м. {name}")
+
+async def near_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    loc = update.message.location
+    await show_nearby(update, loc.latitude, loc.longitude, "от тебя")
+
+async def show_nearby(update: Update, lat: float, lon: float, origin: str):
+    # выборы мастера, если он уже пройден хотя бы частично, тоже учитываются
+    state = user_state.get(update.effective_user.id, {})
+    filters = filters_from_params({k: resolvers[k].normalize(state.get(k)) for k in category_order})
+    found = service.nearby_rows(filters, lat, lon, 3)
+    if found is None:
+        await update.message.reply_text("Каталог ещё загружается, попробуй через минуту 🙏")
+        return
+    if not found:
+        await update.message.reply_text("Рядом ничего подходящего не нашлось 🍽️ Попробуй /start с другими настройками.")
+        return
+    for item, km in found:
+        text = format_card(item, filters, f"{format_distance(km)} {origin}")
+        if len(text) > MAX_CAPTION_LENGTH:
+            text = text[:MAX_CAPTION_LENGTH - 3] + "..."
+        photo = item.get("Фото") or "https://via.placeholder.com/640x360.png?text=No+Image"
+        try:
+            await update.message.reply_photo(photo=photo, caption=text, parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Ошибка отправки фото: {e}")
+            await update.message.reply_text(text, parse_mode="HTML")
+
 # ----------------- СТАРТ ПРИЛОЖЕНИЯ -----------------
 async def on_startup(app):
     # Снять webhook, чтобы polling не ловил 409/Conflict
     await app.bot.delete_webhook(drop_pending_updates=True)
     logger.info("Webhook удалён, запускаю polling…")
+    service.start()
 
 def build_application():
     if not BOT_TOKEN:
@@ -204,7 +230,9 @@ def build_application():
 def main():
     app = build_application()
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("near", near))
     app.add_handler(CallbackQueryHandler(handle_callback))
+    app.add_handler(MessageHandler(tg_filters.LOCATION, near_location))
     logger.info("Бот запущен…")
     # drop_pending_updates — на всякий случай чистим бэклог
     app.run_polling(allowed_updates=list(), drop_pending_updates=True)
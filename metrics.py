@@ -0,0 +1,231 @@
+"""Метрики в текстовом формате Prometheus (/metrics) без внешних зависимостей.
+
+Запись почти без блокировок: каждый поток пишет в свой «шард» счётчиков,
+а при чтении /metrics шарды суммируются. Лок берётся только при первом
+обращении потока к метрике и при появлении нового набора меток.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple, Callable, Optional
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_float(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class _Sharded:
+    """Хранилище по потокам: shard() отдаёт список, в который пишет только текущий поток."""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._shards: List[list] = []
+        self._lock = threading.Lock()
+
+    def shard(self) -> list:
+        s = getattr(self._local, "s", None)
+        if s is None:
+            s = [0] * self._size
+            with self._lock:
+                self._shards.append(s)
+            self._local.s = s
+        return s
+
+    def total(self) -> list:
+        out = [0] * self._size
+        with self._lock:
+            shards = list(self._shards)
+        for s in shards:
+            for i, v in enumerate(s):
+                out[i] += v
+        return out
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: Any):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels(*[""] * len(self.labelnames)) if not self.labelnames else None
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._expose_child(key, child))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.data = _Sharded(1)
+
+    def inc(self, amount: float = 1):
+        self.data.shard()[0] += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def _expose_child(self, key, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_float(child.data.total()[0])}"]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.data = _Sharded(len(buckets) + 2)   # [по корзинам..., +Inf, сумма]
+
+    def observe(self, value: float):
+        s = self.data.shard()
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _expose_child(self, key, child):
+        totals = child.data.total()
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), totals[:-1]):
+            cumulative += n
+            le = 'le="%s"' % ("+Inf" if bound == float("inf") else _fmt_float(bound))
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _fmt_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_fmt_float(totals[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение читается функцией в момент запроса /metrics (размер кэша, пул соединений…)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Any], labelnames: Tuple[str, ...] = (),
+                 kind: str = "gauge"):
+        super().__init__(name, doc, labelnames)
+        self.fn = fn   # без меток — число, с метками — {(значения меток): число}
+        self.kind = kind   # "counter", если fn отдаёт монотонный счётчик, который ведёт кто-то другой
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, v in sorted(items):
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, tuple(key))} {_fmt_float(v)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, doc, labelnames))
+
+    def histogram(self, name: str, doc: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, doc, labelnames, buckets))
+
+    def gauge(self, name: str, doc: str, fn: Callable[[], Any], labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, doc, fn, labelnames))
+
+    def counter_fn(self, name: str, doc: str, fn: Callable[[], Any], labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, doc, fn, labelnames, kind="counter"))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ----------------- МЕТРИКИ ГОРЯЧЕГО ПУТИ -----------------
+WEBHOOK_SECONDS = registry.histogram(
+    "tgm_webhook_seconds", "Время обработки апдейта в telegram_webhook", ("type",))
+UPDATES_TOTAL = registry.counter(
+    "tgm_updates_total", "Апдейты Telegram по типу", ("type",))
+DB_QUERY_SECONDS = registry.histogram(
+    "tgm_db_query_seconds", "Время запросов к БД (подсчёт и выборка совпадений)", ("op",))
+DB_CHECKOUT_SECONDS = registry.histogram(
+    "tgm_db_pool_checkout_seconds", "Ожидание соединения из пула SQLAlchemy (db.engine)")
+BOT_API_SECONDS = registry.histogram(
+    "tgm_bot_api_seconds", "Задержка вызовов Bot API", ("method", "status"))
+RENDER_SECONDS = registry.histogram(
+    "tgm_render_seconds", "Сборка карточки (format_card)",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01))
+UPDATE_QUEUE_SECONDS = registry.histogram(
+    "tgm_update_queue_wait_seconds", "Ожидание апдейта в очереди своего чата до начала обработки")
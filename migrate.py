@@ -0,0 +1,160 @@
+"""Версионные миграции схемы restaurants_v2.
+
+    python migrate.py                 # применить новые скрипты из migrations/
+    python migrate.py status          # что применено, что нет
+    python migrate.py explain [N]     # EXPLAIN ANALYZE запроса подбора до/после миграций на N синтетических строк
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+EXPLAIN_SCHEMA = "explain_bench"
+
+
+def list_scripts():
+    """[(версия, путь)] по порядку: 001_facet_arrays.sql -> ("001", ...)."""
+    return sorted((p.name.split("_", 1)[0], p) for p in MIGRATIONS_DIR.glob("*.sql"))
+
+
+def ensure_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    text PRIMARY KEY,
+            name       text NOT NULL,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def applied_versions(conn):
+    return {r[0] for r in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def run_script(conn, path: Path):
+    # exec_driver_sql: скрипт уходит в драйвер как есть, без разбора :параметров
+    conn.exec_driver_sql(path.read_text(encoding="utf-8"))
+
+
+def apply_all(engine):
+    with engine.begin() as conn:
+        ensure_table(conn)
+        done = applied_versions(conn)
+    pending = [(v, p) for v, p in list_scripts() if v not in done]
+    if not pending:
+        print("✅ Все миграции уже применены")
+        return
+    for version, path in pending:
+        print(f"▶️  {path.name} …", flush=True)
+        started = time.perf_counter()
+        # каждая миграция — своя транзакция: упала — схема осталась как была
+        with engine.begin() as conn:
+            run_script(conn, path)
+            conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+                         {"v": version, "n": path.name})
+        print(f"✅ {path.name} за {time.perf_counter() - started:.1f} с")
+
+
+def status(engine):
+    with engine.begin() as conn:
+        ensure_table(conn)
+        done = applied_versions(conn)
+    for version, path in list_scripts():
+        mark = "✅" if version in done else "⏳"
+        print(f"  {mark} {path.name}")
+
+
+def explain(engine, rows: int):
+    """Синтетический restaurants_v2 в отдельной схеме, планы до и после миграций."""
+    from options import (
+        budget_options, type_options, cuisine_options,
+        atmosphere_options, reason_options
+    )
+    from queries import build_filter_query
+
+    samples = [
+        {"Кухня": "Грузинская кухня"},
+        {"Бюджет": "До 1000 ₽", "Тип заведения": "Кафе", "Повод": "Завтрак / кофе"},
+        {"Бюджет": "3000–6000 ₽", "Тип заведения": "Ресторан", "Кухня": "Итальянская кухня",
+         "Атмосфера": "Романтика", "Повод": "Ужин вдвоем"},
+        {"Кухня": "грузин"},   # свободный текст из чата
+    ]
+
+    def show_plans(conn, facet_columns: bool):
+        for filters in samples:
+            query, params = build_filter_query(filters, facet_columns=facet_columns)
+            print(f"\n🔎 {filters}\n   {query}")
+            plan = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + query), params).fetchall()
+            for line in plan:
+                print("   ", line[0])
+
+    print(f"🧪 Генерирую {rows} строк в схеме {EXPLAIN_SCHEMA}…", flush=True)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {EXPLAIN_SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {EXPLAIN_SCHEMA}"))
+        conn.execute(text(f"SET LOCAL search_path TO {EXPLAIN_SCHEMA}, public"))
+        conn.execute(text("""
+            CREATE TABLE restaurants_v2 (
+                "Название" text, "Описание" text, "Адрес" text, "Метро" text,
+                "Кухня" text, "Тип заведения" text, "Бюджет" text, "Фото" text,
+                "Ссылка" text, "атмосфера" text, "повод" text
+            )
+        """))
+        conn.execute(text("""
+            INSERT INTO restaurants_v2
+            SELECT 'Место ' || g, 'Описание ' || g, 'ул. Примерная, ' || g, '[''Арбатская'']',
+                   lower(o.c[1 + floor(random() * cardinality(o.c))::int]) || ', ' ||
+                   lower(o.c[1 + floor(random() * cardinality(o.c))::int]),
+                   lower(o.t[1 + floor(random() * cardinality(o.t))::int]),
+                   o.b[1 + floor(random() * cardinality(o.b))::int],
+                   'https://example.com/' || g || '.jpg', 'https://example.com/' || g,
+                   lower(o.a[1 + floor(random() * cardinality(o.a))::int]),
+                   lower(o.r[1 + floor(random() * cardinality(o.r))::int]) || ', ' ||
+                   lower(o.r[1 + floor(random() * cardinality(o.r))::int])
+            FROM generate_series(1, :rows) g,
+                 (SELECT CAST(:c AS text[]) c, CAST(:t AS text[]) t, CAST(:b AS text[]) b,
+                         CAST(:a AS text[]) a, CAST(:r AS text[]) r) o
+        """), {"rows": rows, "c": cuisine_options, "t": type_options, "b": budget_options,
+               "a": atmosphere_options, "r": reason_options})
+        conn.execute(text("ANALYZE restaurants_v2"))
+
+        print("\n==================== ДО миграций ====================")
+        show_plans(conn, facet_columns=False)
+
+        for _, path in list_scripts():
+            print(f"\n▶️  {path.name} …", flush=True)
+            run_script(conn, path)
+
+        print("\n==================== ПОСЛЕ миграций ====================")
+        show_plans(conn, facet_columns=True)
+
+        conn.execute(text(f"DROP SCHEMA {EXPLAIN_SCHEMA} CASCADE"))
+
+
+def main():
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ DATABASE_URL не задан. Укажи переменную окружения или .env")
+        sys.exit(1)
+    engine = create_engine(database_url, pool_pre_ping=True)
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "apply"
+    if cmd == "apply":
+        apply_all(engine)
+    elif cmd == "status":
+        status(engine)
+    elif cmd == "explain":
+        explain(engine, int(sys.argv[2]) if len(sys.argv) > 2 else 500_000)
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
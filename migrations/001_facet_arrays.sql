@@ -0,0 +1,35 @@
+-- Нормализованные фасеты для run_query: массивы значений в нижнем регистре + индексы.
+-- В ячейках несколько значений через запятую: «итальянская кухня, европейская кухня».
+-- Бюджет — одно значение на ячейку (queries.SINGLE_VALUED): сравнивается вся ячейка.
+-- Генерируемые колонки пересчитываются самим Postgres при INSERT/UPDATE.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE restaurants_v2
+    ADD COLUMN IF NOT EXISTS facet_budget text
+        GENERATED ALWAYS AS (lower(btrim("Бюджет"))) STORED,
+    ADD COLUMN IF NOT EXISTS facet_type text[]
+        GENERATED ALWAYS AS (regexp_split_to_array(lower(btrim("Тип заведения")), '\s*[,;]\s*')) STORED,
+    ADD COLUMN IF NOT EXISTS facet_cuisine text[]
+        GENERATED ALWAYS AS (regexp_split_to_array(lower(btrim("Кухня")), '\s*[,;]\s*')) STORED,
+    ADD COLUMN IF NOT EXISTS facet_atmosphere text[]
+        GENERATED ALWAYS AS (regexp_split_to_array(lower(btrim("атмосфера")), '\s*[,;]\s*')) STORED,
+    ADD COLUMN IF NOT EXISTS facet_reason text[]
+        GENERATED ALWAYS AS (regexp_split_to_array(lower(btrim("повод")), '\s*[,;]\s*')) STORED;
+
+-- точные значения из кнопок: = / @>
+CREATE INDEX IF NOT EXISTS rv2_facet_budget_idx     ON restaurants_v2 (facet_budget);
+CREATE INDEX IF NOT EXISTS rv2_facet_type_idx       ON restaurants_v2 USING gin (facet_type);
+CREATE INDEX IF NOT EXISTS rv2_facet_cuisine_idx    ON restaurants_v2 USING gin (facet_cuisine);
+CREATE INDEX IF NOT EXISTS rv2_facet_atmosphere_idx ON restaurants_v2 USING gin (facet_atmosphere);
+CREATE INDEX IF NOT EXISTS rv2_facet_reason_idx     ON restaurants_v2 USING gin (facet_reason);
+
+-- свободный текст (LOWER(col) LIKE по подстроке) — триграммы
+CREATE INDEX IF NOT EXISTS rv2_budget_trgm_idx     ON restaurants_v2 USING gin (lower("Бюджет") gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS rv2_type_trgm_idx       ON restaurants_v2 USING gin (lower("Тип заведения") gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS rv2_cuisine_trgm_idx    ON restaurants_v2 USING gin (lower("Кухня") gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS rv2_atmosphere_trgm_idx ON restaurants_v2 USING gin (lower("атмосфера") gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS rv2_reason_trgm_idx     ON restaurants_v2 USING gin (lower("повод") gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS rv2_name_trgm_idx       ON restaurants_v2 USING gin (lower("Название") gin_trgm_ops);
+
+ANALYZE restaurants_v2;
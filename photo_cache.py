@@ -0,0 +1,211 @@
+"""file_id фотографий, уже загруженных в Telegram: повторная отправка — без скачивания по URL.
+
+    PHOTO_CACHE=1                 # 0 — всегда слать URL, как раньше
+    PHOTO_CACHE_CHAT_ID=-100…     # чат для прогрева (бот должен уметь туда писать)
+
+Прогрев — заранее загрузить фото всего каталога в служебный чат:
+
+    python photo_cache.py warm --chat-id -100123456 --rate 1
+    python photo_cache.py status
+
+Ключ — (Название, URL фото): сменился URL — это уже другая картинка.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+PHOTO_CACHE = os.getenv("PHOTO_CACHE", "1") == "1"
+PHOTO_CACHE_CHAT_ID = os.getenv("PHOTO_CACHE_CHAT_ID")
+
+
+def largest_file_id(message: Dict[str, Any]) -> Optional[str]:
+    """file_id самого большого размера из Message.photo (Telegram отдаёт размеры по возрастанию)."""
+    sizes = message.get("photo") or []
+    return sizes[-1].get("file_id") if sizes else None
+
+
+def result_messages(resp) -> List[Dict[str, Any]]:
+    """Message (sendPhoto) или список Message (sendMediaGroup) из ответа Bot API."""
+    try:
+        result = resp.json().get("result")
+    except (ValueError, AttributeError):
+        return []
+    if isinstance(result, dict):
+        return [result]
+    return [m for m in result or [] if isinstance(m, dict)]
+
+
+class PhotoCache:
+    """(ресторан, URL) -> file_id: словарь в памяти + таблица bot_photo_cache.
+
+    Без engine — только память (бенчмарки). Чужие записи (другие воркеры,
+    прогрев) подтягиваются через reload(), например при подмене среза каталога.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self._ids: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        # таблица создаётся при первом походе в БД, а не в конструкторе:
+        # app.py импортируется и без доступной БД, как и до кэша file_id
+        self._table_ready = False
+
+    def _ensure_table(self):
+        if self._table_ready:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS bot_photo_cache (
+                    restaurant TEXT NOT NULL,
+                    url        TEXT NOT NULL,
+                    file_id    TEXT NOT NULL,
+                    updated_at DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY (restaurant, url)
+                )
+            """))
+        self._table_ready = True
+
+    def reload(self):
+        if self.engine is None:
+            return
+        self._ensure_table()
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT restaurant, url, file_id FROM bot_photo_cache")).all()
+        ids = {(r, u): f for r, u, f in rows}
+        with self._lock:
+            self._ids = ids
+        logger.info("[PHOTO] %s cached file_id loaded", len(ids))
+
+    def get(self, restaurant: str, url: str) -> Optional[str]:
+        file_id = self._ids.get((restaurant, url))
+        if file_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return file_id
+
+    def put(self, restaurant: str, url: str, file_id: str):
+        key = (restaurant, url)
+        if not file_id or self._ids.get(key) == file_id:
+            return
+        with self._lock:
+            self._ids[key] = file_id
+        if self.engine is None:
+            return
+        try:
+            self._ensure_table()
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO bot_photo_cache (restaurant, url, file_id, updated_at)
+                    VALUES (:r, :u, :f, :t)
+                    ON CONFLICT (restaurant, url) DO UPDATE SET file_id = EXCLUDED.file_id,
+                                                                updated_at = EXCLUDED.updated_at
+                """), {"r": restaurant, "u": url, "f": file_id, "t": time.time()})
+        except Exception:
+            logger.exception("[PHOTO] failed to store file_id for %s", restaurant)
+
+    def forget(self, restaurant: str, url: str):
+        """Telegram больше не принимает file_id — дальше снова шлём URL."""
+        self.stale += 1
+        with self._lock:
+            self._ids.pop((restaurant, url), None)
+        if self.engine is None:
+            return
+        try:
+            self._ensure_table()
+            with self.engine.begin() as conn:
+                conn.execute(text("DELETE FROM bot_photo_cache WHERE restaurant = :r AND url = :u"),
+                             {"r": restaurant, "u": url})
+        except Exception:
+            logger.exception("[PHOTO] failed to drop file_id for %s", restaurant)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def make_photo_cache() -> Optional[PhotoCache]:
+    if not PHOTO_CACHE:
+        return None
+    from db import engine
+    cache = PhotoCache(engine)
+    try:
+        cache.reload()
+    except Exception:
+        logger.exception("[PHOTO] initial load failed, starting empty")
+    return cache
+
+
+# ----------------- ПРОГРЕВ -----------------
+def warm(cache: PhotoCache, api, chat_id: str, rate: float, limit: Optional[int], keep: bool) -> Dict[str, int]:
+    """Загружает в chat_id фото, для которых ещё нет file_id; сообщения потом удаляются (если не keep)."""
+    from db import connect
+    with connect() as conn:
+        rows = conn.execute(text('SELECT "Название", "Фото" FROM restaurants_v2')).all()
+    todo = [(name, url) for name, url in rows
+            if name and url and str(url).strip().lower() != "nan" and cache.get(name, url) is None]
+    if limit:
+        todo = todo[:limit]
+    stats = {"total": len(rows), "todo": len(todo), "uploaded": 0, "failed": 0}
+    pause = 1.0 / rate if rate > 0 else 0
+    for i, (name, url) in enumerate(todo, 1):
+        started = time.monotonic()
+        resp = api.call("sendPhoto", {"chat_id": chat_id, "photo": url, "disable_notification": True},
+                        timeout=30)
+        messages = result_messages(resp) if resp is not None and resp.status_code == 200 else []
+        file_id = largest_file_id(messages[0]) if messages else None
+        if file_id:
+            cache.put(name, url, file_id)
+            stats["uploaded"] += 1
+            if not keep:
+                api.call("deleteMessage", {"chat_id": chat_id, "message_id": messages[0]["message_id"]}, timeout=15)
+        else:
+            stats["failed"] += 1
+        if i % 50 == 0:
+            print(f"… {i}/{len(todo)}: загружено {stats['uploaded']}, ошибок {stats['failed']}", flush=True)
+        time.sleep(max(0.0, pause - (time.monotonic() - started)))   # лимиты Telegram на сообщения в чат
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("warm", help="загрузить фото каталога в служебный чат и запомнить file_id")
+    w.add_argument("--chat-id", default=PHOTO_CACHE_CHAT_ID)
+    w.add_argument("--rate", type=float, default=1.0, help="сообщений в секунду")
+    w.add_argument("--limit", type=int)
+    w.add_argument("--keep", action="store_true", help="не удалять сообщения из служебного чата")
+    sub.add_parser("status", help="сколько file_id уже в кэше")
+    args = parser.parse_args()
+
+    from db import engine
+    cache = PhotoCache(engine)
+    cache.reload()
+    if args.cmd == "status":
+        print(f"file_id в кэше: {len(cache)}")
+        return
+    if not args.chat_id:
+        sys.exit("Нужен --chat-id или PHOTO_CACHE_CHAT_ID")
+    token = os.getenv("TELEGRAM_TOKEN")
+    if not token:
+        sys.exit("TELEGRAM_TOKEN не задан")
+    from dispatch import BotApi, OutboundDispatcher
+    api = OutboundDispatcher(BotApi(f"{os.getenv('TG_API_BASE', 'https://api.telegram.org')}/bot{token}"),
+                             async_send=False)
+    print(warm(cache, api, args.chat_id, args.rate, args.limit, args.keep))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    main()
@@ -0,0 +1,249 @@
+"""Проверка URL фотографий каталога офлайн, чтобы бот не тратил sendPhoto на битые ссылки.
+
+    python photo_health.py check --workers 16 --timeout 10     # проверить всё, что давно не проверялось
+    python photo_health.py check --max-age 0                   # перепроверить всё
+    python photo_health.py report [--json]                     # битые записи
+
+Для каждого URL сохраняются HTTP-статус, Content-Type, размер и время проверки
+(таблица photo_health). Бот при старте и при обновлении каталога читает список
+битых URL и сразу отправляет вместо них заглушку. Битым считается только
+определённый ответ: статус не 2xx, не картинка или больше 5 МБ. Если ответа нет
+(таймаут, обрыв соединения), status остаётся NULL: фото отправляется как обычно,
+а URL перепроверяется при следующем check независимо от --max-age.
+
+    PHOTO_HEALTH=1                # 0 — не учитывать результаты проверки при отправке
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Iterable
+
+import requests as rq
+from requests.adapters import HTTPAdapter
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+PHOTO_HEALTH = os.getenv("PHOTO_HEALTH", "1") == "1"
+# Telegram скачивает по URL фото не больше 5 МБ
+MAX_PHOTO_BYTES = 5 * 1024 * 1024
+USER_AGENT = "tg_miniapp-photo-check/1.0"
+
+
+def _create_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS photo_health (
+                url          TEXT PRIMARY KEY,
+                ok           BOOLEAN NOT NULL,
+                status       INTEGER,
+                content_type TEXT,
+                size         BIGINT,
+                error        TEXT,
+                checked_at   DOUBLE PRECISION NOT NULL
+            )
+        """))
+
+
+# ----------------- ПРОВЕРКА -----------------
+def verdict(status: Optional[int], content_type: Optional[str], size: Optional[int]) -> Optional[str]:
+    """Почему Telegram не примет эту картинку; None — всё в порядке."""
+    if status is None:
+        return "unreachable"
+    if not 200 <= status < 300:
+        return f"http {status}"
+    if not (content_type or "").lower().startswith("image/"):
+        return f"not an image: {content_type or '?'}"
+    if size is not None and size > MAX_PHOTO_BYTES:
+        return f"too large: {size} bytes"
+    return None
+
+
+def check_url(session: rq.Session, url: str, timeout: float) -> Dict[str, Any]:
+    """HEAD, а если сервер его не понимает — GET первого байта (тело не скачивается)."""
+    status = content_type = size = None
+    error = None
+    try:
+        resp = session.head(url, timeout=timeout, allow_redirects=True)
+        if resp.status_code in (403, 405, 501) or "Content-Type" not in resp.headers:
+            resp.close()
+            resp = session.get(url, timeout=timeout, allow_redirects=True, stream=True,
+                               headers={"Range": "bytes=0-0"})
+            resp.close()
+        status = 200 if resp.status_code == 206 else resp.status_code
+        content_type = resp.headers.get("Content-Type", "").split(";")[0].strip() or None
+        size = _content_size(resp.headers)
+    except rq.RequestException as e:
+        error = type(e).__name__
+    reason = verdict(status, content_type, size)
+    return {
+        "url": url,
+        "ok": reason is None,
+        "status": status,
+        "content_type": content_type,
+        "size": size,
+        "error": error or reason,
+        "checked_at": time.time(),
+    }
+
+
+def _content_size(headers) -> Optional[int]:
+    total = headers.get("Content-Range", "").rpartition("/")[2]   # bytes 0-0/12345
+    raw = total if total.isdigit() else headers.get("Content-Length")
+    return int(raw) if raw and raw.isdigit() else None
+
+
+def transient(res: Dict[str, Any]) -> bool:
+    """Ответа не было (таймаут, обрыв) — о самой картинке ничего не известно."""
+    return res["status"] is None
+
+
+def check_all(urls: Iterable[str], workers: int = 16, timeout: float = 10,
+              on_result=None) -> List[Dict[str, Any]]:
+    """Параллельная проверка ограниченным пулом; одна keep-alive сессия на все потоки."""
+    session = rq.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="photo-check") as pool:
+        results = []
+        for res in pool.map(lambda u: check_url(session, u, timeout), urls):
+            results.append(res)
+            if on_result is not None:
+                on_result(res)
+        return results
+
+
+# ----------------- ХРАНЕНИЕ -----------------
+def catalog_urls(conn) -> List[str]:
+    rows = conn.execute(text('SELECT DISTINCT "Фото" FROM restaurants_v2')).scalars()
+    return [u.strip() for u in rows if u and u.strip().lower() not in ("", "nan")]
+
+
+def save_results(engine, results: List[Dict[str, Any]]):
+    if not results:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO photo_health (url, ok, status, content_type, size, error, checked_at)
+            VALUES (:url, :ok, :status, :content_type, :size, :error, :checked_at)
+            ON CONFLICT (url) DO UPDATE SET ok = EXCLUDED.ok, status = EXCLUDED.status,
+                content_type = EXCLUDED.content_type, size = EXCLUDED.size,
+                error = EXCLUDED.error, checked_at = EXCLUDED.checked_at
+        """), results)
+
+
+def run_check(engine, workers: int, timeout: float, max_age: float, batch: int = 200) -> Dict[str, int]:
+    """Проверяет URL каталога, не проверявшиеся дольше max_age секунд; пишет результаты пачками."""
+    _create_table(engine)
+    with engine.connect() as conn:
+        urls = catalog_urls(conn)
+        # без ответа (status NULL) — перепроверяем всегда
+        fresh = set(conn.execute(text("SELECT url FROM photo_health WHERE checked_at > :t AND status IS NOT NULL"),
+                                 {"t": time.time() - max_age}).scalars())
+    todo = [u for u in urls if u not in fresh]
+    stats = {"urls": len(urls), "checked": 0, "broken": 0, "unknown": 0}
+    pending: List[Dict[str, Any]] = []
+
+    def on_result(res):
+        stats["checked"] += 1
+        if transient(res):
+            stats["unknown"] += 1
+        else:
+            stats["broken"] += not res["ok"]
+        pending.append(res)
+        if len(pending) >= batch:
+            save_results(engine, pending)
+            pending.clear()
+            print(f"… {stats['checked']}/{len(todo)}, битых {stats['broken']}, без ответа {stats['unknown']}",
+                  flush=True)
+
+    check_all(todo, workers, timeout, on_result)   # on_result вызывается из этого потока
+    save_results(engine, pending)
+    return stats
+
+
+def broken(engine) -> List[Dict[str, Any]]:
+    """Определённо битые URL; без ответа (status NULL) сюда не попадают."""
+    _create_table(engine)
+    with engine.connect() as conn:
+        return [dict(r) for r in conn.execute(text("""
+            SELECT h.url, h.status, h.content_type, h.size, h.error, h.checked_at,
+                   (SELECT MIN(r."Название") FROM restaurants_v2 r WHERE r."Фото" = h.url) AS restaurant
+            FROM photo_health h WHERE NOT h.ok AND h.status IS NOT NULL ORDER BY h.error, h.url
+        """)).mappings()]
+
+
+class PhotoHealth:
+    """Множество битых URL для отправки; перечитывается целиком (reload) при обновлении каталога."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.bad: frozenset = frozenset()
+        self.skipped = 0
+
+    def reload(self):
+        # таблица — здесь, а не в конструкторе: без БД app.py должен импортироваться (reload под try)
+        _create_table(self.engine)
+        with self.engine.connect() as conn:
+            bad = frozenset(conn.execute(text(
+                "SELECT url FROM photo_health WHERE NOT ok AND status IS NOT NULL")).scalars())
+        self.bad = bad
+        logger.info("[PHOTO] %s known-bad photo URLs", len(bad))
+
+    def is_bad(self, url: Optional[str]) -> bool:
+        if url and url.strip() in self.bad:
+            self.skipped += 1
+            return True
+        return False
+
+
+def make_photo_health() -> Optional[PhotoHealth]:
+    if not PHOTO_HEALTH:
+        return None
+    from db import engine
+    health = PhotoHealth(engine)
+    try:
+        health.reload()
+    except Exception:
+        logger.exception("[PHOTO] failed to load photo health, sending every URL")
+    return health
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("check", help="проверить URL фото каталога")
+    c.add_argument("--workers", type=int, default=16)
+    c.add_argument("--timeout", type=float, default=10)
+    c.add_argument("--max-age", type=float, default=24 * 3600, help="не перепроверять свежее, сек")
+    r = sub.add_parser("report", help="список битых фото (без ответа — не битые)")
+    r.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    from db import engine
+    if args.cmd == "check":
+        started = time.perf_counter()
+        stats = run_check(engine, args.workers, args.timeout, args.max_age)
+        stats["seconds"] = round(time.perf_counter() - started, 1)
+        print(json.dumps(stats, ensure_ascii=False))
+        return
+
+    rows = broken(engine)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    print(f"Битых фото: {len(rows)}")
+    for row in rows:
+        print(f"  • {row['restaurant'] or '?'} | {row['error']} | {row['url']}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import random
+from typing import Dict, Any, Optional, Tuple, List
+
+from sqlalchemy import text
+
+from render import CARD_COLUMNS
+from options import (
+    budget_options, type_options, cuisine_options,
+    atmosphere_options, reason_options
+)
+
+# Маппинг в названия колонок БД
+column_map = {
+    "Бюджет": "Бюджет",
+    "Тип заведения": "Тип заведения",
+    "Кухня": "Кухня",
+    "Атмосфера": "атмосфера",  # в БД с маленькой
+    "Повод": "повод",          # в БД с маленькой
+}
+
+# нормализованные колонки из migrations/001_facet_arrays.sql: (колонка, оператор)
+facet_column_map = {
+    "Бюджет": ("facet_budget", "="),
+    "Тип заведения": ("facet_type", "@>"),
+    "Кухня": ("facet_cuisine", "@>"),
+    "Атмосфера": ("facet_atmosphere", "@>"),
+    "Повод": ("facet_reason", "@>"),
+}
+
+# в ячейке ровно одно значение: вариант сравнивается со всей ячейкой (lower + trim пробелов),
+# как facet_budget в migrations/001_facet_arrays.sql, CatalogSnapshot и ingest.py
+SINGLE_VALUED = {"Бюджет"}
+
+# значения из кнопок совпадают с элементом массива целиком — для них годится GIN / btree
+known_values = {
+    "Бюджет": {o.strip().lower() for o in budget_options},
+    "Тип заведения": {o.strip().lower() for o in type_options},
+    "Кухня": {o.strip().lower() for o in cuisine_options},
+    "Атмосфера": {o.strip().lower() for o in atmosphere_options},
+    "Повод": {o.strip().lower() for o in reason_options},
+}
+
+
+def build_filter_query(filters: Dict[str, Optional[str]], facet_columns: bool = False,
+                       select: str = "*") -> Tuple[str, Dict[str, Any]]:
+    """SQL + параметры для выборки из restaurants_v2 по фильтрам.
+
+    Значение из options.py совпадает с одним из значений ячейки целиком
+    («бар» не находит «спортбар»), а для SINGLE_VALUED (бюджет) — со всей
+    ячейкой; свободный текст — подстрокой LOWER(col) LIKE. Так же фильтрует срез каталога в памяти (CatalogSnapshot.facet_mask).
+    С facet_columns=True точные значения ищутся через `=` / `@>` по
+    нормализованным колонкам, а LIKE обслуживает триграммный индекс.
+    """
+    query = f"SELECT {select} FROM restaurants_v2 WHERE TRUE"
+    params: Dict[str, Any] = {}
+    for key, value in filters.items():
+        if not value:
+            continue
+        placeholder = key.replace(" ", "_")
+        clause, params[placeholder] = filter_clause(key, value, placeholder, facet_columns)
+        query += f" AND {clause}"
+    return query, params
+
+
+def filter_clause(key: str, value: str, placeholder: str, facet_columns: bool = False) -> Tuple[str, str]:
+    """Условие одного фильтра (правила — в build_filter_query) и значение его параметра :placeholder."""
+    needle = value.strip().lower()
+    if needle in known_values[key] and facet_columns:
+        col_name, op = facet_column_map[key]
+        if op == "=":
+            return f'"{col_name}" = :{placeholder}', needle
+        return f'"{col_name}" @> ARRAY[:{placeholder}]::text[]', needle
+    col_name = column_map[key]  # точное имя колонки в БД
+    if needle in known_values[key] and key in SINGLE_VALUED:
+        return f'LOWER(TRIM("{col_name}")) = :{placeholder}', needle
+    if needle in known_values[key]:
+        # без миграции: ",итальянскаякухня,европейскаякухня," содержит ",итальянскаякухня,"
+        return (f"""',' || REPLACE(REPLACE(LOWER("{col_name}"), ';', ','), ' ', '') || ','"""
+                f" LIKE :{placeholder}"), f"%,{needle.replace(' ', '')},%"
+    return f'LOWER("{col_name}") LIKE :{placeholder}', f"%{needle}%"
+
+
+def count_matches(conn, filters: Dict[str, Optional[str]], facet_columns: bool = False,
+                  statements=None) -> int:
+    query, params = build_filter_query(filters, facet_columns=facet_columns, select="COUNT(*)")
+    return _execute(conn, statements, ("count", filters, facet_columns, "COUNT(*)", 0), query, params).scalar() or 0
+
+
+def count_options(conn, filters: Dict[str, Optional[str]], key: str, options: List[str],
+                  facet_columns: bool = False, statements=None) -> Dict[str, int]:
+    """{вариант: число совпадений filters + этот вариант фильтра key} — одним запросом.
+
+    Каждый вариант — своя сумма SUM(CASE WHEN ...) в одном проходе по строкам,
+    отобранным остальными фильтрами.
+    """
+    sums, option_params = [], {}
+    for i, opt in enumerate(options):
+        clause, option_params[f"_o{i}"] = filter_clause(key, opt, f"_o{i}", facet_columns)
+        sums.append(f"SUM(CASE WHEN {clause} THEN 1 ELSE 0 END) AS _c{i}")
+    select = ", ".join(sums)
+    query, params = build_filter_query({k: v for k, v in filters.items() if k != key},
+                                       facet_columns=facet_columns, select=select)
+    params.update(option_params)
+    row = _execute(conn, statements, ("options", filters, facet_columns, select, 0), query, params).first()
+    return {opt: int(row[i] or 0) if row else 0 for i, opt in enumerate(options)}
+
+
+def sample_matches(conn, filters: Dict[str, Optional[str]], k: int, count: int,
+                   facet_columns: bool = False, select: str = "*", statements=None) -> List[Dict[str, Any]]:
+    """k равномерно случайных совпадений из count, по сети идут только они.
+
+    Случайные позиции выбираются в Python, а строки с этими номерами отбирает
+    сама БД: row_number() нумерует совпадения за один проход, без сортировки.
+    С statements (statements.StatementRegistry) форма запроса берётся из реестра
+    и в Postgres выполняется как подготовленная.
+    """
+    query, params = build_filter_query(filters, facet_columns=facet_columns, select=select)
+    if count <= k:
+        result = _execute(conn, statements, ("select", filters, facet_columns, select, 0), query, params)
+        return [dict(r) for r in result.mappings()]
+
+    positions = random.sample(range(1, count + 1), k)
+    for i, pos in enumerate(positions):
+        params[f"_rn{i}"] = pos
+    wanted = ", ".join(f":_rn{i}" for i in range(k))
+    numbered = query.replace(f"SELECT {select} ", f"SELECT {select}, row_number() OVER () AS _rn ", 1)
+    sql = f"SELECT * FROM ({numbered}) AS numbered WHERE _rn IN ({wanted})"
+    rows = [dict(r) for r in _execute(conn, statements, ("sample", filters, facet_columns, select, k),
+                                      sql, params).mappings()]
+    for r in rows:
+        r.pop("_rn", None)
+    return rows
+
+
+def _execute(conn, statements, shape: tuple, sql: str, params: Dict[str, Any]):
+    """Через реестр форм (если передан) или обычным text()."""
+    if statements is None:
+        return conn.execute(text(sql), params)
+    return statements.run(conn, *shape, sql, params)
+
+
+def projection(conn) -> str:
+    """Список колонок для SELECT: только то, что нужно карточке и фасетам (и что реально есть в таблице)."""
+    present = set(conn.execute(text("SELECT * FROM restaurants_v2 LIMIT 0")).keys())
+    wanted = CARD_COLUMNS + [c for c in column_map.values() if c not in CARD_COLUMNS]
+    cols = [c for c in wanted if c in present]
+    return ", ".join(f'"{c}"' for c in cols) if cols else "*"
+
+
+def has_facet_columns(conn) -> bool:
+    """Применена ли миграция 001 (есть ли нормализованные колонки)."""
+    if conn.dialect.name != "postgresql":
+        return False
+    found = conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'restaurants_v2' AND column_name = 'facet_cuisine'
+          AND table_schema = ANY (current_schemas(false))
+        LIMIT 1
+    """)).first()
+    return found is not None
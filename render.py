@@ -0,0 +1,56 @@
+import re
+from typing import Dict, Any, List
+
+# колонки, которые нужны карточке и /recommend (фасеты добавляются из queries.column_map)
+CARD_COLUMNS = ["Название", "Описание", "Адрес", "Метро", "Фото", "Ссылка", "Сайт"]
+
+# "['Арбатская', 'Смоленская']" — список Python, сохранённый строкой
+_QUOTED = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+
+
+def parse_metro(raw: Any) -> List[str]:
+    """Станции метро без ast.literal_eval: список, строка-список или просто текст."""
+    if not raw:
+        return []
+    if isinstance(raw, (list, tuple)):
+        return [str(s).strip() for s in raw if str(s).strip()]
+    s = str(raw).strip()
+    if s.startswith("[") and s.endswith("]"):
+        found = [a or b for a, b in _QUOTED.findall(s)]
+        if found:
+            return [x.strip() for x in found if x.strip()]
+        s = s[1:-1]
+        if not s.strip():
+            return []
+        return [s.strip()]
+    return [s]
+
+
+def clean_item(row_dict: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in row_dict.items() if v and str(v).strip().lower() != "nan"}
+
+
+def render_card_head(item: Dict[str, Any]) -> str:
+    """Статическая часть карточки: всё, что не зависит от фильтров пользователя."""
+    name = item.get("Название", "Ресторан без названия")
+    desc = item.get("Описание")
+    address = item.get("Адрес")
+    metro = item.get("_metro")
+    if metro is None:
+        metro = parse_metro(item.get("Метро"))
+    link = item.get("Ссылка") or item.get("Сайт")
+
+    lines = [f"<b>{name}</b>"]
+    if desc:    lines.append(desc)
+    if address: lines.append(f"📍 {address}")
+    if metro:   lines.append(f"🚇 {', '.join(metro)}")
+    if link:    lines.append(f"🔗 {link}")
+    return "\n".join(lines)
+
+
+def prepare_item(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Очищенная строка + заранее посчитанные _metro и _card (один раз на ресторан, а не на отправку)."""
+    item = clean_item(row)
+    item["_metro"] = parse_metro(item.get("Метро"))
+    item["_card"] = render_card_head(item)
+    return item
@@ -0,0 +1,211 @@
+"""Текст пользователя -> вариант из options.py: «грузинская», «Грузинскую кухню», «итальянка», «грузинкая».
+
+Всё считается один раз при создании OptionResolver; разбор значения идёт по
+ступеням, пока какая-нибудь не сработает:
+
+  1. точное совпадение без учёта регистра, пробелов и «ё» (dict);
+  2. синонимы и разговорные формы («суши» -> Японская кухня, «итальянка»);
+  3. основы слов (стеммер из search.py) без служебных слов вроде «кухня»:
+     «грузинскую» -> Грузинская кухня, «уютно» -> Уютно и по-домашнему —
+     если такой набор основ однозначен;
+  4. однозначное начало («груз» -> Грузинская кухня), бинпоиск по ключам;
+  5. опечатки: кандидаты по общим триграммам, проверка расстоянием Левенштейна.
+
+Ответы запоминаются, поэтому повторные значения — один поиск в dict.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Optional, Iterable
+
+from search import stemmer, tokenize
+
+# основы, которые есть почти во всех вариантах списка и ничего не различают
+GENERIC_STEMS = {"кухн"}
+
+# синонимы и разговорные названия: ключ мастера -> {как пишут: вариант}
+SYNONYMS: Dict[str, Dict[str, str]] = {
+    "budget": {
+        "дешево": "До 1000 ₽", "недорого": "До 1000 ₽", "бюджетно": "До 1000 ₽", "эконом": "До 1000 ₽",
+        "средний": "1000–3000 ₽", "средне": "1000–3000 ₽",
+        "подороже": "3000–6000 ₽",
+        "дорого": "Больше 6000 ₽", "премиум": "Больше 6000 ₽", "люкс": "Больше 6000 ₽",
+    },
+    "type": {
+        "кофе": "Кофейня", "кофейни": "Кофейня", "чай": "Чайная", "булочная": "Пекарня",
+        "вино": "Винотека", "винный бар": "Винотека", "пивнушка": "Пивной ресторан", "пивбар": "Пивной ресторан",
+        "спорт-бар": "Спортбар", "спорт бар": "Спортбар", "стрит-фуд": "Стритфуд", "уличная еда": "Стритфуд",
+        "фаст-фуд": "Фастфуд", "фаст фуд": "Фастфуд", "кондитерка": "Кондитерская", "банкет": "Банкетный зал",
+    },
+    "cuisine": {
+        "суши": "Японская кухня", "роллы": "Японская кухня", "рамен": "Японская кухня",
+        "пицца": "Итальянская кухня", "паста": "Итальянская кухня",
+        "хинкали": "Грузинская кухня", "хачапури": "Грузинская кухня",
+        "бургеры": "Американская кухня", "стейки": "Американская кухня",
+        "фо": "Вьетнамская кухня", "фо бо": "Вьетнамская кухня", "том ям": "Тайская кухня",
+        "плов": "Узбекская кухня", "шашлык": "Кавказская кухня", "кавказ": "Кавказская кухня",
+        "паназия": "Паназиатская кухня", "азия": "Паназиатская кухня", "азиатская": "Паназиатская кухня",
+        "средиземноморье": "Средиземноморская кухня", "тако": "Мексиканская кухня",
+        "блины": "Русская кухня", "пельмени": "Русская кухня", "хумус": "Ближневосточная кухня",
+        "дим сам": "Китайская кухня", "карри": "Индийская кухня",
+    },
+    "atmosphere": {
+        "романтично": "Романтика", "романтическая": "Романтика",
+        "веранда": "На свежем воздухе", "терраса": "На свежем воздухе", "летняя веранда": "На свежем воздухе",
+        "шумно": "Для шумной компании", "с детьми": "Семейное место", "семейная": "Семейное место",
+    },
+    "reason": {
+        "свидание": "Ужин вдвоем", "романтический ужин": "Ужин вдвоем",
+        "день рождения": "Праздник / событие", "праздник": "Праздник / событие",
+        "бизнес-ланч": "Быстрый обед", "обед": "Быстрый обед", "ланч": "Быстрый обед",
+        "завтрак": "Завтрак / кофе", "друзья": "Встреча с друзьями", "с друзьями": "Встреча с друзьями",
+        "переговоры": "Деловая встреча", "бизнес": "Деловая встреча", "туристы": "Туристическая локация",
+        "ужин с семьей": "Семейный ужин",
+    },
+}
+
+_RESOLVED_CACHE_MAX = 10_000
+# слово подходит к нескольким вариантам («встреча») — дальше по ступеням не идём
+_AMBIGUOUS = object()
+
+
+def fold(value: str) -> str:
+    """Ключ сравнения: нижний регистр, «ё» -> «е», схлопнутые пробелы."""
+    return " ".join(str(value).casefold().replace("ё", "е").split())
+
+
+def stem_key(value: str) -> tuple:
+    return tuple(sorted({stemmer.stem(w) for w in tokenize(value)} - GENERIC_STEMS))
+
+
+def trigrams(s: str) -> set:
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Левенштейн с отсечкой: больше limit — вернётся limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+class OptionResolver:
+    """Разбор свободного текста в один вариант списка; None — однозначного варианта нет."""
+
+    def __init__(self, options: Iterable[str], synonyms: Optional[Dict[str, str]] = None):
+        self.options = list(options)
+        self._exact: Dict[str, str] = {}
+        for opt in self.options:
+            self._exact[fold(opt)] = opt
+            short = " ".join(w for w in fold(opt).split() if stemmer.stem(w) not in GENERIC_STEMS)
+            if short:
+                self._exact.setdefault(short, opt)      # «грузинская»
+            first = short.split(" ")[0] if short else ""
+            if first.endswith("ская") and len(first) > 6:
+                self._exact.setdefault(first[:-4] + "ка", opt)   # «итальянка», «грузинка»
+        known = set(self.options)
+        for alias, opt in (synonyms or {}).items():
+            if opt in known:   # в app.py списки могут быть запасными, синонимы на чужие варианты не нужны
+                self._exact.setdefault(fold(alias), opt)
+
+        # основы слов: точный набор и «какие варианты содержат эту основу»
+        self._by_stems: Dict[tuple, Optional[str]] = {}
+        self._stem_postings: Dict[str, set] = {}
+        for key, opt in self._exact.items():
+            sk = stem_key(key)
+            if not sk:
+                continue
+            prev = self._by_stems.get(sk, opt)
+            self._by_stems[sk] = opt if prev == opt else None   # None — неоднозначно
+            for st in sk:
+                self._stem_postings.setdefault(st, set()).add(opt)
+
+        self._keys = sorted(self._exact)
+        self._trigrams: Dict[str, List[str]] = {}
+        for key in self._keys:
+            for g in trigrams(key):
+                self._trigrams.setdefault(g, []).append(key)
+        self._resolved: Dict[str, Optional[str]] = {}
+
+    # ----------------- РАЗБОР -----------------
+    def resolve(self, value: Optional[str]) -> Optional[str]:
+        if not value:
+            return None
+        key = fold(value)
+        if key in self._resolved:
+            return self._resolved[key]
+        found = self._exact.get(key)
+        if found is None:
+            found = self._by_stem(key)
+            if found is None:
+                found = self._by_prefix(key) or self._by_typo(key)
+            elif found is _AMBIGUOUS:
+                found = None
+        if len(self._resolved) < _RESOLVED_CACHE_MAX:
+            self._resolved[key] = found
+        return found
+
+    def normalize(self, value: Optional[str]) -> Optional[str]:
+        """Как прежний normalize(): вариант из списка, а если не разобрали — значение как есть."""
+        if not value:
+            return value
+        return self.resolve(value) or value
+
+    def _by_stem(self, key: str):
+        """Вариант, None (основ не нашлось) или _AMBIGUOUS."""
+        sk = stem_key(key)
+        if not sk:
+            return None
+        if sk in self._by_stems:
+            return self._by_stems[sk] or _AMBIGUOUS
+        candidates = None
+        for st in sk:
+            opts = self._stem_postings.get(st)
+            if not opts:
+                return None
+            candidates = opts if candidates is None else candidates & opts
+        if not candidates:
+            return None
+        return next(iter(candidates)) if len(candidates) == 1 else _AMBIGUOUS
+
+    def _by_prefix(self, key: str) -> Optional[str]:
+        if len(key) < 3:
+            return None
+        i = bisect_left(self._keys, key)
+        found = set()
+        while i < len(self._keys) and self._keys[i].startswith(key):
+            found.add(self._exact[self._keys[i]])
+            if len(found) > 1:
+                return None
+            i += 1
+        return found.pop() if found else None
+
+    def _by_typo(self, key: str) -> Optional[str]:
+        if len(key) < 4:
+            return None
+        limit = 1 if len(key) <= 6 else 2 if len(key) <= 12 else 3
+        shared: Dict[str, int] = {}
+        for g in trigrams(key):
+            for k in self._trigrams.get(g, ()):
+                shared[k] = shared.get(k, 0) + 1
+        best, best_d = set(), limit + 1
+        for k in sorted(shared, key=shared.__getitem__, reverse=True)[:8]:
+            d = edit_distance(key, k, limit)
+            if d < best_d:
+                best, best_d = {self._exact[k]}, d
+            elif d == best_d and d <= limit:
+                best.add(self._exact[k])
+        return best.pop() if best_d <= limit and len(best) == 1 else None
+
+
+def make_resolvers(options_map: Dict[str, List[str]]) -> Dict[str, OptionResolver]:
+    """{ключ мастера: OptionResolver} для списков мастера (category_options_map)."""
+    return {key: OptionResolver(options, SYNONYMS.get(key)) for key, options in options_map.items()}
+
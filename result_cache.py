@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# ----------------- КОНФИГ -----------------
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))   # сколько комбинаций фильтров держим
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "300"))      # секунд
+
+FILTER_KEYS = ("Бюджет", "Тип заведения", "Кухня", "Атмосфера", "Повод")
+
+
+def cache_key(filters: Dict[str, Optional[str]]) -> Tuple:
+    """Нормализованный кортеж фильтров: регистр и пробелы по краям не важны."""
+    return tuple((filters.get(k) or "").strip().lower() for k in FILTER_KEYS)
+
+
+class ResultCache:
+    """LRU + TTL: комбинация фильтров -> кандидаты (id строк каталога или сами строки).
+
+    Запись помнит версию каталога: после подмены среза старые id недействительны,
+    такая запись считается промахом.
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: int = RESULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple, tuple]" = OrderedDict()   # key -> (expires_at, version, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple, version: int = 0) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != version:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Tuple, value: Any, version: int = 0):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+result_cache = ResultCache()
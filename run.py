@@ -7,6 +7,9 @@ import threading
 
 # чтобы Flask слушал нужный порт на Railway (если не задан)
 os.environ.setdefault("PORT", "5000")
+# wsgi — Flask (app.py), aio — тот же API на asyncio (aio_app.py)
+SERVER_MODE = os.getenv("SERVER_MODE", "wsgi")
+API_SCRIPTS = {"wsgi": "app.py", "aio": "aio_app.py"}
 
 procs = []
 
@@ -62,7 +65,7 @@ def main():
     signal.signal(signal.SIGTERM, handle_signal)
 
     print("[RUN] Starting Flask API…", flush=True)
-    api = spawn("API", ["app.py"])
+    api = spawn("API", [API_SCRIPTS[SERVER_MODE]])
 
     print("[RUN] Starting Telegram BOT…", flush=True)
     bot = spawn("BOT", ["main.py"])
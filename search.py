@@ -0,0 +1,283 @@
+"""Полнотекстовый поиск по срезу каталога: токены, стемминг, инвертированный индекс, BM25.
+
+Свободный текст пользователя («суши у метро тверская», название ресторана)
+ищется по Названию, Описанию, Кухне, Типу заведения и Метро. Слова
+приводятся к основе стеммером Портера для русского (Snowball), так что
+«грузинскую», «грузинская» и «грузинской» — один терм. Индекс строится
+вместе со срезом каталога и живёт в памяти; запрос — сложение заранее
+посчитанных вкладов BM25 и top-k через кучу.
+
+    SEARCH_MIN_SCORE=0      # ниже этого результат считается случайным совпадением
+"""
+import os
+import re
+import math
+import heapq
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from bitsets import mask_from_ids, iter_ids
+
+# ----------------- КОНФИГ -----------------
+SEARCH_MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", "0"))
+
+# поле -> вес терма из этого поля (BM25F-упрощённо: вес умножает частоту)
+FIELD_WEIGHTS = {
+    "Название": 3.0,
+    "Кухня": 2.0,
+    "Тип заведения": 1.5,
+    "_metro": 1.5,
+    "Описание": 1.0,
+}
+K1, B = 1.2, 0.75
+# термы, которые есть больше чем в половине документов, почти ничего не дают к ранжированию,
+# а их списки самые длинные — пропускаем, если в запросе есть что-то ещё
+COMMON_DF = 0.5
+
+STOP_WORDS = {
+    "и", "в", "во", "на", "у", "с", "со", "к", "ко", "по", "для", "от", "до", "из", "за", "о", "об",
+    "а", "но", "или", "не", "где", "как", "что", "мне", "нам", "хочу", "хочется", "найди", "покажи",
+    "рядом", "около", "возле", "недалеко", "метро", "м", "ст", "станция", "поесть", "где-нибудь",
+}
+
+_WORD = re.compile(r"[0-9a-zа-я]+(?:-[0-9a-zа-я]+)*")
+
+
+# ----------------- СТЕММЕР -----------------
+class RussianStemmer:
+    """Snowball (Портер) для русского: окончания отрезаются только в зоне RV, производные — в R2."""
+
+    VOWELS = set("аеиоуыэюя")
+    PERFECTIVE_GERUND = (("вшись", "вши", "в"), ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв"))
+    REFLEXIVE = ("ся", "сь")
+    ADJECTIVE = ("ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый",
+                 "ой", "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+    PARTICIPLE = (("ем", "нн", "вш", "ющ", "щ"), ("ивш", "ывш", "ующ"))
+    VERB = (("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н"),
+            ("ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют", "ены",
+             "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю"))
+    NOUN = ("иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой",
+            "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й", "о", "у",
+            "ы", "ь", "ю", "я")
+    SUPERLATIVE = ("ейше", "ейш")
+    DERIVATIONAL = ("ость", "ост")
+
+    def __init__(self):
+        self._cache: Dict[str, str] = {}
+
+    def _regions(self, word: str) -> Tuple[int, int]:
+        rv = r1 = len(word)
+        for i, ch in enumerate(word):
+            if ch in self.VOWELS:
+                rv = i + 1
+                break
+        for i in range(1, len(word)):
+            if word[i - 1] in self.VOWELS and word[i] not in self.VOWELS:
+                r1 = i + 1
+                break
+        r2 = len(word)
+        for i in range(r1 + 1, len(word)):
+            if word[i - 1] in self.VOWELS and word[i] not in self.VOWELS:
+                r2 = i + 1
+                break
+        return rv, r2
+
+    @staticmethod
+    def _strip(rv: str, endings) -> Optional[str]:
+        for e in endings:
+            if rv.endswith(e):
+                return rv[:-len(e)]
+        return None
+
+    def _strip_grouped(self, rv: str, groups) -> Optional[str]:
+        """Окончания первой группы отрезаются только после «а»/«я», второй — всегда."""
+        first, second = groups
+        for e in first:
+            if rv.endswith(e) and rv[:-len(e)][-1:] in ("а", "я"):
+                return rv[:-len(e)]
+        return self._strip(rv, second)
+
+    def _adjectival(self, rv: str) -> Optional[str]:
+        base = self._strip(rv, self.ADJECTIVE)
+        if base is None:
+            return None
+        participle = self._strip_grouped(base, self.PARTICIPLE)
+        return base if participle is None else participle
+
+    def stem(self, word: str) -> str:
+        cached = self._cache.get(word)
+        if cached is not None:
+            return cached
+        if len(word) < 3 or not word[0].isalpha():
+            return word   # числа, «№12», предлоги — как есть
+        w = word.replace("ё", "е")
+        rv_at, r2_at = self._regions(w)
+        head, rv = w[:rv_at], w[rv_at:]
+
+        # шаг 1
+        base = self._strip_grouped(rv, self.PERFECTIVE_GERUND)
+        if base is None:
+            stripped = self._strip(rv, self.REFLEXIVE)
+            if stripped is not None:
+                rv = stripped
+            base = self._adjectival(rv)
+            if base is None:
+                base = self._strip_grouped(rv, self.VERB)
+            if base is None:
+                base = self._strip(rv, self.NOUN)
+        rv = rv if base is None else base
+        # шаг 2
+        if rv.endswith("и"):
+            rv = rv[:-1]
+        # шаг 3: словообразовательное окончание в R2
+        r2 = max(0, r2_at - rv_at)
+        for e in self.DERIVATIONAL:
+            if rv.endswith(e) and len(rv) - len(e) >= r2:
+                rv = rv[:-len(e)]
+                break
+        # шаг 4
+        if rv.endswith("нн"):
+            rv = rv[:-1]
+        else:
+            sup = self._strip(rv, self.SUPERLATIVE)
+            if sup is not None:
+                rv = sup[:-1] if sup.endswith("нн") else sup
+            elif rv.endswith("ь"):
+                rv = rv[:-1]
+        stemmed = head + rv
+        if len(self._cache) < 200_000:
+            self._cache[word] = stemmed
+        return stemmed
+
+
+stemmer = RussianStemmer()
+
+
+def tokenize(text: Any) -> List[str]:
+    """Слова в нижнем регистре без стоп-слов; «ё» -> «е», составные через дефис — одним словом."""
+    if not text:
+        return []
+    return [w for w in _WORD.findall(str(text).casefold().replace("ё", "е")) if w not in STOP_WORDS]
+
+
+def terms(text: Any) -> List[str]:
+    return [stemmer.stem(w) for w in tokenize(text)]
+
+
+# ----------------- ИНДЕКС -----------------
+class SearchIndex:
+    """Инвертированный индекс среза: терм -> (номера строк, вклады BM25), посчитанные при построении.
+
+    Запрос из одного терма — готовый top-список терма. Из нескольких — сначала
+    строки со всеми словами (AND масок, как у фасетов в catalog.py), ранжированные
+    по BM25; если таких меньше k — обычное OR-сложение по спискам.
+    """
+
+    # столько лучших строк каждого терма хранится заранее
+    TOP_PER_TERM = 50
+    # для термов с таким df и больше хранится битовая маска строк
+    MASK_MIN_DF = 1024
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.n = len(rows)
+        freqs: List[Counter] = []
+        lengths: List[float] = []
+        # кухня, тип и метро повторяются от строки к строке — разбираем каждое значение один раз
+        memo: Dict[tuple, List[str]] = {}
+        for row in rows:
+            tf: Counter = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                value = row.get(field)
+                if isinstance(value, list):
+                    value = tuple(value)
+                key = (field, value)
+                found = memo.get(key)
+                if found is None:
+                    found = terms(" ".join(value) if isinstance(value, tuple) else value)
+                    if field != "Описание" and field != "Название":
+                        memo[key] = found
+                for t in found:
+                    tf[t] += weight
+            freqs.append(tf)
+            lengths.append(sum(tf.values()))
+        avgdl = (sum(lengths) / self.n) if self.n else 1.0
+
+        postings: Dict[str, List[int]] = {}
+        for doc, tf in enumerate(freqs):
+            for t in tf:
+                postings.setdefault(t, []).append(doc)
+        self.df = {t: len(docs) for t, docs in postings.items()}
+        self.postings: Dict[str, Tuple[List[int], List[float]]] = {}
+        self.top: Dict[str, List[Tuple[int, float]]] = {}
+        self.masks: Dict[str, int] = {}
+        for t, docs in postings.items():
+            idf = math.log(1 + (self.n - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores = []
+            for doc in docs:
+                f = freqs[doc][t]
+                norm = K1 * (1 - B + B * lengths[doc] / avgdl)
+                scores.append(idf * f * (K1 + 1) / (f + norm))
+            self.postings[t] = (docs, scores)
+            if len(docs) == 1:
+                self.top[t] = [(docs[0], scores[0])]
+            else:
+                self.top[t] = heapq.nlargest(self.TOP_PER_TERM, zip(docs, scores), key=_by_score)
+            if len(docs) >= self.MASK_MIN_DF:
+                self.masks[t] = mask_from_ids(docs)
+
+    def _mask(self, t: str) -> int:
+        mask = self.masks.get(t)
+        return mask if mask is not None else mask_from_ids(self.postings[t][0])
+
+    def search(self, query: str, k: int = 3, min_score: float = SEARCH_MIN_SCORE) -> List[Tuple[int, float]]:
+        """k лучших [(номер строки, score)] по убыванию score."""
+        wanted = [t for t in dict.fromkeys(terms(query)) if t in self.postings]
+        if not wanted:
+            return []
+        rare = [t for t in wanted if self.df[t] <= self.n * COMMON_DF] or wanted
+        if len(rare) == 1 and k <= self.TOP_PER_TERM:
+            best = self.top[rare[0]][:k]
+        else:
+            best = self._search_all(rare, wanted, k) or self._search_any(rare, k)
+        return [(doc, score) for doc, score in best if score > min_score]
+
+    def _search_all(self, rare: List[str], wanted: List[str], k: int) -> List[Tuple[int, float]]:
+        """Строки со всеми редкими словами запроса; пусто, если таких меньше k."""
+        rare = sorted(rare, key=self.df.__getitem__)
+        mask = self._mask(rare[0])
+        for t in rare[1:]:
+            mask &= self._mask(t)
+            if not mask:
+                return []
+        if mask.bit_count() < k:
+            return []
+        lists = [self.postings[t] for t in wanted]
+        scored = []
+        for doc in iter_ids(mask):
+            score = 0.0
+            for docs, scores in lists:
+                i = bisect_left(docs, doc)
+                if i < len(docs) and docs[i] == doc:
+                    score += scores[i]
+            scored.append((score, doc))
+        return [(doc, score) for score, doc in heapq.nlargest(k, scored)]
+
+    def _search_any(self, rare: List[str], k: int) -> List[Tuple[int, float]]:
+        acc: Dict[int, float] = {}
+        for t in rare:
+            docs, scores = self.postings[t]
+            get = acc.get
+            for doc, s in zip(docs, scores):
+                acc[doc] = get(doc, 0.0) + s
+        return heapq.nlargest(k, acc.items(), key=_by_score)
+
+    def __len__(self):
+        return len(self.postings)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"docs": self.n, "terms": len(self.postings), "masks": len(self.masks)}
+
+
+def _by_score(item: Tuple[int, float]) -> float:
+    return item[1]
@@ -0,0 +1,293 @@
+"""Подбор ресторанов: фильтры -> случайные совпадения -> карточки.
+
+Общий для Flask-приложения (app.py) и PTB-бота (main.py): оба вызывают эти
+функции напрямую, без HTTP-запросов к /recommend.
+"""
+import os
+import time
+import base64
+import random
+import asyncio
+import logging
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Mapping, Tuple
+
+import db
+from catalog import catalog
+from queries import count_matches, count_options, has_facet_columns, projection, sample_matches
+from statements import statements
+from result_cache import result_cache, cache_key
+from render import prepare_item, render_card_head
+from metrics import DB_QUERY_SECONDS, RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+# потоки для асинхронного входа, когда выборка идёт в БД (каталог ещё не загружен)
+SERVICE_DB_THREADS = int(os.getenv("SERVICE_DB_THREADS", "4"))
+# 1 — asyncio-код ходит в БД через asyncpg/aiosqlite (включается по умолчанию в aio_app)
+ASYNC_DB = os.getenv("ASYNC_DB", "0") == "1"
+# сколько перемешанных кандидатов хранится в сессии для кнопки «Ещё варианты»
+MORE_MAX_IDS = int(os.getenv("MORE_MAX_IDS", "300"))
+
+# параметр запроса / ключ состояния мастера -> имя фильтра
+param2filter = {
+    "budget": "Бюджет",
+    "type": "Тип заведения",
+    "cuisine": "Кухня",
+    "atmosphere": "Атмосфера",
+    "reason": "Повод",
+}
+
+_db_executor = ThreadPoolExecutor(max_workers=SERVICE_DB_THREADS, thread_name_prefix="service-db")
+_started = False
+
+def start():
+    """Загрузка каталога и фоновое обновление; кэш подборок и формы SQL сбрасываются при каждой подмене среза."""
+    global _started
+    if _started:
+        return
+    _started = True
+    catalog.on_swap(lambda snap: result_cache.invalidate())
+    # после ingest могла смениться схема restaurants_v2 — подготовленные формы на соединениях устарели
+    catalog.on_swap(lambda snap: statements.invalidate())
+    catalog.start()
+
+def filters_from_params(params: Mapping[str, Any]) -> Dict[str, Optional[str]]:
+    """{"budget": ..., "cuisine": ...} (query string или состояние мастера) -> фильтры подбора."""
+    return {human: params.get(key) for key, human in param2filter.items()}
+
+# ----------------- СЧЁТЧИКИ ФАСЕТОВ -----------------
+def facet_steps(params: Mapping[str, Any], upto: Optional[str] = None):
+    """Выборы мастера до категории upto -> ((фильтр, значение), ...) — ключ для CatalogSnapshot.candidates."""
+    steps = []
+    for key, human in param2filter.items():
+        if key == upto:
+            break
+        value = (params.get(key) or "").strip().lower()
+        if value:
+            steps.append((human, value))
+    return tuple(steps)
+
+def facet_counts(params: Mapping[str, Any], key: str, options: List[str]) -> Optional[Dict[str, int]]:
+    """Сколько мест останется для каждого варианта категории key при уже сделанных выборах.
+
+    Считается по каталогу в памяти, а пока он не загружен — одним запросом в БД на
+    всю клавиатуру (числа кэшируются в result_cache, как у sample_rows). None — БД
+    тоже недоступна (клавиатура без счётчиков).
+    """
+    snap = catalog.snapshot()
+    if snap is not None:
+        return snap.option_counts(facet_steps(params, upto=key), param2filter[key], options)
+    try:
+        return count_db(dict(facet_steps(params, upto=key)), param2filter[key], options)
+    except Exception:
+        logger.exception("[API] facet counts from DB failed")
+        return None
+
+def facets_json(params: Mapping[str, Any], options_map: Dict[str, List[str]],
+                keys: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Ответ /facets: число совпадений по текущим выборам и счётчики вариантов невыбранных категорий."""
+    snap = catalog.snapshot()
+    if snap is None:
+        return None
+    steps = facet_steps(params)
+    keys = keys or [k for k in param2filter if not params.get(k)]
+    return {
+        "version": snap.version,
+        "total": snap.candidates(steps).bit_count(),
+        "facets": {k: snap.option_counts(steps, param2filter[k], options_map[k]) for k in keys},
+    }
+
+# ----------------- РАБОТА С БД -----------------
+# None — ещё не проверяли, применена ли migrations/001_facet_arrays.sql
+_facet_columns: Optional[bool] = None
+_select: Optional[str] = None
+
+def _projection(conn) -> str:
+    global _select
+    if _select is None:
+        _select = projection(conn)
+    return _select
+
+def _use_facet_columns(conn) -> bool:
+    global _facet_columns
+    if _facet_columns is None:
+        _facet_columns = has_facet_columns(conn)
+    return _facet_columns
+
+def _sample_on(conn, filters: Dict[str, Optional[str]], k: int, count: Optional[int]):
+    facet_columns = _use_facet_columns(conn)
+    if count is None:
+        count = count_matches(conn, filters, facet_columns=facet_columns, statements=statements)
+    if not count:
+        return 0, []
+    rows = sample_matches(conn, filters, k, count, facet_columns=facet_columns, select=_projection(conn),
+                          statements=statements)
+    return count, [prepare_item(r) for r in rows]
+
+def sample_db(filters: Dict[str, Optional[str]], k: int, count: Optional[int] = None):
+    """(число совпадений, k случайных строк) — без выгрузки всех совпадений из БД."""
+    with db.connect() as conn, DB_QUERY_SECONDS.labels("sample_db").time():
+        return _sample_on(conn, filters, k, count)
+
+def count_db(filters: Dict[str, Optional[str]], human: str, options: List[str]) -> Dict[str, int]:
+    """Число совпадений для filters + каждый вариант options категории human; уже посчитанные — из result_cache,
+    остальные — одним запросом (queries.count_options)."""
+    counts: Dict[str, int] = {}
+    missing = []
+    for opt in options:
+        count = result_cache.get(cache_key({**filters, human: opt}))
+        if count is None:
+            missing.append(opt)
+        else:
+            counts[opt] = count
+    if missing:
+        with db.connect() as conn, DB_QUERY_SECONDS.labels("count_db").time():
+            facet_columns = _use_facet_columns(conn)
+            # всегда все варианты: одна форма запроса на категорию, а не на каждый набор недостающих
+            found = count_options(conn, filters, human, options, facet_columns=facet_columns, statements=statements)
+        for opt, count in found.items():
+            counts[opt] = count
+            result_cache.put(cache_key({**filters, human: opt}), count)
+    return counts
+
+def sample_rows(filters: Dict[str, Optional[str]], k: int = 3) -> List[Dict[str, Any]]:
+    """k случайных совпадений. Кандидаты (или их число для пути через БД) берутся из кэша по нормализованным фильтрам."""
+    snap = catalog.snapshot()
+    key = cache_key(filters)
+    if snap is None:
+        # без каталога выборку делает БД, а в кэше лежит только число совпадений
+        count, rows = sample_db(filters, k, result_cache.get(key))
+        result_cache.put(key, count)
+        return rows
+
+    candidates = _candidates(snap, filters)
+    selected = candidates if len(candidates) <= k else random.sample(candidates, k)
+    return [snap.rows[i] for i in selected]
+
+def _candidates(snap, filters: Dict[str, Optional[str]]) -> List[int]:
+    key = cache_key(filters)
+    candidates = result_cache.get(key, snap.version)
+    if candidates is None:
+        candidates = snap.match_ids(filters)
+        result_cache.put(key, candidates, snap.version)
+    return candidates
+
+def nearby_rows(filters: Dict[str, Optional[str]], lat: float, lon: float,
+                k: int = 3) -> Optional[List[Tuple[Dict[str, Any], float]]]:
+    """k ближайших к точке мест под фильтры: [(строка, км)]. None — каталог ещё не загружен
+    (координаты есть только в срезе в памяти, в БД за ними не ходим)."""
+    snap = catalog.snapshot()
+    if snap is None:
+        return None
+    return [(snap.rows[i], km) for i, km in snap.nearest(filters, lat, lon, k)]
+
+def search_rows(query: str, k: int = 3) -> Optional[List[Tuple[Dict[str, Any], float]]]:
+    """Полнотекстовый поиск (search.py) по срезу каталога: [(строка, score)] по убыванию.
+    None — каталог ещё не загружен."""
+    snap = catalog.snapshot()
+    if snap is None:
+        return None
+    return [(snap.rows[i], score) for i, score in snap.search.search(query, k)]
+
+# ----------------- ЕЩЁ ВАРИАНТЫ -----------------
+# Колода — перемешанные номера строк среза под фильтры, лежит в сессии:
+#   {"v": версия каталога, "ids": "H<base64 массива>", "at": курсор, "f": фильтры}
+# Каждое «Ещё варианты» берёт следующие k номеров — без повторов и без запроса в БД.
+
+def pack_ids(ids: List[int]) -> str:
+    """Номера строк -> строка для JSON-сессии: тип массива + base64 (2 байта на номер, если влезает)."""
+    packed = array("H" if max(ids, default=0) < 1 << 16 else "I", ids)
+    return packed.typecode + base64.b64encode(packed.tobytes()).decode("ascii")
+
+def unpack_ids(raw: str) -> array:
+    ids = array(raw[0])
+    ids.frombytes(base64.b64decode(raw[1:]))
+    return ids
+
+def new_deck(filters: Dict[str, Optional[str]]) -> Optional[Dict[str, Any]]:
+    """Колода под фильтры. None — каталог ещё не загружен (тогда подбор идёт в БД, листать нечего)."""
+    snap = catalog.snapshot()
+    if snap is None:
+        return None
+    candidates = _candidates(snap, filters)
+    ids = random.sample(candidates, min(len(candidates), MORE_MAX_IDS))
+    return {"v": snap.version, "ids": pack_ids(ids), "at": 0, "f": filters}
+
+def deck_rows(deck: Dict[str, Any], k: int = 3) -> Optional[List[Dict[str, Any]]]:
+    """Следующие k строк колоды, курсор сдвигается. None — колода кончилась
+    или собрана на другой версии каталога (номера строк уже не те)."""
+    snap = catalog.snapshot()
+    ids = unpack_ids(deck["ids"])
+    at = deck["at"]
+    if snap is None or snap.version != deck["v"] or at >= len(ids):
+        return None
+    deck["at"] = at + k
+    return [snap.rows[i] for i in ids[at:at + k]]
+
+def deck_left(deck: Dict[str, Any]) -> int:
+    return max(0, len(unpack_ids(deck["ids"])) - deck["at"])
+
+def generate_ai_reason(item: Dict[str, Any], filters: Dict[str, Optional[str]]) -> str:
+    parts = []
+    if filters.get("Кухня") and filters["Кухня"].lower() in (item.get("Кухня") or "").lower():
+        parts.append(f"здесь готовят отличную {filters['Кухня'].lower()} кухню")
+    if filters.get("Атмосфера") and filters["Атмосфера"].lower() in (item.get("атмосфера") or "").lower():
+        parts.append(f"атмосфера — {filters['Атмосфера'].lower()}")
+    if filters.get("Повод") and filters["Повод"].lower() in (item.get("повод") or "").lower():
+        parts.append(f"идеально подойдёт для: {filters['Повод'].lower()}")
+    if filters.get("Тип заведения") and filters["Тип заведения"].lower() in (item.get("Тип заведения") or "").lower():
+        parts.append(f"формат: {filters['Тип заведения'].lower()}")
+    if filters.get("Бюджет"):
+        parts.append(f"в пределах бюджета: {filters['Бюджет'].lower()}")
+    if parts:
+        return "Это место выбрано, потому что " + ", ".join(parts) + "."
+    return "Это заведение точно стоит посетить — оно выделяется среди других."
+
+def format_card(item: Dict[str, Any], filters: Dict[str, Optional[str]], distance: Optional[str] = None) -> str:
+    # статическая часть посчитана при загрузке каталога (render.prepare_item), на запрос — только причина
+    started = time.perf_counter()
+    head = item.get("_card") or render_card_head(item)
+    if distance:
+        head = f"{head}\n📏 {distance}"
+    card = f"{head}\n\n🤖 {generate_ai_reason(item, filters)}"
+    RENDER_SECONDS.observe(time.perf_counter() - started)
+    return card
+
+def card_json(item: Dict[str, Any], filters: Dict[str, Optional[str]],
+              distance_km: Optional[float] = None) -> Dict[str, Any]:
+    """Карточка в формате ответа /recommend (и /nearby — с distance_km)."""
+    data = {
+        "name": item.get("Название", "Ресторан без названия"),
+        "description": item.get("Описание"),
+        "address": item.get("Адрес"),
+        "metro": item.get("Метро"),
+        "photo": item.get("Фото"),
+        "link": item.get("Ссылка") or item.get("Сайт"),
+        "ai_reason": generate_ai_reason(item, filters),
+    }
+    if distance_km is not None:
+        data["distance_km"] = round(distance_km, 2)
+    return data
+
+# ----------------- АСИНХРОННЫЙ ВХОД -----------------
+async def asample_db(filters: Dict[str, Optional[str]], k: int, count: Optional[int] = None):
+    """sample_db через асинхронный пул (db.get_async_engine) — без потоков."""
+    async with db.get_async_engine().connect() as conn:
+        with DB_QUERY_SECONDS.labels("sample_db_async").time():
+            return await conn.run_sync(_sample_on, filters, k, count)
+
+async def asample_rows(filters: Dict[str, Optional[str]], k: int = 3) -> List[Dict[str, Any]]:
+    """sample_rows для asyncio-кода: из каталога — сразу; в БД — через async-драйвер (ASYNC_DB=1)
+    или в отдельном ограниченном пуле потоков."""
+    if catalog.snapshot() is not None:
+        return sample_rows(filters, k)
+    if ASYNC_DB:
+        key = cache_key(filters)
+        count, rows = await asample_db(filters, k, result_cache.get(key))
+        result_cache.put(key, count)
+        return rows
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, sample_rows, filters, k)
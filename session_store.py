@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional
+
+from sqlalchemy import text
+
+from options import (
+    budget_options, type_options, cuisine_options,
+    atmosphere_options, reason_options
+)
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")   # memory | sql | redis
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 3600)))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# порядок шагов мастера и списки, по которым выбор кодируется индексом
+_CATEGORIES = [
+    ("budget", budget_options),
+    ("type", type_options),
+    ("cuisine", cuisine_options),
+    ("atmosphere", atmosphere_options),
+    ("reason", reason_options),
+]
+_FORMAT_VERSION = "1"
+
+
+# ----------------- СЕРИАЛИЗАЦИЯ -----------------
+def encode_state(state: Dict[str, Any]) -> str:
+    """Компактная строка вместо dict: `1|[страницы..., выборы..., {прочее}]`.
+
+    Выбор из options.py хранится индексом в списке, произвольный текст — как есть.
+    {"page_map": {"budget": 0, ...}, "budget": "До 1000 ₽"} -> `1|[0,0,0,0,0,3,null,null,null,null]`
+    """
+    page_map = state.get("page_map") or {}
+    packed: list = [page_map.get(key, 0) for key, _ in _CATEGORIES]
+    for key, options in _CATEGORIES:
+        value = state.get(key)
+        try:
+            packed.append(options.index(value))
+        except ValueError:
+            packed.append(value)
+    known = {"page_map"} | {key for key, _ in _CATEGORIES}
+    extra = {k: v for k, v in state.items() if k not in known}
+    if extra:
+        packed.append(extra)
+    return _FORMAT_VERSION + "|" + json.dumps(packed, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_state(raw: str) -> Optional[Dict[str, Any]]:
+    version, _, body = raw.partition("|")
+    if version != _FORMAT_VERSION:
+        return None   # старый формат — начнём мастер заново
+    packed = json.loads(body)
+    n = len(_CATEGORIES)
+    state: Dict[str, Any] = {"page_map": {key: packed[i] for i, (key, _) in enumerate(_CATEGORIES)}}
+    for i, (key, options) in enumerate(_CATEGORIES):
+        value = packed[n + i]
+        if isinstance(value, int):
+            state[key] = options[value] if 0 <= value < len(options) else None
+        elif value is not None:
+            state[key] = value
+    if len(packed) > 2 * n:
+        state.update(packed[2 * n])
+    return state
+
+
+# ----------------- БЭКЕНДЫ -----------------
+class SessionStore(ABC):
+    """Состояние мастера по chat_id. get() отдаёт копию: после изменений нужно вызвать set()."""
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def set(self, chat_id: int, state: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def delete(self, chat_id: int):
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    """Прежнее поведение: dict в памяти процесса. Годится только для одного воркера."""
+
+    _SWEEP_EVERY = 1000   # раз в столько записей выкидываем протухшие сессии
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        super().__init__(ttl)
+        self._data: Dict[int, tuple] = {}   # chat_id -> (expires_at, encoded)
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, chat_id):
+        entry = self._data.get(chat_id)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._data.pop(chat_id, None)
+            return None
+        return decode_state(entry[1])
+
+    def set(self, chat_id, state):
+        now = time.time()
+        self._data[chat_id] = (now + self.ttl, encode_state(state))
+        self._writes += 1
+        if self._writes % self._SWEEP_EVERY == 0:
+            with self._lock:
+                for key in [k for k, (exp, _) in list(self._data.items()) if exp < now]:
+                    self._data.pop(key, None)
+
+    def delete(self, chat_id):
+        self._data.pop(chat_id, None)
+
+
+class SQLSessionStore(SessionStore):
+    """Таблица bot_sessions в той же БД (Postgres или SQLite) — общая для всех воркеров и нод."""
+
+    _SWEEP_EVERY = 500
+
+    def __init__(self, engine, ttl: int = SESSION_TTL):
+        super().__init__(ttl)
+        self.engine = engine
+        self._writes = 0
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS bot_sessions (
+                    chat_id    BIGINT PRIMARY KEY,
+                    data       TEXT NOT NULL,
+                    expires_at DOUBLE PRECISION NOT NULL
+                )
+            """))
+
+    def get(self, chat_id):
+        with self.engine.connect() as conn:
+            raw = conn.execute(
+                text("SELECT data FROM bot_sessions WHERE chat_id = :c AND expires_at > :now"),
+                {"c": chat_id, "now": time.time()},
+            ).scalar()
+        return decode_state(raw) if raw else None
+
+    def set(self, chat_id, state):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO bot_sessions (chat_id, data, expires_at) VALUES (:c, :d, :e)
+                ON CONFLICT (chat_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+            """), {"c": chat_id, "d": encode_state(state), "e": now + self.ttl})
+            self._writes += 1
+            if self._writes % self._SWEEP_EVERY == 0:
+                conn.execute(text("DELETE FROM bot_sessions WHERE expires_at <= :now"), {"now": now})
+
+    def delete(self, chat_id):
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM bot_sessions WHERE chat_id = :c"), {"c": chat_id})
+
+
+class RedisSessionStore(SessionStore):
+    """Любой сервер с протоколом Redis (Redis, KeyDB, Valkey, локальная заглушка). TTL — через SET EX.
+
+    client — готовый клиент с get/set(ex=)/delete и decode_responses=True; по умолчанию создаётся по url.
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = SESSION_TTL, prefix: str = "tgm:s:", client=None):
+        super().__init__(ttl)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("SESSION_BACKEND=redis требует пакет redis (pip install -r requirements-redis.txt)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, chat_id):
+        raw = self.client.get(f"{self.prefix}{chat_id}")
+        return decode_state(raw) if raw else None
+
+    def set(self, chat_id, state):
+        self.client.set(f"{self.prefix}{chat_id}", encode_state(state), ex=self.ttl)
+
+    def delete(self, chat_id):
+        self.client.delete(f"{self.prefix}{chat_id}")
+
+
+def make_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sql":
+        from db import engine
+        return SQLSessionStore(engine)
+    if backend == "redis":
+        return RedisSessionStore()
+    raise RuntimeError(f"Unknown SESSION_BACKEND={backend!r} (memory | sql | redis)")
@@ -0,0 +1,176 @@
+"""Реестр SQL-форм подбора (queries.count_matches / sample_matches): каждая форма собирается один раз, в Postgres — PREPARE на соединение.
+
+Форма запроса определяется тем, какие фильтры заданы и как они ищутся
+(точное значение из кнопок или подстрока), а не самими значениями. Таких
+форм конечное число (2^5 наборов фильтров × способ поиска), поэтому SQL,
+text() и порядок параметров хранятся в словаре по ключу формы.
+
+С psycopg2/psycopg форма при первом использовании на соединении
+подготавливается на сервере (`PREPARE tgm_sN(...) AS ...`), дальше идёт
+только `EXECUTE tgm_sN(...)` — без разбора и, после нескольких вызовов,
+с общим (generic) планом. Имена подготовленных форм живут в conn.info,
+то есть вместе с соединением в пуле.
+
+Сервер может потерять подготовленную форму (DISCARD ALL, сброс соединения
+пулером) или отказаться её выполнять после смены схемы («cached plan must not
+change result type», например когда ingest сделал «Метро» массивом). Тогда
+форма готовится заново и EXECUTE повторяется один раз. При подмене среза
+каталога (invalidate) все формы соединения готовятся заново.
+
+    PREPARED_STATEMENTS=1     # 0 — без PREPARE (например, за pgbouncer в transaction mode)
+"""
+import os
+import re
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from queries import known_values
+
+logger = logging.getLogger(__name__)
+
+# ----------------- КОНФИГ -----------------
+PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "1") == "1"
+
+# драйверы, у которых нет своего кэша подготовленных запросов (asyncpg готовит их сам)
+_PREPARE_DRIVERS = {"psycopg2", "psycopg"}
+# :имя, но не приведение типа ::text[]
+_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+
+
+class Shape:
+    __slots__ = ("name", "sql", "clause", "order", "prepare_sql", "uses")
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.clause = text(sql)
+        self.order: List[str] = []
+        for p in _PARAM.findall(sql):
+            if p not in self.order:
+                self.order.append(p)
+        positional = _PARAM.sub(lambda m: f"${self.order.index(m.group(1)) + 1}", sql)
+        types = ", ".join("bigint" if p.startswith("_rn") else "text" for p in self.order)
+        self.prepare_sql = f"PREPARE {name} ({types}) AS {positional}" if self.order else \
+            f"PREPARE {name} AS {positional}"
+        self.uses = 0
+
+
+class StatementRegistry:
+    def __init__(self, prepared: bool = PREPARED_STATEMENTS):
+        self.prepared = prepared
+        self._shapes: Dict[tuple, Shape] = {}
+        self._lock = threading.Lock()
+        self.prepares = 0      # PREPARE на сервере (форма × соединение)
+        self.executions = 0    # EXECUTE подготовленной формы
+        self.plain = 0         # выполнение через text() (SQLite, asyncpg, PREPARED_STATEMENTS=0)
+        self.reprepares = 0    # EXECUTE не прошёл, форма подготовлена заново
+        self.generation = 0    # растёт при invalidate(); формы прошлых поколений готовятся заново
+
+    # ----------------- ФОРМЫ -----------------
+    @staticmethod
+    def shape_key(kind: str, filters: Dict[str, Optional[str]], facet_columns: bool, select: str,
+                  k: int = 0) -> tuple:
+        modes = []
+        for key, value in filters.items():
+            if value:
+                exact = value.strip().lower() in known_values[key]
+                modes.append((key, "=" if exact else "~"))
+        return kind, tuple(modes), facet_columns, select, k
+
+    def _shape(self, key: tuple, build) -> Shape:
+        shape = self._shapes.get(key)
+        if shape is None:
+            with self._lock:
+                shape = self._shapes.get(key)
+                if shape is None:
+                    shape = self._shapes[key] = Shape(f"tgm_s{len(self._shapes)}", build())
+        shape.uses += 1
+        return shape
+
+    def __len__(self):
+        return len(self._shapes)
+
+    # ----------------- ВЫПОЛНЕНИЕ -----------------
+    def execute(self, conn, shape: Shape, params: Dict[str, Any]):
+        if not (self.prepared and conn.dialect.driver in _PREPARE_DRIVERS):
+            self.plain += 1
+            return conn.execute(shape.clause, params)
+        done = self._prepared_on(conn)
+        args = tuple(params[p] for p in shape.order)
+        try:
+            return self._execute_prepared(conn, shape, done, args)
+        except DBAPIError:
+            # на сервере формы нет или её план устарел; запросы реестра только читают,
+            # так что откат прерванной транзакции ничего не теряет
+            conn.rollback()
+            self._deallocate(conn, done, [shape.name])
+            self.reprepares += 1
+            logger.warning("[SQL] %s: EXECUTE failed, preparing again", shape.name, exc_info=True)
+            return self._execute_prepared(conn, shape, done, args)
+
+    def _execute_prepared(self, conn, shape: Shape, done: set, args: tuple):
+        if shape.name not in done:
+            conn.exec_driver_sql(shape.prepare_sql)
+            done.add(shape.name)
+            self.prepares += 1
+        self.executions += 1
+        marks = ", ".join(["%s"] * len(args))
+        return conn.exec_driver_sql(f"EXECUTE {shape.name}({marks})" if args else f"EXECUTE {shape.name}", args)
+
+    def _prepared_on(self, conn) -> set:
+        """Имена форм, подготовленных на этом соединении в текущем поколении."""
+        generation, done = conn.info.get("tgm_prepared", (self.generation, set()))
+        if generation != self.generation:
+            self._deallocate(conn, done, list(done))
+        conn.info["tgm_prepared"] = (self.generation, done)
+        return done
+
+    @staticmethod
+    def _deallocate(conn, done: set, names: List[str]):
+        """DEALLOCATE форм, которые ещё есть на сервере (чужие подготовленные запросы не трогаем)."""
+        for name in names:
+            done.discard(name)
+            exists = conn.exec_driver_sql("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (name,)).first()
+            if exists:
+                conn.exec_driver_sql(f"DEALLOCATE {name}")
+
+    def invalidate(self):
+        """Схема или данные каталога сменились: на каждом соединении формы будут подготовлены заново."""
+        self.generation += 1
+
+    def run(self, conn, kind: str, filters: Dict[str, Optional[str]], facet_columns: bool, select: str,
+            k: int, sql: str, params: Dict[str, Any]):
+        """sql одной из форм (kind + фильтры): text() собирается один раз, в Postgres — PREPARE."""
+        shape = self._shape(self.shape_key(kind, filters, facet_columns, select, k), lambda: sql)
+        return self.execute(conn, shape, params)
+
+    # ----------------- СТАТИСТИКА -----------------
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shapes": len(self._shapes),
+            "prepared": self.prepared,
+            "prepares": self.prepares,
+            "executions": self.executions,
+            "plain": self.plain,
+            "reprepares": self.reprepares,
+            # сколько EXECUTE пришлось на один PREPARE: чем больше, тем меньше разбора на сервере
+            "reuse_ratio": round(self.executions / self.prepares, 2) if self.prepares else 0.0,
+            "top_shapes": sorted(((s.name, s.uses) for s in self._shapes.values()), key=lambda x: -x[1])[:10],
+        }
+
+    @staticmethod
+    def server_plans(conn) -> List[Dict[str, Any]]:
+        """generic/custom планы подготовленных форм на этом соединении (Postgres 14+)."""
+        if conn.dialect.name != "postgresql":
+            return []
+        rows = conn.exec_driver_sql(
+            "SELECT name, generic_plans, custom_plans FROM pg_prepared_statements "
+            "WHERE name LIKE 'tgm\\_s%%' ORDER BY name")
+        return [dict(r) for r in rows.mappings()]
+
+
+statements = StatementRegistry()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# модули читают конфиг из окружения при импорте; тестам нужна только локальная sqlite
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'tg_miniapp_tests.db')}")
+os.environ.setdefault("TELEGRAM_TOKEN", "test")
+os.environ.setdefault("CATALOG_REFRESH_SEC", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
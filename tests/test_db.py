@@ -0,0 +1,39 @@
+"""Ожидание соединения из пула попадает в метрику при любом способе взять соединение."""
+from sqlalchemy import text
+
+import db
+from metrics import DB_CHECKOUT_SECONDS
+from session_store import SQLSessionStore
+
+
+def checkouts() -> float:
+    for line in DB_CHECKOUT_SECONDS.expose():
+        if line.startswith("tgm_db_pool_checkout_seconds_count"):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0   # ещё ни одного замера
+
+
+def test_every_checkout_is_measured():
+    before = checkouts()
+    with db.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT 1"))
+    assert checkouts() == before + 2
+
+
+def test_store_checkouts_are_measured():
+    store = SQLSessionStore(db.engine)
+    before = checkouts()
+    store.set(1, {"budget": None})
+    store.get(1)
+    store.delete(1)
+    assert checkouts() == before + 3
+
+
+def test_checkout_measured_after_dispose():
+    db.engine.dispose()   # новый пул: событие checkout должно остаться на engine
+    before = checkouts()
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert checkouts() == before + 1
@@ -0,0 +1,42 @@
+"""dispatch.py: порядок внутри чата, ограниченные очереди, ошибки в фоне не теряются."""
+import logging
+import threading
+
+from dispatch import ShardedWorkerPool, UpdateDispatcher
+
+
+def test_updates_of_one_chat_run_in_order():
+    seen, lock = {}, threading.Lock()
+
+    def handle(update):
+        with lock:
+            seen.setdefault(update["chat"], []).append(update["n"])
+
+    updates = UpdateDispatcher(handle, workers=4, maxsize=1000)
+    for n in range(200):
+        for chat in (1, 2, 3, 4, 5):
+            assert updates.dispatch(chat, {"chat": chat, "n": n})
+    updates.join()
+    assert seen == {chat: list(range(200)) for chat in (1, 2, 3, 4, 5)}
+
+
+def test_full_queue_rejects_update():
+    release = threading.Event()
+    updates = UpdateDispatcher(lambda u: release.wait(5), workers=1, maxsize=1, put_timeout=0)
+    accepted = [updates.dispatch(7, {"update_id": i}) for i in range(4)]
+    release.set()
+    updates.join()
+    assert accepted[0] and accepted.count(True) <= 2   # одно в работе, одно в очереди
+    assert updates.rejected == accepted.count(False)
+
+
+def test_failing_task_is_logged(caplog):
+    def boom():
+        raise ValueError("nope")
+
+    pool = ShardedWorkerPool(1, "test")
+    with caplog.at_level(logging.ERROR, logger="dispatch"):
+        fut = pool.submit(1, boom)
+        pool.join()
+    assert isinstance(fut.exception(), ValueError)
+    assert any("boom" in r.getMessage() and r.exc_info for r in caplog.records)
@@ -0,0 +1,137 @@
+"""Фильтры одинаково работают в SQL (queries.py) и в срезе каталога в памяти (catalog.py)."""
+import random
+
+import pytest
+from sqlalchemy import event, text
+
+import db
+import service
+from bench.fixtures import COLUMNS, make_row
+from catalog import Catalog, CatalogSnapshot
+from options import budget_options, type_options, cuisine_options, atmosphere_options, reason_options
+from queries import build_filter_query, count_matches, sample_matches
+from statements import StatementRegistry
+
+# ячейки, на которых подстрока и точное значение расходятся
+TRICKY = [
+    {"Тип заведения": "Спортбар", "Кухня": "Итальянская кухня; Европейская кухня"},
+    {"Тип заведения": "Бар", "Кухня": "итальянская кухня,европейская кухня"},
+    {"Тип заведения": "Гастропаб", "Кухня": "  Грузинская кухня ,  Кавказская кухня "},
+    {"Тип заведения": "Пивной ресторан, Бар", "Кухня": "Паназиатская кухня"},
+    {"Тип заведения": "Кулинарная студия", "Кухня": "nan"},
+    {"Тип заведения": "Винотека", "Кухня": None},
+    # бюджет — одно значение на ячейку: сравнивается вся ячейка без пробелов по краям
+    {"Бюджет": "  До 1000 ₽ "},
+    {"Бюджет": "до 1000 ₽"},
+    {"Бюджет": "До 1000 ₽, 1000–3000 ₽"},
+    {"Бюджет": "1000–3000 ₽;"},
+]
+
+FILTERS = (
+    [{"Бюджет": o} for o in budget_options]
+    + [{"Тип заведения": o} for o in type_options]
+    + [{"Кухня": o} for o in cuisine_options]
+    + [{"Атмосфера": o} for o in atmosphere_options]
+    + [{"Повод": o} for o in reason_options]
+    + [
+        {"Бюджет": budget_options[0], "Кухня": cuisine_options[1]},
+        {"Тип заведения": "Бар", "Кухня": "Итальянская кухня"},
+        {"Тип заведения": "БАР "},
+        # свободный текст — подстрока
+        {"Тип заведения": "бар"[:2]},
+        {"Кухня": "итальян"},
+        {"Кухня": "кухня"},
+        {"Кухня": "кухня, евро"},
+        {"Атмосфера": "романт", "Повод": "ужин"},
+        {"Кухня": "несуществующая"},
+        {},
+    ]
+)
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    rnd = random.Random(3)
+    rows = [dict(zip(COLUMNS, make_row(i, rnd))) for i in range(400)]
+    for i, cells in enumerate(TRICKY):
+        rows.append({**dict(zip(COLUMNS, make_row(1000 + i, rnd))), **cells})
+    cols = ", ".join(f'"{c}" TEXT' for c in COLUMNS)
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS restaurants_v2"))
+        conn.execute(text(f"CREATE TABLE restaurants_v2 ({cols})"))
+        conn.execute(text(f"INSERT INTO restaurants_v2 VALUES ({', '.join(f':c{i}' for i in range(len(COLUMNS)))})"),
+                     [{f"c{i}": row[c] for i, c in enumerate(COLUMNS)} for row in rows])
+        # facet_budget из migrations/001_facet_arrays.sql (там — GENERATED ALWAYS AS)
+        conn.execute(text("ALTER TABLE restaurants_v2 ADD COLUMN facet_budget TEXT"))
+        conn.execute(text('UPDATE restaurants_v2 SET facet_budget = lower(trim("Бюджет"))'))
+    return CatalogSnapshot(Catalog()._load_rows(), 1)
+
+
+def sql_names(filters, facet_columns=False):
+    query, params = build_filter_query(filters, facet_columns=facet_columns, select='"Название"')
+    with db.connect() as conn:
+        return sorted(conn.execute(text(query), params).scalars())
+
+
+@pytest.mark.parametrize("filters", FILTERS, ids=lambda f: ",".join(f"{k}={v}" for k, v in f.items()) or "all")
+def test_sql_and_snapshot_match_same_rows(snapshot, filters):
+    in_memory = sorted(snapshot.rows[i]["Название"] for i in snapshot.match_ids(filters))
+    assert in_memory == sql_names(filters)
+
+
+@pytest.mark.parametrize("filters", [{"Бюджет": o} for o in budget_options] + [
+    {"Бюджет": budget_options[3], "Кухня": "итальян"},
+    {"Бюджет": "1000–3000"},
+], ids=lambda f: ",".join(f"{k}={v}" for k, v in f.items()))
+def test_facet_budget_column_matches_same_rows(snapshot, filters):
+    # остальные facet_* — массивы Postgres (@>), в SQLite есть только facet_budget
+    in_memory = sorted(snapshot.rows[i]["Название"] for i in snapshot.match_ids(filters))
+    assert sql_names(filters, facet_columns=True) == in_memory == sql_names(filters)
+
+
+def test_budget_matches_whole_cell(snapshot):
+    names = sql_names({"Бюджет": "До 1000 ₽"})
+    assert "Место 1006" in names and "Место 1007" in names
+    assert "Место 1008" not in names and "Место 1009" not in sql_names({"Бюджет": "1000–3000 ₽"})
+
+
+def test_option_matches_whole_value(snapshot):
+    names = sql_names({"Тип заведения": "Бар"})
+    assert "Место 1001" in names and "Место 1003" in names
+    assert "Место 1000" not in names   # Спортбар
+    assert "Место 1004" not in sql_names({"Тип заведения": "Кулинария"})   # Кулинарная студия
+
+
+@pytest.mark.parametrize("statements", [None, StatementRegistry()], ids=["text", "registry"])
+def test_sample_matches_draws_from_matches(snapshot, statements):
+    filters = {"Тип заведения": "Бар"}
+    with db.connect() as conn:
+        count = count_matches(conn, filters, statements=statements)
+        assert count == len(sql_names(filters))
+        for k in (3, count + 1):
+            rows = sample_matches(conn, filters, k, count, select='"Название"', statements=statements)
+            names = [r["Название"] for r in rows]
+            assert len(names) == min(k, count) and len(set(names)) == len(names)
+            assert set(names) <= set(sql_names(filters))
+    if statements is not None:
+        assert len(statements) == 3 and statements.plain == 3   # count, sample k=3, select всех
+
+
+@pytest.mark.parametrize("steps", [(), (("Бюджет", budget_options[0].lower()),), (("Тип заведения", "бар"),)],
+                         ids=["none", "budget", "type"])
+def test_db_counts_match_snapshot(snapshot, steps):
+    service.result_cache.invalidate()
+    queries = []
+    listener = lambda *args: queries.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        for human, options in (("Кухня", cuisine_options), ("Повод", reason_options)):
+            del queries[:]
+            assert service.count_db(dict(steps), human, options) == snapshot.option_counts(steps, human, options)
+            assert len([q for q in queries if "restaurants_v2" in q]) == 1   # одна клавиатура — один запрос
+            # посчитанное ложится в result_cache — следующая клавиатура обойдётся без запросов
+            assert service.result_cache.get(service.cache_key({**dict(steps), human: options[0]})) is not None
+            service.count_db(dict(steps), human, options)
+            assert len([q for q in queries if "restaurants_v2" in q]) == 1
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
@@ -0,0 +1,103 @@
+"""photo_health.py против локального HTTP-сервера: 200, 404 и зависший ответ."""
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import photo_health
+
+TIMEOUT = 0.5
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, body: bool):
+        if self.path == "/slow.jpg":
+            time.sleep(TIMEOUT * 4)
+        if self.path == "/ok.jpg":
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", "10")
+            self.end_headers()
+            if body:
+                self.wfile.write(b"0123456789")
+            return
+        self.send_response(404)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._reply(body=False)
+
+    def do_GET(self):
+        self._reply(body=True)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def engine(tmp_path, server):
+    engine = create_engine(f"sqlite:///{tmp_path / 'photos.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE restaurants_v2 ("Название" TEXT, "Фото" TEXT)'))
+        conn.execute(text('INSERT INTO restaurants_v2 VALUES (:n, :u)'), [
+            {"n": "Хорошее", "u": f"{server}/ok.jpg"},
+            {"n": "Пропавшее", "u": f"{server}/missing.jpg"},
+            {"n": "Медленное", "u": f"{server}/slow.jpg"},
+            {"n": "Без фото", "u": "nan"},
+        ])
+    return engine
+
+
+def test_check_records_status_per_url(engine, server):
+    stats = photo_health.run_check(engine, workers=4, timeout=TIMEOUT, max_age=0)
+    assert stats == {"urls": 3, "checked": 3, "broken": 1, "unknown": 1}
+
+    with engine.connect() as conn:
+        rows = {r.url: r for r in conn.execute(text("SELECT * FROM photo_health"))}
+    ok = rows[f"{server}/ok.jpg"]
+    assert (bool(ok.ok), ok.status, ok.content_type, ok.size, ok.error) == (True, 200, "image/jpeg", 10, None)
+    missing = rows[f"{server}/missing.jpg"]
+    assert (bool(missing.ok), missing.status, missing.error) == (False, 404, "http 404")
+    slow = rows[f"{server}/slow.jpg"]
+    assert (slow.status, slow.error) == (None, "ReadTimeout")   # ответа нет — не известно, битое ли
+
+
+def test_report_lists_broken_with_restaurant(engine, server):
+    photo_health.run_check(engine, workers=4, timeout=TIMEOUT, max_age=0)
+    report = photo_health.broken(engine)
+    assert [(r["restaurant"], r["error"]) for r in report] == [("Пропавшее", "http 404")]
+
+    health = photo_health.PhotoHealth(engine)
+    health.reload()
+    assert health.bad == {f"{server}/missing.jpg"}
+    assert health.is_bad(f"{server}/missing.jpg") and not health.is_bad(f"{server}/ok.jpg")
+    # таймаут не делает фото битым: бот отправит его как обычно
+    assert not health.is_bad(f"{server}/slow.jpg")
+
+
+def test_fresh_results_are_not_rechecked_unless_unanswered(engine):
+    photo_health.run_check(engine, workers=4, timeout=TIMEOUT, max_age=0)
+    again = photo_health.run_check(engine, workers=4, timeout=TIMEOUT, max_age=3600)
+    assert (again["checked"], again["unknown"]) == (1, 1)   # только зависший URL
+
+
+def test_construction_does_not_touch_database(tmp_path):
+    health = photo_health.PhotoHealth(create_engine(f"sqlite:///{tmp_path / 'missing' / 'x.db'}"))
+    with pytest.raises(OperationalError):
+        health.reload()
+    assert health.bad == frozenset()
@@ -0,0 +1,89 @@
+"""resolver.py: каждый вариант каждого списка options.py и его разговорные формы."""
+import pytest
+
+from options import budget_options, type_options, cuisine_options, atmosphere_options, reason_options
+from resolver import SYNONYMS, make_resolvers
+
+LISTS = {
+    "budget": budget_options,
+    "type": type_options,
+    "cuisine": cuisine_options,
+    "atmosphere": atmosphere_options,
+    "reason": reason_options,
+}
+resolvers = make_resolvers(LISTS)
+
+ALL_OPTIONS = [(key, opt) for key, options in LISTS.items() for opt in options]
+ALL_SYNONYMS = [(key, alias, opt) for key, aliases in SYNONYMS.items() for alias, opt in aliases.items()]
+
+
+@pytest.mark.parametrize("key,option", ALL_OPTIONS)
+def test_option_resolves_to_itself(key, option):
+    for variant in (option, option.lower(), option.upper(), f"  {option} ", option.replace("е", "ё")):
+        assert resolvers[key].resolve(variant) == option
+
+
+@pytest.mark.parametrize("key,alias,option", ALL_SYNONYMS)
+def test_synonym(key, alias, option):
+    assert option in LISTS[key], f"синоним {alias!r} ведёт в несуществующий вариант"
+    assert resolvers[key].resolve(alias) == option
+
+
+@pytest.mark.parametrize("option", cuisine_options)
+def test_cuisine_word_forms(option):
+    adjective = option.split()[0]
+    stem = adjective.lower()[:-2]
+    assert resolvers["cuisine"].resolve(adjective) == option               # «грузинская»
+    assert resolvers["cuisine"].resolve(stem + "ую кухню") == option       # «грузинскую кухню»
+    assert resolvers["cuisine"].resolve(stem + "ой") == option             # «грузинской»
+
+
+@pytest.mark.parametrize("key,value,expected", [
+    # основы слов
+    ("atmosphere", "уютно", "Уютно и по-домашнему"),
+    ("type", "ресторан", "Ресторан"),
+    ("budget", "до 1000", "До 1000 ₽"),
+    ("reason", "ужин вдвоём", "Ужин вдвоем"),
+    # разговорные формы
+    ("cuisine", "итальянка", "Итальянская кухня"),
+    ("type", "кофейни", "Кофейня"),
+    # начало слова
+    ("cuisine", "груз", "Грузинская кухня"),
+    ("cuisine", "итальян", "Итальянская кухня"),
+    # опечатки
+    ("cuisine", "грузинкая", "Грузинская кухня"),
+    ("cuisine", "итальянска кухня", "Итальянская кухня"),
+    # неоднозначно или не из списка
+    ("reason", "встреча", None),
+    ("cuisine", "несуществующее", None),
+    ("cuisine", "", None),
+])
+def test_resolve(key, value, expected):
+    assert resolvers[key].resolve(value) == expected
+
+
+@pytest.mark.parametrize("key", list(LISTS))
+def test_prefixes_of_every_option(key):
+    """Недописанное первое слово («грузин», «кофей») находит свой вариант, если другого с таким началом нет."""
+    resolver = resolvers[key]
+    for option in LISTS[key]:
+        word = option.lower().split()[0]
+        if len(word) < 7 or not word.isalpha():
+            continue
+        prefix = word[:-3]
+        owners = {o for o in LISTS[key] if any(w.startswith(prefix) for w in o.lower().split())}
+        if owners == {option}:
+            assert resolver.resolve(prefix) == option, prefix
+
+
+@pytest.mark.parametrize("key,option", [(k, o) for k, o in ALL_OPTIONS if len(o) >= 8])
+def test_single_typo(key, option):
+    """Одна пропущенная буква в середине длинного варианта — всё ещё тот же вариант."""
+    i = len(option) // 2
+    typo = option[:i] + option[i + 1:]
+    assert resolvers[key].resolve(typo) == option
+
+
+def test_normalize_keeps_unknown_text():
+    assert resolvers["cuisine"].normalize("марсианская") == "марсианская"
+    assert resolvers["cuisine"].normalize(None) is None
@@ -0,0 +1,104 @@
+"""Бэкенды сессий мастера: общий контракт get/set/delete и Redis на поддельном клиенте."""
+import time
+
+import pytest
+
+import db
+from options import budget_options, cuisine_options
+from session_store import (
+    SessionStore, MemorySessionStore, SQLSessionStore, RedisSessionStore, encode_state, decode_state,
+)
+
+STATE = {
+    "page_map": {"budget": 0, "type": 1, "cuisine": 2, "atmosphere": 0, "reason": 0},
+    "budget": budget_options[1],
+    "cuisine": "что-то своё",
+    "deck": "AAEC",
+}
+
+
+class FakeRedis:
+    """get / set(ex=) / delete с истечением по времени — столько, сколько нужно RedisSessionStore."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def set(self, key, value, ex=None):
+        assert isinstance(value, str)
+        self.data[key] = (time.time() + ex if ex else float("inf"), value)
+        self.ttls[key] = ex
+        return True
+
+    def delete(self, key):
+        return int(self.data.pop(key, None) is not None)
+
+
+def test_state_roundtrip():
+    raw = encode_state({**STATE, "cuisine": cuisine_options[0]})
+    assert raw.startswith("1|")
+    assert decode_state(raw) == {**STATE, "cuisine": cuisine_options[0]}
+    assert decode_state("0|[]") is None
+
+
+def test_store_without_overrides_fails_on_construction():
+    class Partial(SessionStore):
+        def get(self, chat_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.fixture(params=["memory", "sql", "redis"])
+def store(request):
+    if request.param == "memory":
+        return MemorySessionStore(ttl=60)
+    if request.param == "sql":
+        return SQLSessionStore(db.engine, ttl=60)
+    return RedisSessionStore(ttl=60, client=FakeRedis())
+
+
+def test_get_set_delete(store):
+    assert store.get(42) is None
+    store.set(42, STATE)
+    assert store.get(42) == STATE
+    got = store.get(42)
+    got["budget"] = None
+    assert store.get(42) == STATE   # get() отдаёт копию
+    store.delete(42)
+    assert store.get(42) is None
+
+
+def test_expired_session_is_gone(store):
+    store.ttl = -1
+    store.set(7, STATE)
+    assert store.get(7) is None
+
+
+def test_redis_keys_and_ttl():
+    client = FakeRedis()
+    store = RedisSessionStore(ttl=120, prefix="t:", client=client)
+    store.set(5, STATE)
+    assert list(client.data) == ["t:5"] and client.ttls["t:5"] == 120
+    assert decode_state(client.data["t:5"][1]) == STATE
+
+
+def test_redis_without_package_is_reported(monkeypatch):
+    import builtins
+    real_import = builtins.__import__
+
+    def no_redis(name, *args, **kwargs):
+        if name == "redis":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", no_redis)
+    with pytest.raises(RuntimeError, match="requirements-redis.txt"):
+        RedisSessionStore()
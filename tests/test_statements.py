@@ -0,0 +1,99 @@
+"""Подготовленные формы: повторный PREPARE, когда сервер потерял форму или сменилась схема."""
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from statements import StatementRegistry
+
+
+class FakeServer:
+    """Соединение psycopg2 глазами реестра: exec_driver_sql + подготовленные формы сервера."""
+
+    def __init__(self):
+        self.info = {}
+        self.dialect = type("Dialect", (), {"driver": "psycopg2"})()
+        self.prepared = {}         # имя -> SQL
+        self.stale = set()         # формы, чей план сервер больше не выполняет
+        self.log = []
+        self.rollbacks = 0
+
+    def exec_driver_sql(self, sql, args=()):
+        self.log.append(sql.split()[0])
+        if sql.startswith("PREPARE"):
+            name = sql.split()[1]
+            assert name not in self.prepared, f"prepared statement {name} already exists"
+            self.prepared[name] = sql
+        elif sql.startswith("EXECUTE"):
+            name = sql.split()[1].split("(")[0]
+            if name not in self.prepared or name in self.stale:
+                raise DBAPIError(sql, args, Exception(f"prepared statement {name} is unusable"))
+            return args
+        elif sql.startswith("DEALLOCATE"):
+            self.prepared.pop(sql.split()[1])
+            self.stale.discard(sql.split()[1])
+        elif sql.startswith("SELECT 1 FROM pg_prepared_statements"):
+            return Result(1 if args[0] in self.prepared else None)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class Result:
+    def __init__(self, value):
+        self.value = value
+
+    def first(self):
+        return (self.value,) if self.value else None
+
+
+@pytest.fixture
+def registry():
+    return StatementRegistry(prepared=True)
+
+
+def run(registry, conn, value="До 1000 ₽"):
+    return registry.run(conn, "count", {"Бюджет": value}, False, "COUNT(*)", 0,
+                        'SELECT COUNT(*) FROM restaurants_v2 WHERE "Бюджет" = :Бюджет', {"Бюджет": value})
+
+
+def test_prepare_once_then_execute(registry):
+    conn = FakeServer()
+    assert run(registry, conn) == ("До 1000 ₽",)
+    run(registry, conn)
+    assert conn.log == ["PREPARE", "EXECUTE", "EXECUTE"]
+    assert (registry.prepares, registry.executions, registry.reprepares) == (1, 2, 0)
+
+
+def test_lost_statement_is_prepared_again(registry):
+    conn = FakeServer()
+    run(registry, conn)
+    conn.prepared.clear()          # DISCARD ALL на сервере
+    assert run(registry, conn) == ("До 1000 ₽",)
+    assert registry.reprepares == 1 and conn.rollbacks == 1
+    assert run(registry, conn) == ("До 1000 ₽",)   # дальше — снова обычный EXECUTE
+    assert conn.log[-1] == "EXECUTE" and registry.reprepares == 1
+
+
+def test_stale_plan_is_deallocated_and_prepared_again(registry):
+    conn = FakeServer()
+    run(registry, conn)
+    conn.stale.add("tgm_s0")       # cached plan must not change result type
+    assert run(registry, conn) == ("До 1000 ₽",)
+    assert conn.log[-4:] == ["SELECT", "DEALLOCATE", "PREPARE", "EXECUTE"]
+
+
+def test_second_failure_is_raised(registry):
+    conn = FakeServer()
+    conn.exec_driver_sql = lambda sql, args=(): (_ for _ in ()).throw(DBAPIError(sql, args, Exception("down")))
+    with pytest.raises(DBAPIError):
+        run(registry, conn)
+
+
+def test_invalidate_prepares_again_on_every_connection(registry):
+    first, second = FakeServer(), FakeServer()
+    run(registry, first)
+    run(registry, second)
+    registry.invalidate()
+    for conn in (first, second):
+        run(registry, conn)
+        assert conn.log[-4:] == ["SELECT", "DEALLOCATE", "PREPARE", "EXECUTE"]
+    assert registry.reprepares == 0 and registry.prepares == 4